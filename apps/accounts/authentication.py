@@ -0,0 +1,99 @@
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+logger = logging.getLogger(__name__)
+
+
+# Só o que a autenticação e as permissões usam; o hash da senha nunca vai para o cache
+CACHED_USER_FIELDS = ("id", "username", "email", "is_active", "is_staff", "is_superuser")
+
+
+def _user_cache_key(user_id) -> str:
+    # "v2": as entradas antigas guardavam o User inteiro
+    return f"accounts:user:v2:{user_id}"
+
+
+def _user_from_cache(data: dict):
+    # Instância com os demais campos adiados: se algum código ler, o Django o carrega do banco
+    User = get_user_model()
+    # from_db espera os valores na ordem dos campos do model
+    fields = [f.attname for f in User._meta.concrete_fields if f.attname in data]
+    user = User.from_db(User.objects.db, fields, [data[f] for f in fields])
+    user._password_md5 = data.get("password_md5")
+    return user
+
+
+def get_cached_user(user_id):
+    """Busca o usuário no cache (TTL curto) e só vai ao banco em caso de falta."""
+    key = _user_cache_key(user_id)
+    try:
+        data = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Cache indisponível ao buscar usuário: {e}")
+        data = None
+
+    if data is not None:
+        return _user_from_cache(data)
+
+    User = get_user_model()
+    try:
+        user = User.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+    except User.DoesNotExist:
+        return None
+
+    data = {f: getattr(user, f) for f in CACHED_USER_FIELDS}
+    if api_settings.CHECK_REVOKE_TOKEN:
+        # O mesmo valor que já viaja no token, não o hash
+        data["password_md5"] = get_md5_hash_password(user.password)
+    try:
+        cache.set(key, data, settings.USER_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Cache indisponível ao salvar usuário: {e}")
+    return user
+
+
+def invalidate_cached_user(user_id):
+    try:
+        cache.delete(_user_cache_key(user_id))
+    except Exception as e:
+        logger.warning(f"Cache indisponível ao invalidar usuário: {e}")
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication que carrega o usuário pelo cache em vez de consultar o MySQL
+    a cada requisição. O cache é invalidado quando o usuário é salvo ou removido.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(
+                _("Token contained no recognizable user identification")
+            ) from e
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            password_md5 = getattr(user, "_password_md5", None) or get_md5_hash_password(user.password)
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_md5:
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+
+        return user
@@ -0,0 +1,83 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps.accounts.authentication import CachedJWTAuthentication, invalidate_cached_user
+from apps.accounts.views import jwt_create_custom
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a vazão do login e da autenticação JWT por requisição, comparando a "
+        "autenticação padrão (um SELECT por requisição) com a CachedJWTAuthentication."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requisições autenticadas por backend')
+        parser.add_argument('--logins', type=int, default=20, help='Logins (cada um faz o hash da senha)')
+        parser.add_argument('--users', type=int, default=0, help='Usuários extras para simular uma tabela auth_user populada')
+
+    def handle(self, *args, **options):
+        prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        password = 'Bench@123'
+        user = User.objects.create_user(username=prefix, email=f'{prefix}@bench.local', password=password)
+
+        if options['users']:
+            hashed = make_password(password)
+            User.objects.bulk_create(
+                [
+                    User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@bench.local', password=hashed)
+                    for i in range(options['users'])
+                ],
+                batch_size=1000,
+            )
+
+        try:
+            self._bench_login(user.email, password, options['logins'])
+            self._bench_authentication(user, options['requests'])
+        finally:
+            User.objects.filter(username__startswith=prefix).delete()
+
+    def _report(self, label, count, elapsed, queries):
+        self.stdout.write(
+            f"{label:<32} {count / elapsed:>10.1f} req/s  "
+            f"{elapsed / count * 1000:>8.3f} ms/req  {queries / count:>5.2f} queries/req"
+        )
+
+    def _bench_login(self, email, password, count):
+        factory = APIRequestFactory()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(count):
+                request = factory.post('/api/auth/jwt/create/', {'email': email, 'password': password})
+                response = jwt_create_custom(request)
+                assert response.status_code == 200, response.data
+            elapsed = time.perf_counter() - start
+        self._report('login', count, elapsed, len(queries))
+
+    def _bench_authentication(self, user, count):
+        token = str(RefreshToken.for_user(user).access_token)
+        request = APIRequestFactory().get('/api/knowledge/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        for label, backend in (
+            ('JWTAuthentication', JWTAuthentication()),
+            ('CachedJWTAuthentication', CachedJWTAuthentication()),
+        ):
+            invalidate_cached_user(user.pk)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for _ in range(count):
+                    backend.authenticate(request)
+                elapsed = time.perf_counter() - start
+            self._report(label, count, elapsed, len(queries))
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+EMAIL_INDEX = models.Index(fields=['email'], name='auth_user_email_idx')
+
+
+def add_email_index(apps, schema_editor):
+    # auth_user.email não é único nem indexado; o login busca o usuário por email
+    User = apps.get_model('auth', 'User')
+    schema_editor.add_index(User, EMAIL_INDEX)
+
+
+def remove_email_index(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    schema_editor.remove_index(User, EMAIL_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_email_index, remove_email_index),
+    ]
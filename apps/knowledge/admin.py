@@ -1,18 +1,70 @@
 from django.contrib import admin
-from .models import Knowledge, Message
+from django.db import connection
+from .models import IngestionJob, Knowledge, Message, UsageRollup
+from .usage import daily_summary, summarize
 
 class KnowledgeAdmin(admin.ModelAdmin):
     list_display = ['user', 'title', 'created_at', 'updated_at']
-    list_filter = ['user', 'created_at', 'updated_at']
-    search_fields = ['user', 'title']
+    # Sem filtro por usuário: a lista de filtros carregaria todos os usuários
+    list_filter = ['created_at', 'updated_at']
+    search_fields = ['=user__username', 'title']
+    list_select_related = ['user']
     ordering = ['-created_at']
 
 admin.site.register(Knowledge, KnowledgeAdmin)
 
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ['user', 'content', 'author', 'created_at', 'updated_at']
-    list_filter = ['user', 'author', 'created_at', 'updated_at']
-    search_fields = ['user', 'content']
+    list_display = ['user', 'content', 'author', 'status', 'latency_ms', 'created_at']
+    # Sem filtro por usuário: a lista de filtros carregaria todos os usuários
+    list_filter = ['author', 'status', 'cache_hit', 'no_documents', 'created_at']
+    list_select_related = ['user']
+    # Evita um COUNT(*) na tabela inteira a cada busca
+    show_full_result_count = False
     ordering = ['-created_at']
 
-admin.site.register(Message, MessageAdmin)
\ No newline at end of file
+    def get_search_fields(self, request):
+        # Só campos indexados: o conteúdo usa o índice FULLTEXT do MySQL em vez de LIKE '%...%'
+        if connection.vendor == 'mysql':
+            return ['=user__username', '@content']
+        return ['=user__username']
+
+admin.site.register(Message, MessageAdmin)
+
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['user', 'status', 'total', 'processed', 'failed', 'created_at', 'updated_at']
+    list_filter = ['status', 'created_at']
+    ordering = ['-created_at']
+
+admin.site.register(IngestionJob, IngestionJobAdmin)
+
+class UsageRollupAdmin(admin.ModelAdmin):
+    """Painel de uso: lê só os agregados diários, nunca a tabela de mensagens."""
+    change_list_template = 'admin/knowledge/usagerollup/change_list.html'
+    list_display = ['date', 'user', 'questions', 'answers', 'failed', 'cache_hits', 'no_documents', 'avg_latency_ms', 'prompt_tokens', 'completion_tokens']
+    list_filter = ['date']
+    date_hierarchy = 'date'
+    search_fields = ['=user__username']
+    list_select_related = ['user']
+    ordering = ['-date']
+
+    @admin.display(description='Avg latency (ms)')
+    def avg_latency_ms(self, obj):
+        return round(obj.latency_ms / obj.answers) if obj.answers else None
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context=extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None:
+            # Totais do período filtrado (data, usuário) e a série diária
+            queryset = changelist.get_queryset(request)
+            response.context_data['summary'] = summarize(queryset)
+            response.context_data['daily'] = daily_summary(queryset)
+        return response
+
+admin.site.register(UsageRollup, UsageRollupAdmin)
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class KnowledgeConfig(AppConfig):
     name = 'apps.knowledge'
+
+    def ready(self):
+        from django.db.models import TextField
+
+        from . import signals  # noqa: F401
+        from .lookups import FullTextSearch
+
+        TextField.register_lookup(FullTextSearch)
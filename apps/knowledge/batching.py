@@ -0,0 +1,111 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Agrupa chamadas concorrentes em lotes.
+
+    Cada chamada a `submit` enfileira um item e devolve um Future. Uma thread de
+    despacho junta os itens que chegam dentro de `max_wait_ms` (até
+    `max_batch_size`) e chama `fn` uma única vez com a lista de itens; `fn` deve
+    devolver uma lista de resultados na mesma ordem.
+
+    `stats()` expõe contadores do processo: distribuição do tamanho dos lotes e a
+    latência adicionada pela fila (tempo entre o `submit` e o despacho do lote).
+    """
+
+    def __init__(self, fn, max_batch_size: int = 32, max_wait_ms: float = 5.0, executor=None, name: str = "batcher"):
+        self._fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._executor = executor
+        self._name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._ensure_started()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def run(self, item):
+        return self.submit(item).result()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=self._name, daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            self._record(batch)
+            if self._executor is not None:
+                self._executor.submit(self._dispatch, batch)
+            else:
+                self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        items = [item for item, _, _ in batch]
+        try:
+            results = self._fn(items)
+        except Exception as e:
+            logger.error(f"Erro ao processar lote de {len(items)} itens: {e}", exc_info=True)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def _record(self, batch):
+        now = time.monotonic()
+        waits = [now - enqueued_at for _, _, enqueued_at in batch]
+        with self._stats_lock:
+            self._batch_sizes[len(batch)] += 1
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, max(waits))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            items = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                "batches": batches,
+                "items": items,
+                "avg_batch_size": round(items / batches, 2) if batches else 0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "avg_queue_wait_ms": round(self._wait_total / items * 1000, 3) if items else 0,
+                "max_queue_wait_ms": round(self._wait_max * 1000, 3),
+            }
@@ -0,0 +1,92 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q, Sum
+
+from .models import Knowledge
+
+
+logger = logging.getLogger(__name__)
+
+NO_ANSWER_MESSAGE = (
+    "Desculpe, não encontrei informações relevantes para responder "
+    "sua pergunta nos documentos disponíveis."
+)
+
+
+def _corpus_cache_key(user_id) -> str:
+    # "v2": descritores antigos não têm hidden_chunk_versions
+    return f"knowledge:corpus:v2:{user_id}"
+
+
+def build_corpus(user_id) -> dict:
+    """
+    Descritor do corpus do usuário calculado a partir do banco: número de documentos,
+    de chunks, versão (instante da última ingestão, atualização ou remoção), títulos
+    e as versões de chunks escondidas por trocas de PDF em andamento.
+    """
+    knowledge = Knowledge.objects.filter(user_id=user_id)
+    active = knowledge.filter(is_deleted=False)
+
+    totals = active.aggregate(
+        documents=Count('id'),
+        chunks=Sum('chunk_count'),
+        uncounted=Count('id', filter=Q(chunk_count__isnull=True)),
+    )
+    # Inclui os removidos: o soft delete também atualiza o updated_at
+    last_change = knowledge.aggregate(last_change=Max('updated_at'))['last_change']
+
+    return {
+        "documents": totals["documents"],
+        # None quando algum documento não tem a contagem de chunks
+        "chunks": None if totals["uncounted"] else (totals["chunks"] or 0),
+        "version": int(last_change.timestamp() * 1_000_000) if last_change else 0,
+        "titles": list(active.order_by('created_at').values_list('title', flat=True)),
+        "hidden_chunk_versions": sorted(
+            version
+            for pair in knowledge.exclude(pending_chunk_version='', retired_chunk_version='')
+            .values_list('pending_chunk_version', 'retired_chunk_version')
+            for version in pair
+            if version
+        ),
+    }
+
+
+def get_corpus(user_id) -> dict:
+    """Descritor do corpus do usuário, lido do cache e recalculado em caso de falta."""
+    key = _corpus_cache_key(user_id)
+    try:
+        corpus = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Cache indisponível ao buscar corpus: {e}")
+        corpus = None
+
+    if corpus is not None:
+        return corpus
+
+    corpus = build_corpus(user_id)
+    try:
+        cache.set(key, corpus, settings.CORPUS_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Cache indisponível ao salvar corpus: {e}")
+    return corpus
+
+
+def invalidate_corpus(user_id):
+    try:
+        cache.delete(_corpus_cache_key(user_id))
+    except Exception as e:
+        logger.warning(f"Cache indisponível ao invalidar corpus: {e}")
+
+
+def get_corpus_version(user_id) -> str:
+    """
+    Chave de versão do corpus para outros caches (respostas, buscas): muda sempre
+    que um documento do usuário é ingerido, atualizado ou removido.
+    """
+    return f"{user_id}:{get_corpus(user_id)['version']}"
+
+
+def is_empty(corpus: dict) -> bool:
+    return corpus["documents"] == 0 or corpus["chunks"] == 0
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+from decouple import config
+from django.conf import settings
+from django.utils.text import slugify
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.embeddings.openai.base import get_embeddings
+from pydantic import Field, PrivateAttr
+
+from .batching import MicroBatcher
+from .openai_client import RateLimitedOpenAIEmbedding, estimate_tokens
+
+
+logger = logging.getLogger(__name__)
+
+# Assinatura do modelo usado pela coleção original; coleções desse modelo mantêm o nome base
+DEFAULT_EMBEDDING_SIGNATURE = "openai-text-embedding-3-small"
+
+_embed_models = {}
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """
+    Embeddings locais a partir de um modelo sentence-transformers exportado para ONNX.
+
+    Consultas isoladas passam por um MicroBatcher, que agrupa pedidos concorrentes
+    em um único `session.run`; lotes de ingestão vão direto para o pool de threads.
+    """
+
+    model_path: str = Field(description="Caminho do arquivo .onnx")
+    tokenizer_path: str = Field(description="Caminho do tokenizer.json")
+    max_length: int = Field(default=256)
+
+    _session = PrivateAttr()
+    _tokenizer = PrivateAttr()
+    _input_names = PrivateAttr()
+    _executor = PrivateAttr()
+    _batcher = PrivateAttr()
+
+    def __init__(
+        self,
+        model_path: str,
+        tokenizer_path: str,
+        model_name: str = "onnx",
+        max_length: int = 256,
+        embed_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        num_threads: int = 4,
+        num_workers: int = 2,
+        **kwargs,
+    ):
+        super().__init__(
+            model_name=model_name,
+            model_path=model_path,
+            tokenizer_path=tokenizer_path,
+            max_length=max_length,
+            embed_batch_size=embed_batch_size,
+            **kwargs,
+        )
+
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        self._session = ort.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+        tokenizer = Tokenizer.from_file(tokenizer_path)
+        tokenizer.enable_truncation(max_length=max_length)
+        tokenizer.enable_padding()
+        self._tokenizer = tokenizer
+
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="onnx-embed")
+        self._batcher = MicroBatcher(
+            self._embed,
+            max_batch_size=embed_batch_size,
+            max_wait_ms=max_wait_ms,
+            executor=self._executor,
+            name="onnx-embed-batcher",
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        encodings = self._tokenizer.encode_batch(texts)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": attention_mask,
+        }
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        output = self._session.run(None, feeds)[0]
+
+        # Modelos sem pooling embutido devolvem (batch, tokens, dim): aplica mean pooling
+        if output.ndim == 3:
+            mask = attention_mask[..., None].astype(output.dtype)
+            output = (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return (output / np.clip(norms, 1e-12, None)).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._batcher.run(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await asyncio.wrap_future(self._batcher.submit(query))
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._batcher.run(text)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self._batcher.submit(text))
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        size = self.embed_batch_size
+        futures = [
+            self._executor.submit(self._embed, texts[i:i + size])
+            for i in range(0, len(texts), size)
+        ]
+        embeddings = []
+        for future in futures:
+            embeddings.extend(future.result())
+        return embeddings
+
+
+class BatchedOpenAIEmbedding(RateLimitedOpenAIEmbedding):
+    """
+    OpenAIEmbedding que agrupa embeddings de perguntas concorrentes.
+
+    Perguntas que chegam dentro de alguns milissegundos viram uma única chamada à
+    API, reduzindo o número de requisições contado pelo rate limit.
+    """
+
+    _batcher = PrivateAttr()
+
+    def __init__(self, max_batch_size: int = 16, max_wait_ms: float = 5.0, batch_workers: int = 4, **kwargs):
+        super().__init__(**kwargs)
+        self._batcher = MicroBatcher(
+            self._embed_queries,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            executor=ThreadPoolExecutor(max_workers=batch_workers, thread_name_prefix="query-embed"),
+            name="query-embed-batcher",
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchedOpenAIEmbedding"
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        client = self._get_client()
+        return self._get_limiter().call(
+            lambda: get_embeddings(
+                client,
+                queries,
+                engine=self._query_engine,
+                **self.additional_kwargs,
+            ),
+            estimate_tokens(queries),
+        )
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._batcher.run(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await asyncio.wrap_future(self._batcher.submit(query))
+
+
+def get_embedding_signature() -> str:
+    """Identifica backend + modelo (+ dimensões); coleções com assinaturas diferentes não se misturam."""
+    signature = f"{settings.EMBEDDING_BACKEND}-{settings.EMBEDDING_MODEL}"
+    if settings.EMBEDDING_DIMENSIONS:
+        signature += f"-{settings.EMBEDDING_DIMENSIONS}d"
+    return signature
+
+
+def get_collection_name(base: str) -> str:
+    signature = get_embedding_signature()
+    if signature == DEFAULT_EMBEDDING_SIGNATURE:
+        return base
+    return f"{base}__{slugify(signature)}"
+
+
+def _build_embed_model():
+    backend = settings.EMBEDDING_BACKEND
+
+    if backend == "openai":
+        if settings.QUERY_EMBEDDING_BATCHING:
+            return BatchedOpenAIEmbedding(
+                model=settings.EMBEDDING_MODEL,
+                dimensions=settings.EMBEDDING_DIMENSIONS,
+                api_key=config("OPENAI_API_KEY"),
+                max_batch_size=settings.QUERY_EMBEDDING_MAX_BATCH_SIZE,
+                max_wait_ms=settings.QUERY_EMBEDDING_MAX_WAIT_MS,
+                batch_workers=settings.QUERY_EMBEDDING_WORKERS,
+            )
+        return RateLimitedOpenAIEmbedding(
+            model=settings.EMBEDDING_MODEL,
+            dimensions=settings.EMBEDDING_DIMENSIONS,
+            api_key=config("OPENAI_API_KEY"),
+        )
+
+    if backend == "onnx":
+        return OnnxEmbedding(
+            model_path=settings.ONNX_EMBEDDING_MODEL_PATH,
+            tokenizer_path=settings.ONNX_EMBEDDING_TOKENIZER_PATH,
+            model_name=settings.EMBEDDING_MODEL,
+            max_length=settings.ONNX_EMBEDDING_MAX_LENGTH,
+            embed_batch_size=settings.ONNX_EMBEDDING_BATCH_SIZE,
+            max_wait_ms=settings.ONNX_EMBEDDING_MAX_WAIT_MS,
+            num_threads=settings.ONNX_EMBEDDING_THREADS,
+            num_workers=settings.ONNX_EMBEDDING_WORKERS,
+        )
+
+    raise ValueError(f"EMBEDDING_BACKEND inválido: {backend}")
+
+
+def get_embed_model():
+    """
+    Devolve o modelo de embedding configurado, reaproveitado dentro do processo.
+
+    A chave inclui o pid: threads e sessões não sobrevivem ao fork dos workers.
+    """
+    key = (os.getpid(), get_embedding_signature())
+    if key not in _embed_models:
+        logger.info(f"Carregando modelo de embedding {key[1]}")
+        _embed_models[key] = _build_embed_model()
+    return _embed_models[key]
+
+
+def get_embedding_stats() -> dict:
+    """Contadores de micro-batching dos modelos carregados neste processo."""
+    pid = os.getpid()
+    return {
+        signature: model._batcher.stats()
+        for (model_pid, signature), model in _embed_models.items()
+        if model_pid == pid and isinstance(model, (BatchedOpenAIEmbedding, OnnxEmbedding))
+    }
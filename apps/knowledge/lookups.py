@@ -0,0 +1,18 @@
+from django.db.models import Lookup
+from django.db.utils import NotSupportedError
+
+
+class FullTextSearch(Lookup):
+    """
+    `campo__search`: MATCH ... AGAINST em modo booleano, que usa o índice FULLTEXT do
+    MySQL. É o lookup que o admin aplica aos search_fields com prefixo "@".
+    """
+    lookup_name = 'search'
+
+    def as_mysql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"MATCH ({lhs}) AGAINST ({rhs} IN BOOLEAN MODE)", (*lhs_params, *rhs_params)
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError("Busca full-text disponível apenas no MySQL.")
@@ -0,0 +1,148 @@
+import multiprocessing
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+from llama_index.core.embeddings import MockEmbedding
+
+from apps.knowledge.memory import peak_rss_mb, reset_peak_rss
+from apps.knowledge.rag_service import RAG_Service
+
+
+_LOREM = (
+    "Este paragrafo de teste descreve procedimentos, requisitos e observacoes "
+    "sobre o funcionamento do sistema para gerar texto suficiente por pagina. "
+)
+
+
+class _RandomEmbedding(MockEmbedding):
+    # O MockEmbedding repete o mesmo float em todos os vetores, o que esconde o custo
+    # real de manter os embeddings de um PDF inteiro em memória
+    def _get_vector(self):
+        return np.random.default_rng().random(self.embed_dim).tolist()
+
+
+def write_text_pdf(path, pages: int, lines_per_page: int = 40):
+    """Gera um PDF simples com `pages` páginas de texto, sem dependências externas."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages, preenchido depois de conhecer os filhos
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in range(pages):
+        lines = [f"Pagina {page + 1}. {_LOREM}"[:90] for _ in range(lines_per_page)]
+        text = " T* ".join(f"({line})Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids)
+    )
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def _run(backend, operation, file_path, store_path, knowledge_id, window, dim, conn):
+    # Processo filho: o pico de RSS medido é só desta ingestão, atualização ou limpeza
+    with override_settings(
+        VECTOR_STORE_BACKEND=backend,
+        NUMPY_VECTOR_STORE_PATH=store_path,
+        CHROMADB_PATH=store_path,
+        INGESTION_PAGE_WINDOW=window,
+    ), patch("apps.knowledge.rag_service.get_embed_model", return_value=_RandomEmbedding(embed_dim=dim)):
+        reset_peak_rss()
+        start = time.perf_counter()
+        # O user_id "0" não existe: a troca de versões no Chroma não encontra o Knowledge
+        if operation == "update":
+            chunks = RAG_Service.update_pdf(file_path, "0", "bench", knowledge_id)["chunks"]
+        elif operation == "ingest":
+            chunks = RAG_Service.ingest_pdf(file_path, "0", "bench", knowledge_id=knowledge_id)
+        else:
+            chunks = RAG_Service.delete_knowledge("0", knowledge_id)
+    conn.send((chunks, time.perf_counter() - start, peak_rss_mb()))
+    conn.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o pico de memória (RSS) da ingestão e da atualização de PDFs de tamanhos "
+        "crescentes, cada uma em um processo novo, com embeddings simulados. Os backends "
+        "numpy e persistent usam um diretório temporário; o http usa o servidor de "
+        "CHROMADB_HOST/CHROMADB_PORT e apaga os chunks gravados no fim. A atualização "
+        "reenvia o mesmo PDF, ingerido antes em outro processo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', default='10,100,500,2000', help='Tamanhos de PDF (páginas)')
+        parser.add_argument('--windows', default='32,100000', help='Janelas de páginas a comparar (100000 = tudo de uma vez)')
+        parser.add_argument('--backends', default='numpy', help='Backends a comparar (numpy, persistent, http)')
+        parser.add_argument('--operations', default='ingest,update', help='Operações a medir (ingest, update)')
+        parser.add_argument('--dim', type=int, default=1536, help='Dimensão dos embeddings simulados')
+
+    def _child(self, context, *args):
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run, args=(*args, sender))
+        process.start()
+        # Sem a ponta de escrita no pai, o recv termina com EOFError se o filho morrer
+        sender.close()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            process.join()
+            raise CommandError(f"{args[1]} com o backend {args[0]} falhou (código de saída {process.exitcode})")
+        process.join()
+        return result
+
+    def handle(self, *args, **options):
+        tmp_dir = Path(tempfile.mkdtemp(prefix='bench-ingest-'))
+        context = multiprocessing.get_context('fork')
+        # Os filhos abrem as próprias conexões com o banco
+        connections.close_all()
+        try:
+            self.stdout.write(
+                f"{'backend':>10} {'operação':>8} {'páginas':>8} {'janela':>8} {'chunks':>8} {'tempo s':>8} {'pico RSS MB':>12}"
+            )
+            for pages in [int(p) for p in options['pages'].split(',')]:
+                pdf_path = tmp_dir / f"{pages}.pdf"
+                write_text_pdf(pdf_path, pages)
+
+                for backend in options['backends'].split(','):
+                    for operation in options['operations'].split(','):
+                        for window in [int(w) for w in options['windows'].split(',')]:
+                            store_path = tmp_dir / f"store-{backend}-{pages}-{window}"
+                            run = (backend, str(pdf_path), str(store_path), str(uuid.uuid4()), window, options['dim'])
+                            if operation == "update":
+                                self._child(context, run[0], "ingest", *run[1:])
+                            chunks, elapsed, peak = self._child(context, run[0], operation, *run[1:])
+                            if backend == "http":
+                                self._child(context, run[0], "delete", *run[1:])
+                            shutil.rmtree(store_path, ignore_errors=True)
+
+                            self.stdout.write(
+                                f"{backend:>10} {operation:>8} {pages:>8} {window:>8} {chunks:>8} {elapsed:>8.2f} {peak:>12.1f}"
+                            )
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,137 @@
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import VectorStoreQuery
+
+from apps.knowledge.embeddings import get_collection_name
+from apps.knowledge.rag_service import COLLECTION_NAME, RAG_Service
+from apps.knowledge.vector_store import VECTOR_DTYPES, NumpyVectorStore
+
+
+def _mb(size: int) -> float:
+    return size / 1024 / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o recall@k e a memória de vetores truncados (EMBEDDING_DIMENSIONS) e "
+        "quantizados (float16/int8 com repontuação) contra a busca exata em float32, "
+        "usando os vetores de uma coleção existente. Também lista o espaço ocupado "
+        "pelas coleções do backend numpy. A quantização reduz a memória e os bytes "
+        "varridos por consulta, não o disco: os vetores float32 continuam gravados "
+        "para a repontuação."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', default=None, help='Coleção de origem (padrão: a do modelo configurado)')
+        parser.add_argument('--sample', type=int, default=20000, help='Máximo de chunks lidos da coleção')
+        parser.add_argument('--synthetic', type=int, default=0, help='Usa N vetores aleatórios em vez de uma coleção')
+        parser.add_argument('--dim', type=int, default=1536, help='Dimensão dos vetores sintéticos')
+        parser.add_argument('--dimensions', default='', help='Dimensões truncadas a avaliar, ex.: 512,256')
+        parser.add_argument('--dtypes', default=','.join(VECTOR_DTYPES), help='Precisões a avaliar')
+        parser.add_argument('--oversample', type=int, default=settings.NUMPY_VECTOR_STORE_OVERSAMPLE)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self._report_collections()
+
+        vectors = self._load_vectors(options)
+        if len(vectors) <= options['k']:
+            raise CommandError("Vetores insuficientes para medir o recall.")
+
+        # Perguntas simuladas: chunks existentes com ruído, para não coincidirem com nenhum vetor
+        rng = np.random.default_rng(0)
+        picked = rng.choice(len(vectors), size=min(options['queries'], len(vectors)), replace=False)
+        queries = vectors[picked] + rng.normal(0, 0.5 / np.sqrt(vectors.shape[1]), (len(picked), vectors.shape[1]))
+        queries = queries.astype(np.float32)
+
+        k = options['k']
+        exact = self._exact_top_k(vectors, queries, k)
+
+        dimensions = [vectors.shape[1]] + [int(d) for d in options['dimensions'].split(',') if d]
+        dtypes = [d.strip() for d in options['dtypes'].split(',') if d.strip()]
+
+        self.stdout.write(
+            f"\n{len(vectors)} chunks, {len(queries)} perguntas, k={k}, oversample={options['oversample']}\n"
+            f"{'dim':>6} {'dtype':<8} {'recall@k':>9} {'p50 ms':>8} {'scan MB':>9} {'float32 MB':>11} {'disco MB':>9}"
+        )
+        for dim in dimensions:
+            for dtype in dtypes:
+                recall, p50, stats = self._evaluate(vectors, queries, exact, dim, dtype, k, options['oversample'])
+                scan_bytes = stats['quantized_bytes'] or stats['float32_bytes']
+                self.stdout.write(
+                    f"{dim:>6} {dtype:<8} {recall:>9.4f} {p50:>8.2f} "
+                    f"{_mb(scan_bytes):>9.1f} {_mb(stats['float32_bytes']):>11.1f} {_mb(stats['disk_bytes']):>9.1f}"
+                )
+
+    def _report_collections(self):
+        root = Path(settings.NUMPY_VECTOR_STORE_PATH)
+        if not root.exists():
+            return
+
+        self.stdout.write(
+            f"{'coleção':<48} {'chunks':>8} {'dim':>5} {'dtype':<8} {'float32 MB':>11} {'quant. MB':>10} {'disco MB':>9}"
+        )
+        for path in sorted(p for p in root.iterdir() if p.is_dir()):
+            stats = NumpyVectorStore(path, dtype=settings.NUMPY_VECTOR_STORE_DTYPE).storage_stats()
+            self.stdout.write(
+                f"{path.name:<48} {stats['chunks']:>8} {stats['dim']:>5} {stats['dtype']:<8} "
+                f"{_mb(stats['float32_bytes']):>11.1f} {_mb(stats['quantized_bytes']):>10.1f} {_mb(stats['disk_bytes']):>9.1f}"
+            )
+
+    def _load_vectors(self, options) -> np.ndarray:
+        if options['synthetic']:
+            rng = np.random.default_rng(42)
+            return rng.standard_normal((options['synthetic'], options['dim']), dtype=np.float32)
+
+        name = options['collection'] or get_collection_name(COLLECTION_NAME)
+        if settings.VECTOR_STORE_BACKEND == 'numpy':
+            store = NumpyVectorStore(Path(settings.NUMPY_VECTOR_STORE_PATH) / name)
+            chunks = [np.asarray(store._load(d).vectors) for d in store._all_shard_dirs()]
+            chunks = [c for c in chunks if c.size]
+            vectors = np.vstack(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+        else:
+            collection = RAG_Service._get_chroma_collection(name)
+            batch = collection.get(limit=options['sample'], include=['embeddings'])
+            vectors = np.asarray(batch['embeddings'], dtype=np.float32)
+
+        return vectors[:options['sample']]
+
+    @staticmethod
+    def _truncate(vectors: np.ndarray, dim: int) -> np.ndarray:
+        # Equivalente a pedir `dimensions` à API: primeiras componentes, renormalizadas
+        truncated = vectors[:, :dim]
+        return truncated / np.clip(np.linalg.norm(truncated, axis=1, keepdims=True), 1e-12, None)
+
+    def _exact_top_k(self, vectors, queries, k):
+        scores = self._truncate(queries, queries.shape[1]) @ self._truncate(vectors, vectors.shape[1]).T
+        return [set(np.argsort(-row)[:k]) for row in scores]
+
+    def _evaluate(self, vectors, queries, exact, dim, dtype, k, oversample):
+        tmp_dir = tempfile.mkdtemp(prefix='bench-quant-')
+        try:
+            store = NumpyVectorStore(tmp_dir, dtype=dtype, oversample=oversample)
+            truncated = self._truncate(vectors, dim)
+            store.add([
+                TextNode(id_=str(i), text='', embedding=v.tolist(), metadata={'user_id': 'bench'})
+                for i, v in enumerate(truncated)
+            ])
+
+            hits = 0
+            latencies = []
+            for q, expected in zip(self._truncate(queries, dim), exact):
+                start = time.perf_counter()
+                result = store.query(VectorStoreQuery(query_embedding=q.tolist(), similarity_top_k=k))
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += len(expected & {int(i) for i in result.ids})
+
+            return hits / (k * len(queries)), float(np.percentile(latencies, 50)), store.storage_stats()
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,90 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Cada alvo roda em um interpretador novo: django.setup() e depois o código indicado
+TARGETS = {
+    'django': '',
+    'urls': "from django.urls import resolve; resolve('/api/message/')",
+    'tasks': 'import apps.knowledge.tasks',
+    'rag': 'import apps.knowledge.rag_service',
+    'warmup': 'from apps.knowledge.warmup import warm_up; warm_up()',
+}
+
+_CHILD = """
+import os, sys
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+import django
+django.setup()
+{code}
+from apps.knowledge.memory import current_rss_mb
+sys.stdout.write(f"{{current_rss_mb():.1f}}")
+"""
+
+
+def _parse_importtime(stderr: str) -> list:
+    """Linhas de `-X importtime` como (cumulativo em µs, módulo)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), module.strip()))
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o tempo de início e o RSS de um processo Django novo até cada ponto "
+        "(django.setup, URLconf, tasks, RAG, warm-up), com `python -X importtime` "
+        "para listar os imports mais caros."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--targets', default=','.join(TARGETS), help='Alvos a medir')
+        parser.add_argument('--runs', type=int, default=5, help='Execuções por alvo (mediana)')
+        parser.add_argument('--top', type=int, default=10, help='Imports mais caros listados por alvo')
+
+    def handle(self, *args, **options):
+        targets = [t.strip() for t in options['targets'].split(',') if t.strip()]
+        unknown = set(targets) - set(TARGETS)
+        if unknown:
+            raise CommandError(f"Alvos desconhecidos: {', '.join(sorted(unknown))}")
+
+        results = []
+        for target in targets:
+            timings, rss, imports = [], 0.0, []
+            for _ in range(options['runs']):
+                start = time.perf_counter()
+                proc = subprocess.run(
+                    [sys.executable, '-X', 'importtime', '-c', _CHILD.format(code=TARGETS[target])],
+                    capture_output=True, text=True, env=os.environ.copy(),
+                )
+                timings.append(time.perf_counter() - start)
+                if proc.returncode != 0:
+                    raise CommandError(f"{target}: {proc.stderr.strip().splitlines()[-1]}")
+                rss = float(proc.stdout.strip().splitlines()[-1])
+                imports = _parse_importtime(proc.stderr)
+            results.append((target, statistics.median(timings), rss, imports))
+
+        self.stdout.write(f"{'alvo':<8} {'início s':>9} {'RSS MB':>8} {'módulos':>8}")
+        for target, elapsed, rss, imports in results:
+            self.stdout.write(f"{target:<8} {elapsed:>9.2f} {rss:>8.1f} {len(imports):>8}")
+
+        for target, _, _, imports in results:
+            if not imports:
+                continue
+            # Agrupa por pacote de primeiro nível: o maior cumulativo já inclui os submódulos
+            packages = {}
+            for cumulative, module in imports:
+                package = module.split('.')[0]
+                packages[package] = max(packages.get(package, 0), cumulative)
+            top = sorted(((c, m) for m, c in packages.items()), reverse=True)[:options['top']]
+            self.stdout.write(f"\n{target}: imports mais caros (cumulativo)")
+            for cumulative, module in top:
+                self.stdout.write(f"  {cumulative / 1000:>8.1f} ms  {module}")
@@ -0,0 +1,116 @@
+import shutil
+import statistics
+import tempfile
+import time
+from unittest.mock import patch
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from llama_index.core import Document
+from llama_index.core.base.llms.types import CompletionResponse
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import MockLLM
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+from apps.knowledge.rag_service import DECOMPOSE_PROMPT, RAG_Service
+from apps.knowledge.vector_store import NumpyVectorStore
+
+# Id numérico sem usuário no banco: o corpus e o roteamento consultam Knowledge por ele
+_BENCH_USER_ID = '0'
+
+
+class _SlowEmbedding(MockEmbedding):
+    """Embedding simulado com a latência de uma chamada à API."""
+    latency: float = 0.0
+
+    def _get_query_embedding(self, query):
+        time.sleep(self.latency)
+        return super()._get_query_embedding(query)
+
+
+class _SlowLLM(MockLLM):
+    """LLM simulado: devolve as sub-perguntas na decomposição e um texto fixo na síntese."""
+    latency: float = 0.0
+    sub_questions: list = []
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs):
+        time.sleep(self.latency)
+        if prompt.startswith(DECOMPOSE_PROMPT.split("{")[0]):
+            return CompletionResponse(text="\n".join(self.sub_questions))
+        return CompletionResponse(text="Resposta sintetizada.")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara a latência de ponta a ponta de answer_question para perguntas compostas: "
+        "sem decomposição, com sub-perguntas buscadas em sequência e em paralelo. "
+        "Embeddings, vector store e LLM são simulados com as latências informadas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subquestions', default='2,3,4', help='Números de sub-perguntas a medir')
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--embed-latency', type=float, default=0.15, help='Segundos por embedding de pergunta')
+        parser.add_argument('--retrieve-latency', type=float, default=0.05, help='Segundos por busca no vector store')
+        parser.add_argument('--llm-latency', type=float, default=0.8, help='Segundos por chamada ao LLM')
+
+    def handle(self, *args, **options):
+        tmp_dir = tempfile.mkdtemp(prefix='bench-subq-')
+        embed_model = _SlowEmbedding(embed_dim=64)
+        llm = _SlowLLM(max_tokens=20)
+        llm.latency = options['llm_latency']
+        query = NumpyVectorStore.query
+        retrieve_latency = options['retrieve_latency']
+
+        def slow_query(store, *args, **kwargs):
+            time.sleep(retrieve_latency)
+            return query(store, *args, **kwargs)
+
+        try:
+            with override_settings(
+                VECTOR_STORE_BACKEND='numpy',
+                NUMPY_VECTOR_STORE_PATH=tmp_dir,
+                DOCUMENT_ROUTING_TOP_N=0,
+            ), patch('apps.knowledge.rag_service.get_embed_model', return_value=embed_model), \
+                    patch('apps.knowledge.rag_service.get_llm', return_value=llm):
+                RAG_Service._index_documents([
+                    Document(
+                        text=f"Documento {d}, página {p}: requisitos, prazos e procedimentos.",
+                        metadata={'user_id': _BENCH_USER_ID, 'knowledge_id': f'doc-{d}', 'title': f'Documento {d}', 'page_label': str(p)},
+                    )
+                    for d in range(4) for p in range(1, 6)
+                ])
+                # Latências só depois da ingestão
+                embed_model.latency = options['embed_latency']
+
+                with patch.object(NumpyVectorStore, 'query', slow_query):
+                    self._report(llm, options)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _measure(self, question, runs, decomposition, concurrent=True):
+        aretrieve = RAG_Service._aretrieve_subquestions
+
+        async def retrieve(index, sub_questions, user_id):
+            return await aretrieve(index, sub_questions, user_id, concurrent=concurrent)
+
+        timings = []
+        with override_settings(SUBQUESTION_DECOMPOSITION=decomposition), \
+                patch.object(RAG_Service, '_aretrieve_subquestions', retrieve):
+            for _ in range(runs):
+                start = time.perf_counter()
+                RAG_Service.answer_question(question, _BENCH_USER_ID)
+                timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def _report(self, llm, options):
+        self.stdout.write(f"{'sub-perguntas':>13} {'sem decomp. ms':>15} {'sequencial ms':>14} {'paralelo ms':>12}")
+        for count in [int(n) for n in options['subquestions'].split(',')]:
+            llm.sub_questions = [f"Quais são os prazos do Documento {d}?" for d in range(count)]
+            question = "Compare os prazos " + ", ".join(f"do Documento {d}" for d in range(count)) + "."
+
+            single = self._measure(question, options['runs'], decomposition=False)
+            sequential = self._measure(question, options['runs'], decomposition=True, concurrent=False)
+            concurrent = self._measure(question, options['runs'], decomposition=True)
+            self.stdout.write(f"{count:>13} {single:>15.0f} {sequential:>14.0f} {concurrent:>12.0f}")
@@ -0,0 +1,84 @@
+import shutil
+import tempfile
+import time
+import uuid
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import ExactMatchFilter, MetadataFilters, VectorStoreQuery
+
+from apps.knowledge.memory import current_rss_mb
+from apps.knowledge.rag_service import RAG_Service
+
+
+BACKENDS = ('http', 'persistent', 'numpy')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara os backends de vector store (http, persistent e numpy) com chunks "
+        "sintéticos: tempo de inserção, latência p50/p95 da busca filtrada por usuário "
+        "e memória residente do processo. Cada consulta obtém o store por "
+        "RAG_Service._get_vector_store(), como em produção."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default='numpy,persistent', help='Lista separada por vírgula: http, persistent, numpy')
+        parser.add_argument('--chunks', type=int, default=20000, help='Total de chunks sintéticos')
+        parser.add_argument('--dim', type=int, default=1536, help='Dimensão dos vetores')
+        parser.add_argument('--users', type=int, default=20, help='Usuários entre os quais os chunks são divididos')
+        parser.add_argument('--queries', type=int, default=200, help='Consultas por backend')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(42)
+        vectors = rng.standard_normal((options['chunks'], options['dim']), dtype=np.float32)
+        users = [str(i % options['users']) for i in range(options['chunks'])]
+        queries = rng.standard_normal((options['queries'], options['dim']), dtype=np.float32)
+
+        self.stdout.write(
+            f"{'backend':<12} {'insert s':>9} {'p50 ms':>8} {'p95 ms':>8} {'rss MB':>8}"
+        )
+        for backend in options['backends'].split(','):
+            backend = backend.strip()
+            if backend not in BACKENDS:
+                raise CommandError(f"Backend desconhecido: {backend}")
+
+            tmp_dir = tempfile.mkdtemp(prefix='bench-vs-')
+            name = f"bench_{uuid.uuid4().hex[:8]}"
+            try:
+                with override_settings(VECTOR_STORE_BACKEND=backend, NUMPY_VECTOR_STORE_PATH=tmp_dir, CHROMADB_PATH=tmp_dir):
+                    try:
+                        self._bench(backend, name, vectors, users, queries)
+                    finally:
+                        if backend != 'numpy':
+                            RAG_Service._get_chroma_client().delete_collection(name)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _bench(self, backend, name, vectors, users, queries):
+        nodes = [
+            TextNode(id_=f"n{i}", text=f"chunk {i}", embedding=vectors[i].tolist(), metadata={"user_id": user})
+            for i, user in enumerate(users)
+        ]
+
+        start = time.perf_counter()
+        store = RAG_Service._get_vector_store(name)
+        for i in range(0, len(nodes), 1000):
+            store.add(nodes[i:i + 1000])
+        insert_elapsed = time.perf_counter() - start
+
+        latencies = []
+        for i, q in enumerate(queries):
+            filters = MetadataFilters(filters=[ExactMatchFilter(key="user_id", value=users[i % len(users)])])
+            start = time.perf_counter()
+            # Store novo a cada pergunta, como em RAG_Service.answer_question
+            store = RAG_Service._get_vector_store(name)
+            store.query(VectorStoreQuery(query_embedding=q.tolist(), similarity_top_k=5, filters=filters))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        self.stdout.write(
+            f"{backend:<12} {insert_elapsed:>9.2f} {np.percentile(latencies, 50):>8.2f} "
+            f"{np.percentile(latencies, 95):>8.2f} {current_rss_mb():>8.1f}"
+        )
@@ -0,0 +1,90 @@
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from llama_index.core.vector_stores import ExactMatchFilter, MetadataFilters
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from apps.knowledge.models import Knowledge
+from apps.knowledge.rag_service import RAG_Service
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera o índice de resumos por documento a partir dos chunks já indexados, "
+        "para usuários com documentos ingeridos antes do roteamento por documento. "
+        "No ChromaDB, chunks sem knowledge_id recebem o id do Knowledge de mesmo título."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help='Restringe a um usuário (pode repetir)')
+
+    def handle(self, *args, **options):
+        user_ids = options['user'] or list(
+            Knowledge.objects.filter(is_deleted=False).values_list('user_id', flat=True).distinct()
+        )
+
+        summary_store = RAG_Service._get_summary_store()
+        for user_id in user_ids:
+            nodes, untagged = self._load_chunks(user_id)
+            summaries = RAG_Service._build_summary_nodes(nodes)
+
+            RAG_Service._delete_summaries(
+                MetadataFilters(filters=[ExactMatchFilter(key="user_id", value=str(user_id))])
+            )
+            if summaries:
+                summary_store.add(summaries)
+
+            documents = len({n.metadata["knowledge_id"] for n in summaries})
+            self.stdout.write(f"Usuário {user_id}: {documents} documentos, {len(summaries)} resumos")
+            if untagged:
+                self.stdout.write(self.style.WARNING(
+                    f"Usuário {user_id}: {untagged} chunks sem knowledge_id ficaram fora do índice; "
+                    "reenvie esses PDFs para que participem do roteamento."
+                ))
+
+        self.stdout.write(self.style.SUCCESS("Índice de resumos pronto."))
+
+    def _load_chunks(self, user_id):
+        """Chunks do usuário com embedding; devolve também quantos ficaram sem knowledge_id."""
+        if settings.VECTOR_STORE_BACKEND == "numpy":
+            nodes = RAG_Service._get_vector_store().get_nodes(
+                filters=MetadataFilters(filters=[ExactMatchFilter(key="user_id", value=str(user_id))])
+            )
+            return nodes, sum(1 for n in nodes if not n.metadata.get("knowledge_id"))
+
+        collection = RAG_Service._get_chroma_collection()
+        batch = collection.get(
+            where={"user_id": str(user_id)},
+            include=['documents', 'metadatas', 'embeddings'],
+        )
+        self._tag_legacy_chunks(collection, user_id, batch)
+
+        nodes = []
+        for text, metadata, embedding in zip(batch['documents'], batch['metadatas'], batch['embeddings']):
+            node = metadata_dict_to_node(metadata, text=text)
+            # Chunks marcados acima só têm o knowledge_id nos metadados planos do Chroma
+            if metadata.get("knowledge_id"):
+                node.metadata["knowledge_id"] = metadata["knowledge_id"]
+            node.embedding = list(embedding)
+            nodes.append(node)
+        return nodes, sum(1 for n in nodes if not n.metadata.get("knowledge_id"))
+
+    def _tag_legacy_chunks(self, collection, user_id, batch):
+        # Só associa títulos que identificam um único Knowledge do usuário
+        knowledge = list(Knowledge.objects.filter(user_id=user_id, is_deleted=False).values_list('pk', 'title'))
+        titles = Counter(title for _, title in knowledge)
+        knowledge_by_title = {title: str(pk) for pk, title in knowledge if titles[title] == 1}
+
+        ids, metadatas = [], []
+        for chunk_id, metadata in zip(batch['ids'], batch['metadatas']):
+            knowledge_id = knowledge_by_title.get(metadata.get('title'))
+            if metadata.get('knowledge_id') or not knowledge_id:
+                continue
+            metadata['knowledge_id'] = knowledge_id
+            ids.append(chunk_id)
+            metadatas.append(metadata)
+
+        if ids:
+            collection.update(ids=ids, metadatas=metadatas)
+            self.stdout.write(f"Usuário {user_id}: {len(ids)} chunks antigos associados ao Knowledge pelo título")
@@ -0,0 +1,55 @@
+import time
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.knowledge.models import IngestionJob
+from apps.knowledge.tasks import dispatch_bulk_ingestion
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingere todos os PDFs de um diretório para um usuário, em lotes distribuídos "
+        "entre os workers do Celery. O diretório precisa estar acessível aos workers; "
+        "os arquivos de origem não são removidos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--user', required=True, help='Email ou id do usuário dono dos documentos')
+        parser.add_argument('--wait', action='store_true', help='Acompanha o progresso até o fim')
+
+    def handle(self, *args, **options):
+        directory = Path(options['directory']).resolve()
+        if not directory.is_dir():
+            raise CommandError(f"Diretório não encontrado: {directory}")
+
+        User = get_user_model()
+        lookup = {'pk': options['user']} if options['user'].isdigit() else {'email': options['user']}
+        user = User.objects.filter(**lookup).first()
+        if user is None:
+            raise CommandError(f"Usuário não encontrado: {options['user']}")
+
+        files = [
+            {"file_path": str(path), "title": path.stem}
+            for path in sorted(directory.rglob('*'))
+            if path.is_file() and path.suffix.lower() == '.pdf'
+        ]
+        if not files:
+            raise CommandError(f"Nenhum PDF encontrado em {directory}")
+
+        job = IngestionJob.objects.create(user=user, total=len(files))
+        dispatch_bulk_ingestion(job, files, delete_files=False)
+        self.stdout.write(f"Ingestão {job.id} iniciada com {len(files)} PDFs")
+
+        if not options['wait']:
+            return
+
+        while job.status == 'running':
+            time.sleep(5)
+            job.refresh_from_db()
+            self.stdout.write(f"{job.processed + job.failed}/{job.total} (falhas: {job.failed})")
+
+        style = self.style.SUCCESS if job.status == 'completed' else self.style.ERROR
+        self.stdout.write(style(f"Ingestão {job.status}: {job.processed} PDFs processados, {job.failed} falhas"))
@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from llama_index.core.schema import MetadataMode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from apps.knowledge.embeddings import get_collection_name, get_embed_model, get_embedding_signature
+from apps.knowledge.rag_service import COLLECTION_NAME, SUMMARY_COLLECTION_NAME, RAG_Service, _SummaryAccumulator
+from apps.knowledge.vector_store import NumpyVectorStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-gera os embeddings de uma coleção existente com o backend configurado "
+        "em EMBEDDING_BACKEND/EMBEDDING_MODEL, gravando na coleção desse modelo. "
+        "Os resumos usados no roteamento por documento são recalculados a partir dos "
+        "novos embeddings. A coleção de origem não é alterada, permitindo indexação "
+        "dupla durante a migração. Funciona com os backends do Chroma e com o numpy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=COLLECTION_NAME, help='Coleção de origem')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        target = get_collection_name(COLLECTION_NAME)
+        if options['source'] == target:
+            raise CommandError(
+                f"A coleção de origem já usa o modelo {get_embedding_signature()}."
+            )
+
+        self.embed_model = get_embed_model()
+        self.batch_size = options['batch_size']
+
+        if settings.VECTOR_STORE_BACKEND == 'numpy':
+            self._reindex_numpy(options['source'], target)
+        else:
+            self._reindex_chroma(options['source'], target)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Coleções {target} e {get_collection_name(SUMMARY_COLLECTION_NAME)} prontas."
+        ))
+
+    def _embed(self, nodes):
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        for node, embedding in zip(nodes, self.embed_model.get_text_embedding_batch(texts)):
+            node.embedding = embedding
+
+    def _reindex_chroma(self, source_name, target_name):
+        source = RAG_Service._get_chroma_collection(source_name)
+        target = RAG_Service._get_chroma_collection(target_name)
+        # Os centróides de resumo são recalculados no espaço do novo modelo
+        summaries = _SummaryAccumulator(settings.DOCUMENT_SECTION_PAGES)
+        total = source.count()
+        offset = 0
+
+        self.stdout.write(f"Migrando {total} chunks de {source.name} para {target.name}")
+
+        while offset < total:
+            batch = source.get(
+                limit=self.batch_size,
+                offset=offset,
+                include=['documents', 'metadatas'],
+            )
+            if not batch['ids']:
+                break
+
+            nodes = [
+                metadata_dict_to_node(metadata, text=text)
+                for text, metadata in zip(batch['documents'], batch['metadatas'])
+            ]
+            self._embed(nodes)
+            summaries.add(nodes)
+
+            target.upsert(
+                ids=batch['ids'],
+                embeddings=[node.embedding for node in nodes],
+                documents=batch['documents'],
+                metadatas=batch['metadatas'],
+            )
+
+            offset += len(batch['ids'])
+            self.stdout.write(f"{offset}/{total}")
+
+        self._write_summaries(summaries.build())
+
+    def _reindex_numpy(self, source_name, target_name):
+        source = RAG_Service._get_vector_store(source_name)
+        target = RAG_Service._get_vector_store(target_name)
+        total = source.storage_stats()['chunks']
+        done = 0
+
+        self.stdout.write(f"Migrando {total} chunks de {source_name} para {target_name}")
+
+        # Um shard (usuário) por vez: o shard de destino é reescrito uma vez e os
+        # resumos dos documentos dele são gravados antes do próximo
+        for shard_dir in source._all_shard_dirs():
+            shard = source._load(shard_dir, use_cache=False)
+            if not shard.ids:
+                continue
+
+            summaries = _SummaryAccumulator(settings.DOCUMENT_SECTION_PAGES)
+            with target.bulk_replace(node_ids=shard.ids) as staged:
+                for start in range(0, len(shard.ids), self.batch_size):
+                    nodes = [metadata_dict_to_node(record) for record in shard.records[start:start + self.batch_size]]
+                    self._embed(nodes)
+                    staged.add(nodes)
+                    summaries.add(nodes)
+
+                    done += len(nodes)
+                    self.stdout.write(f"{done}/{total}")
+
+            self._write_summaries(summaries.build())
+
+    def _write_summaries(self, summary_nodes):
+        if not summary_nodes:
+            return
+
+        store = RAG_Service._get_summary_store()
+        node_ids = [node.node_id for node in summary_nodes]
+        # Os ids dos resumos são fixos por documento: substitui os de uma execução anterior
+        if isinstance(store, NumpyVectorStore):
+            with store.bulk_replace(node_ids=node_ids) as staged:
+                staged.add(summary_nodes)
+            return
+
+        store.delete_nodes(node_ids=node_ids)
+        with RAG_Service._chunk_writer(store) as write:
+            write(summary_nodes)
@@ -0,0 +1,39 @@
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _read_status_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def current_rss_mb() -> float:
+    """RSS atual do processo (Linux)."""
+    try:
+        return _read_status_kb("VmRSS") / 1024
+    except OSError:
+        return 0.0
+
+
+def peak_rss_mb() -> float:
+    """Pico de RSS do processo desde o início ou desde o último `reset_peak_rss`."""
+    try:
+        return _read_status_kb("VmHWM") / 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss() -> bool:
+    """Zera o pico de RSS (VmHWM) para medir uma tarefa isolada; requer Linux 4.0+."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
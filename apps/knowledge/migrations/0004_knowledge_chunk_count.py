@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0003_message_reply_to_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledge',
+            name='chunk_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
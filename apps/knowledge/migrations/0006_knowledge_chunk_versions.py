@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0005_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledge',
+            name='pending_chunk_version',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='knowledge',
+            name='retired_chunk_version',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
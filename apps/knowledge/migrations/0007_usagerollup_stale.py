@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0006_knowledge_chunk_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagerollup',
+            name='stale',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
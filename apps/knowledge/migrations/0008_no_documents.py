@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-10-19 21:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+# Até aqui só o atalho de corpus vazio gravava cache_hit: passa essas contagens para no_documents
+def move_empty_corpus_counts(apps, schema_editor):
+    apps.get_model('knowledge', 'Message').objects.filter(cache_hit=True).update(no_documents=True, cache_hit=False)
+    apps.get_model('knowledge', 'UsageRollup').objects.update(no_documents=F('cache_hits'), cache_hits=0)
+
+
+def restore_cache_hit_counts(apps, schema_editor):
+    apps.get_model('knowledge', 'Message').objects.filter(no_documents=True).update(cache_hit=True)
+    apps.get_model('knowledge', 'UsageRollup').objects.update(cache_hits=F('cache_hits') + F('no_documents'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0007_usagerollup_stale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='no_documents',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='usagerollup',
+            name='no_documents',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(move_empty_corpus_counts, restore_cache_hit_counts),
+    ]
@@ -7,6 +7,18 @@ AUTHOR_CHOICES = [
     ('system', 'System'),
 ]
 
+MESSAGE_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('completed', 'Completed'),
+    ('failed', 'Failed'),
+]
+
+JOB_STATUS_CHOICES = [
+    ('running', 'Running'),
+    ('completed', 'Completed'),
+    ('failed', 'Failed'),
+]
+
 class Knowledge(models.Model):
     id = models.UUIDField(
         primary_key=True,
@@ -21,6 +33,12 @@ class Knowledge(models.Model):
         verbose_name='User'
     )
     title = models.CharField(max_length=255)
+    # Chunks no vector store; nulo para documentos ingeridos antes da contagem
+    chunk_count = models.PositiveIntegerField(null=True, blank=True)
+    # Versões de chunks escondidas das consultas durante a troca de PDF no Chroma: a nova
+    # enquanto é gravada e a antiga enquanto é apagada
+    pending_chunk_version = models.CharField(max_length=32, blank=True, default='')
+    retired_chunk_version = models.CharField(max_length=32, blank=True, default='')
     is_deleted = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -48,6 +66,25 @@ class Message(models.Model):
     )
     content = models.TextField()
     author = models.CharField(max_length=10, choices=AUTHOR_CHOICES, default='user')
+    # Pergunta respondida por uma mensagem do sistema
+    reply_to = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='replies',
+        verbose_name='Reply to'
+    )
+    # Estado da resposta de perguntas enviadas no modo assíncrono
+    status = models.CharField(max_length=10, choices=MESSAGE_STATUS_CHOICES, default='completed')
+    # Métricas das respostas do sistema, agregadas em UsageRollup
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+    # Resposta servida de cache, sem consultar o RAG
+    cache_hit = models.BooleanField(default=False)
+    # Respondida sem busca porque o usuário não tinha documentos
+    no_documents = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -55,6 +92,77 @@ class Message(models.Model):
         verbose_name = 'Message'
         verbose_name_plural = 'Messages'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='knowledge_message_created_idx'),
+            models.Index(fields=['updated_at'], name='knowledge_message_updated_idx'),
+        ]
+
+    def __str__(self):
+        return self.content
+
+class IngestionJob(models.Model):
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False,
+        verbose_name='ID'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='ingestion_jobs',
+        verbose_name='User'
+    )
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=JOB_STATUS_CHOICES, default='running')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Ingestion job'
+        verbose_name_plural = 'Ingestion jobs'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.processed + self.failed}/{self.total}"
+
+class UsageRollup(models.Model):
+    """Uso agregado por usuário e dia, atualizado incrementalmente por `refresh_usage_rollups`."""
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False,
+        verbose_name='ID'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='usage_rollups',
+        verbose_name='User'
+    )
+    date = models.DateField()
+    questions = models.PositiveIntegerField(default=0)
+    answers = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    cache_hits = models.PositiveIntegerField(default=0)
+    no_documents = models.PositiveIntegerField(default=0)
+    # Somas: médias são calculadas dividindo por `answers`
+    latency_ms = models.PositiveBigIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    # Dia com mensagens apagadas desde a última agregação, a ser recontado
+    stale = models.BooleanField(default=False, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Usage rollup'
+        verbose_name_plural = 'Usage rollups'
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='knowledge_usagerollup_user_date'),
+        ]
 
     def __str__(self):
-        return self.content
\ No newline at end of file
+        return f"{self.user} {self.date}"
@@ -0,0 +1,348 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import List
+
+import openai
+import redis
+from decouple import config
+from django.conf import settings
+from llama_index.embeddings.openai import OpenAIEmbedding
+from llama_index.llms.openai import OpenAI
+
+from .openai_errors import RETRYABLE_ERRORS
+
+
+logger = logging.getLogger(__name__)
+
+# Balde de tokens com "dívida": o pedido sempre é debitado e o chamador dorme o
+# tempo necessário para o saldo voltar a zero, garantindo ordem de chegada.
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate) - requested
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+# Semáforo global: cada vaga expira sozinha se o processo que a ocupava morrer
+_ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - tonumber(ARGV[2]))
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+    return 1
+end
+return 0
+"""
+
+_PAUSE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+end
+return 1
+"""
+
+INFLIGHT_KEY = "openai:ratelimit:inflight"
+
+_limiters = {}
+
+
+def estimate_tokens(texts: List[str]) -> int:
+    # Aproximação de ~4 caracteres por token; basta para ritmar o orçamento
+    return sum(len(t) // 4 + 1 for t in texts)
+
+
+class OpenAIRateLimiter:
+    """
+    Controle de vazão para chamadas à OpenAI, compartilhado entre processos via Redis.
+
+    Cada chamada debita requisições e tokens de dois baldes (RPM e TPM), ocupa uma
+    vaga no limite global de chamadas simultâneas e é repetida individualmente em
+    caso de erro transitório, respeitando o Retry-After. Um 429 pausa todos os
+    processos pelo tempo indicado. Se o Redis estiver indisponível, os limites
+    passam a valer apenas dentro do processo por `redis_cooldown` segundos, e
+    então o Redis é tentado de novo.
+    """
+
+    slot_ttl = 120
+    redis_cooldown = 30
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int, max_concurrency: int, max_retries: int, max_backoff: float, redis_url: str):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._redis = redis.Redis.from_url(redis_url, socket_connect_timeout=1, socket_timeout=2)
+        self._local_until = 0.0
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._paused_until = 0.0
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+        self._pause_script = self._redis.register_script(_PAUSE_SCRIPT)
+
+    def _key(self, suffix: str) -> str:
+        return f"openai:ratelimit:{self.name}:{suffix}"
+
+    @property
+    def _local(self) -> bool:
+        return time.monotonic() < self._local_until
+
+    def _fallback(self, e: Exception):
+        if not self._local:
+            logger.warning(
+                f"Redis indisponível para o rate limit ({e}); usando limites locais ao processo "
+                f"pelos próximos {self.redis_cooldown}s"
+            )
+            self._local_until = time.monotonic() + self.redis_cooldown
+
+    def _take_local(self, bucket: str, capacity: float, requested: float) -> float:
+        rate = capacity / 60
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(bucket, (capacity, now))
+            tokens = min(capacity, tokens + (now - ts) * rate) - requested
+            self._buckets[bucket] = (tokens, now)
+        return 0.0 if tokens >= 0 else -tokens / rate
+
+    def _take_budget(self, bucket: str, per_minute: int, requested: float) -> float:
+        requested = min(requested, per_minute)
+        if not self._local:
+            try:
+                return float(self._take(
+                    keys=[self._key(bucket)],
+                    args=[per_minute, per_minute / 60, time.time(), requested],
+                ))
+            except redis.RedisError as e:
+                self._fallback(e)
+        return self._take_local(bucket, per_minute, requested)
+
+    def _pause_remaining(self) -> float:
+        if not self._local:
+            try:
+                paused_until = float(self._redis.get(self._key("pause")) or 0)
+                return max(0.0, paused_until - time.time())
+            except redis.RedisError as e:
+                self._fallback(e)
+        return max(0.0, self._paused_until - time.time())
+
+    def _pause(self, seconds: float):
+        until = time.time() + seconds
+        self._paused_until = max(self._paused_until, until)
+        if not self._local:
+            try:
+                self._pause_script(keys=[self._key("pause")], args=[until, int(seconds * 1000) + 1])
+            except redis.RedisError as e:
+                self._fallback(e)
+
+    def wait_for_budget(self, tokens: int):
+        wait = max(
+            self._pause_remaining(),
+            self._take_budget("requests", self.requests_per_minute, 1),
+            self._take_budget("tokens", self.tokens_per_minute, tokens),
+        )
+        if wait > 0:
+            time.sleep(wait)
+
+    @contextmanager
+    def slot(self):
+        token = uuid.uuid4().hex
+        acquired_remote = False
+
+        while not self._local:
+            try:
+                if self._acquire(keys=[INFLIGHT_KEY], args=[time.time(), self.slot_ttl, self.max_concurrency, token]):
+                    acquired_remote = True
+                    break
+            except redis.RedisError as e:
+                self._fallback(e)
+                break
+            time.sleep(0.05)
+
+        if not acquired_remote:
+            self._semaphore.acquire()
+        try:
+            yield
+        finally:
+            if acquired_remote:
+                try:
+                    self._redis.zrem(INFLIGHT_KEY, token)
+                except redis.RedisError as e:
+                    self._fallback(e)
+            else:
+                self._semaphore.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        context = self.slot()
+        await asyncio.to_thread(context.__enter__)
+        try:
+            yield
+        finally:
+            context.__exit__(None, None, None)
+
+    def retry_delay(self, error: Exception, attempt: int) -> float:
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            pass
+        return min(self.max_backoff, 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def call(self, fn, tokens: int = 1):
+        """Executa `fn` dentro do orçamento, repetindo apenas esta chamada em erros transitórios."""
+        attempt = 0
+        while True:
+            self.wait_for_budget(tokens)
+            with self.slot():
+                try:
+                    return fn()
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self.retry_delay(e, attempt)
+                    if isinstance(e, openai.RateLimitError):
+                        self._pause(delay)
+                    logger.warning(
+                        f"OpenAI ({self.name}) falhou com {type(e).__name__}; "
+                        f"tentativa {attempt + 1}/{self.max_retries} em {delay:.1f}s"
+                    )
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, fn, tokens: int = 1):
+        """Versão assíncrona de `call`; `fn` devolve uma coroutine."""
+        attempt = 0
+        while True:
+            await asyncio.to_thread(self.wait_for_budget, tokens)
+            async with self.aslot():
+                try:
+                    return await fn()
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self.retry_delay(e, attempt)
+                    if isinstance(e, openai.RateLimitError):
+                        self._pause(delay)
+                    logger.warning(
+                        f"OpenAI ({self.name}) falhou com {type(e).__name__}; "
+                        f"tentativa {attempt + 1}/{self.max_retries} em {delay:.1f}s"
+                    )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def get_rate_limiter(model: str, requests_per_minute: int, tokens_per_minute: int) -> OpenAIRateLimiter:
+    # Os limites da OpenAI são por modelo; a vaga de concorrência é da conta inteira,
+    # então todos os limitadores compartilham o mesmo limite de chamadas simultâneas.
+    key = (os.getpid(), model)
+    if key not in _limiters:
+        _limiters[key] = OpenAIRateLimiter(
+            name=model,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+            max_backoff=settings.OPENAI_RETRY_MAX_BACKOFF,
+            redis_url=settings.REDIS_URL,
+        )
+    return _limiters[key]
+
+
+class RateLimitedOpenAIEmbedding(OpenAIEmbedding):
+    """OpenAIEmbedding cujas chamadas passam pelo OpenAIRateLimiter (um retry por lote)."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("max_retries", 0)
+        super().__init__(**kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RateLimitedOpenAIEmbedding"
+
+    def _get_limiter(self) -> OpenAIRateLimiter:
+        return get_rate_limiter(
+            self.model_name,
+            settings.OPENAI_EMBEDDING_RPM,
+            settings.OPENAI_EMBEDDING_TPM,
+        )
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_limiter().call(lambda: super(RateLimitedOpenAIEmbedding, self)._get_query_embedding(query), estimate_tokens([query]))
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._get_limiter().acall(lambda: super(RateLimitedOpenAIEmbedding, self)._aget_query_embedding(query), estimate_tokens([query]))
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_limiter().call(lambda: super(RateLimitedOpenAIEmbedding, self)._get_text_embedding(text), estimate_tokens([text]))
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await self._get_limiter().acall(lambda: super(RateLimitedOpenAIEmbedding, self)._aget_text_embedding(text), estimate_tokens([text]))
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._get_limiter().call(lambda: super(RateLimitedOpenAIEmbedding, self)._get_text_embeddings(texts), estimate_tokens(texts))
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._get_limiter().acall(lambda: super(RateLimitedOpenAIEmbedding, self)._aget_text_embeddings(texts), estimate_tokens(texts))
+
+
+class RateLimitedOpenAI(OpenAI):
+    """LLM da OpenAI cujas chamadas passam pelo OpenAIRateLimiter."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("max_retries", 0)
+        super().__init__(**kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RateLimitedOpenAI"
+
+    def _get_limiter(self) -> OpenAIRateLimiter:
+        return get_rate_limiter(self.model, settings.OPENAI_CHAT_RPM, settings.OPENAI_CHAT_TPM)
+
+    def _estimate(self, prompt: str) -> int:
+        return estimate_tokens([prompt]) + (self.max_tokens or 512)
+
+    def _chat(self, messages, **kwargs):
+        tokens = self._estimate("".join(str(m.content) for m in messages))
+        return self._get_limiter().call(lambda: super(RateLimitedOpenAI, self)._chat(messages, **kwargs), tokens)
+
+    async def _achat(self, messages, **kwargs):
+        tokens = self._estimate("".join(str(m.content) for m in messages))
+        return await self._get_limiter().acall(lambda: super(RateLimitedOpenAI, self)._achat(messages, **kwargs), tokens)
+
+    def _complete(self, prompt, **kwargs):
+        return self._get_limiter().call(lambda: super(RateLimitedOpenAI, self)._complete(prompt, **kwargs), self._estimate(prompt))
+
+    async def _acomplete(self, prompt, **kwargs):
+        return await self._get_limiter().acall(lambda: super(RateLimitedOpenAI, self)._acomplete(prompt, **kwargs), self._estimate(prompt))
+
+
+def get_llm():
+    return RateLimitedOpenAI(
+        model=settings.LLM_MODEL,
+        api_key=config("OPENAI_API_KEY"),
+    )
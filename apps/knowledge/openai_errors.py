@@ -0,0 +1,11 @@
+import openai
+
+
+# Erros transitórios que o OpenAIRateLimiter repete chamada a chamada. Fica fora de
+# openai_client para que as tasks possam usá-lo sem importar o llama_index.
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
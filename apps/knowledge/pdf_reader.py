@@ -0,0 +1,52 @@
+import logging
+from pathlib import Path
+from typing import Iterator
+
+from llama_index.core import Document
+from llama_index.core.readers.file.base import default_file_metadata_func
+
+
+logger = logging.getLogger(__name__)
+
+# Mesmos metadados que o SimpleDirectoryReader deixa fora do embedding e do prompt
+EXCLUDED_FILE_METADATA_KEYS = [
+    "file_name",
+    "file_type",
+    "file_size",
+    "creation_date",
+    "last_modified_date",
+    "last_accessed_date",
+]
+
+# Páginas lidas entre limpezas do cache de objetos do pypdf
+_CACHE_CLEAR_PAGES = 16
+
+
+def iter_pdf_pages(file_path: str) -> Iterator[Document]:
+    """
+    Lê o PDF página a página, devolvendo um Document por página com os mesmos
+    metadados do SimpleDirectoryReader (page_label, file_name, file_path, ...).
+
+    O arquivo é lido sob demanda e o cache de objetos já resolvidos do pypdf é
+    descartado periodicamente, então a memória não cresce com o número de páginas.
+    """
+    import pypdf
+
+    file_metadata = default_file_metadata_func(str(file_path))
+    file_name = Path(file_path).name
+
+    with open(file_path, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        labels = reader.page_labels
+
+        for i in range(len(reader.pages)):
+            doc = Document(
+                text=reader.pages[i].extract_text(),
+                metadata={"page_label": labels[i], "file_name": file_name, **file_metadata},
+            )
+            doc.excluded_embed_metadata_keys.extend(EXCLUDED_FILE_METADATA_KEYS)
+            doc.excluded_llm_metadata_keys.extend(EXCLUDED_FILE_METADATA_KEYS)
+            yield doc
+
+            if (i + 1) % _CACHE_CLEAR_PAGES == 0:
+                reader.resolved_objects.clear()
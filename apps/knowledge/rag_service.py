@@ -1,103 +1,749 @@
+import asyncio
+import hashlib
 import logging
+import os
+import re
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
 
 import chromadb
+import numpy as np
 from decouple import config
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, StorageContext
-from llama_index.core.vector_stores import ExactMatchFilter, MetadataFilters
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.llms.openai import OpenAI
+from django.conf import settings
+from django.utils import timezone
+from llama_index.core import QueryBundle, Settings, VectorStoreIndex, StorageContext, get_response_synthesizer
+from llama_index.core.callbacks import CallbackManager, TokenCountingHandler
+from llama_index.core.indices.utils import embed_nodes
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import MetadataMode, TextNode
+from llama_index.core.vector_stores import (
+    ExactMatchFilter,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+    VectorStoreQuery,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
 from llama_index.vector_stores.chroma import ChromaVectorStore
 
+from .corpus import NO_ANSWER_MESSAGE, get_corpus, invalidate_corpus
+from .embeddings import get_collection_name, get_embed_model, get_embedding_signature
+from .models import Knowledge
+from .openai_client import get_llm
+from .pdf_reader import iter_pdf_pages
+from .vector_store import NumpyVectorStore
+
 
 OPENAI_API_KEY = config("OPENAI_API_KEY")
 logger = logging.getLogger(__name__)
 COLLECTION_NAME = "rag_chunks"
+# Índice pequeno com um vetor-resumo por documento (e por seção), usado para rotear as perguntas
+SUMMARY_COLLECTION_NAME = "rag_summaries"
+SIMILARITY_TOP_K = 5
+
+# Clientes do Chroma por processo e configuração: cada HttpClient novo abre o próprio
+# pool de conexões, e a memória de um cliente descartado não volta para o sistema
+_chroma_clients = {}
+
+# Marcadores baratos de pergunta composta: sem eles, a pergunta não passa pela decomposição
+COMPOUND_QUESTION_PATTERN = re.compile(
+    r"\b(compar\w*|diferen[çc]\w*|versus|vs\.?|em rela[çc][ãa]o [aào]|tanto\b.+\bquanto|ambos|ambas)\b",
+    re.IGNORECASE,
+)
+DECOMPOSE_PROMPT = (
+    "Divida a pergunta abaixo em no máximo {max_questions} sub-perguntas independentes, "
+    "cada uma respondível com trechos de um único documento. Escreva uma sub-pergunta por "
+    "linha, sem numeração nem comentários. Se a pergunta já for simples, repita-a sem "
+    "alterações.\n\nPergunta: {question}\n"
+)
+
+
+class _SummaryAccumulator:
+    """
+    Soma os embeddings dos chunks por documento e por bloco de DOCUMENT_SECTION_PAGES
+    páginas, sem guardar os chunks; `build()` devolve os nós-resumo (centróides).
+    """
+
+    def __init__(self, section_pages: int):
+        self.section_pages = section_pages
+        self.documents = {}
+
+    def add(self, nodes):
+        for node in nodes:
+            knowledge_id = node.metadata.get("knowledge_id")
+            if not knowledge_id or node.embedding is None:
+                continue
+
+            document = self.documents.get(knowledge_id)
+            if document is None:
+                document = self.documents[knowledge_id] = {
+                    "metadata": node.metadata,
+                    "sum": 0.0,
+                    "count": 0,
+                    "pages": {},
+                    "sections": defaultdict(lambda: [0.0, 0]),
+                }
+
+            vector = np.asarray(node.embedding, dtype=np.float64)
+            document["sum"] = document["sum"] + vector
+            document["count"] += 1
+
+            # Ordem de primeira aparição da página dentro do documento
+            page = document["pages"].setdefault(node.metadata.get("page_label", ""), len(document["pages"]))
+            if self.section_pages:
+                section = document["sections"][page // self.section_pages]
+                section[0] = section[0] + vector
+                section[1] += 1
+
+    @staticmethod
+    def _summary(node_id, text, total, count, first, **metadata):
+        centroid = total / count
+        centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+        return TextNode(
+            id_=node_id,
+            text=text,
+            embedding=centroid.tolist(),
+            metadata={
+                "user_id": first["user_id"],
+                "knowledge_id": first["knowledge_id"],
+                "title": first.get("title", ""),
+                **metadata,
+            },
+        )
+
+    def build(self):
+        summaries = []
+        for knowledge_id, document in self.documents.items():
+            first = document["metadata"]
+            title = first.get("title", "")
+            summaries.append(self._summary(
+                f"{knowledge_id}:document", title, document["sum"], document["count"], first, level="document",
+            ))
+
+            pages = list(document["pages"])
+            if not self.section_pages or len(pages) <= self.section_pages:
+                continue
+            for index, (total, count) in sorted(document["sections"].items()):
+                start = index * self.section_pages
+                label = f"{pages[start]}-{pages[min(start + self.section_pages, len(pages)) - 1]}"
+                summaries.append(self._summary(
+                    f"{knowledge_id}:section:{index}",
+                    f"{title} (páginas {label})",
+                    total,
+                    count,
+                    first,
+                    level="section",
+                    pages=label,
+                ))
+        return summaries
+
 
 class RAG_Service:
 
     @staticmethod
     def _get_chroma_client():
-        host = config("CHROMADB_HOST", default="localhost")
-        port = config("CHROMADB_PORT", default="8001")
-        return chromadb.HttpClient(host=host, port=port)
+        if settings.VECTOR_STORE_BACKEND == "persistent":
+            key = (os.getpid(), "persistent", str(settings.CHROMADB_PATH))
+        else:
+            key = (os.getpid(), "http", config("CHROMADB_HOST", default="localhost"), config("CHROMADB_PORT", default="8001"))
+
+        client = _chroma_clients.get(key)
+        if client is None:
+            if key[1] == "persistent":
+                client = chromadb.PersistentClient(path=key[2])
+            else:
+                client = chromadb.HttpClient(host=key[2], port=key[3])
+            _chroma_clients[key] = client
+        return client
 
     @staticmethod
-    def _get_chroma_collection():
+    def _get_chroma_collection(name: str = None):
+        # Cada modelo de embedding tem sua coleção, evitando misturar espaços vetoriais
         client = RAG_Service._get_chroma_client()
         return client.get_or_create_collection(
-            COLLECTION_NAME,
-            metadata={"description": "Coleção para chunks de documentos RAG"},
+            name or get_collection_name(COLLECTION_NAME),
+            metadata={
+                "description": "Coleção para chunks de documentos RAG",
+                "embedding_model": get_embedding_signature(),
+            },
+        )
+
+    @staticmethod
+    def _get_vector_store(name: str = None):
+        """Vector store do backend configurado em VECTOR_STORE_BACKEND (http, persistent ou numpy)."""
+        name = name or get_collection_name(COLLECTION_NAME)
+        if settings.VECTOR_STORE_BACKEND == "numpy":
+            return NumpyVectorStore(
+                Path(settings.NUMPY_VECTOR_STORE_PATH) / name,
+                dtype=settings.NUMPY_VECTOR_STORE_DTYPE,
+                oversample=settings.NUMPY_VECTOR_STORE_OVERSAMPLE,
+                cache_shards=settings.NUMPY_VECTOR_STORE_CACHE_SHARDS,
+            )
+        return ChromaVectorStore(chroma_collection=RAG_Service._get_chroma_collection(name))
+
+    @staticmethod
+    def _tag_document(doc, user_id: str, title: str, knowledge_id: str = None):
+        doc.metadata["user_id"] = str(user_id)
+        doc.metadata["title"] = title
+        # Preenchido por chunk em _split_documents
+        doc.excluded_embed_metadata_keys.append("content_hash")
+        doc.excluded_llm_metadata_keys.append("content_hash")
+        if knowledge_id:
+            doc.metadata["knowledge_id"] = str(knowledge_id)
+            # Identificador interno: não entra no texto de embedding nem no prompt
+            doc.excluded_embed_metadata_keys.append("knowledge_id")
+            doc.excluded_llm_metadata_keys.append("knowledge_id")
+        return doc
+
+    @staticmethod
+    def _iter_pdf(file_path: str, user_id: str, title: str, knowledge_id: str = None):
+        """Páginas do PDF, uma por vez, já com os metadados do usuário e do documento."""
+        for doc in iter_pdf_pages(file_path):
+            yield RAG_Service._tag_document(doc, user_id, title, knowledge_id)
+
+    @staticmethod
+    def _get_summary_store():
+        return RAG_Service._get_vector_store(get_collection_name(SUMMARY_COLLECTION_NAME))
+
+    @staticmethod
+    def _delete_summaries(filters: MetadataFilters):
+        store = RAG_Service._get_summary_store()
+        # O ChromaVectorStore não apaga só por filtro (envia ids=[], recusado pelo chromadb)
+        node_ids = [n.node_id for n in store.get_nodes(None, filters=filters)]
+        if node_ids:
+            store.delete_nodes(node_ids=node_ids)
+
+    @staticmethod
+    def _build_summary_nodes(nodes):
+        """
+        Vetores-resumo por documento: o centróide normalizado dos embeddings dos seus
+        chunks e, com DOCUMENT_SECTION_PAGES, um centróide para cada bloco de páginas.
+        Não custa chamadas extras à API, pois reaproveita os embeddings da ingestão.
+        """
+        accumulator = _SummaryAccumulator(settings.DOCUMENT_SECTION_PAGES)
+        accumulator.add(nodes)
+        return accumulator.build()
+
+    @staticmethod
+    def _content_hash(node) -> str:
+        return hashlib.sha256(node.get_content(metadata_mode=MetadataMode.NONE).encode()).hexdigest()
+
+    @staticmethod
+    def _split_documents(docs):
+        """Mesmos chunks do VectorStoreIndex.from_documents, com o hash do conteúdo de cada um."""
+        nodes = run_transformations(docs, Settings.transformations, show_progress=True)
+        for node in nodes:
+            node.metadata["content_hash"] = RAG_Service._content_hash(node)
+        return nodes
+
+    @staticmethod
+    def _embed_nodes(nodes):
+        """Embedda só os chunks que ainda não têm vetor."""
+        embeddings = embed_nodes(nodes, get_embed_model(), show_progress=True)
+        for node in nodes:
+            node.embedding = embeddings[node.node_id]
+
+    @staticmethod
+    def _document_filters(user_id: str, knowledge_id: str):
+        return MetadataFilters(filters=[
+            ExactMatchFilter(key="user_id", value=str(user_id)),
+            ExactMatchFilter(key="knowledge_id", value=str(knowledge_id)),
+        ])
+
+    @staticmethod
+    def _windows(docs):
+        """Páginas de `docs` (lista ou gerador) em janelas de INGESTION_PAGE_WINDOW."""
+        window = []
+        for doc in docs:
+            window.append(doc)
+            if len(window) >= settings.INGESTION_PAGE_WINDOW:
+                yield window
+                window = []
+        if window:
+            yield window
+
+    @staticmethod
+    @contextmanager
+    def _chunk_writer(vector_store):
+        """
+        Função que grava os chunks de uma janela. No backend numpy as janelas vão para
+        segmentos no disco e o shard é reescrito uma única vez, ao sair do bloco; no
+        Chroma cada janela é gravada direto, em lotes do tamanho aceito pelo servidor
+        (o ChromaVectorStore só divide acima de 41665 itens).
+        """
+        if isinstance(vector_store, NumpyVectorStore):
+            with vector_store.bulk_replace() as staged:
+                yield staged.add
+            return
+
+        def add(nodes):
+            for batch in RAG_Service._chroma_batches(nodes):
+                vector_store.add(batch)
+
+        yield add
+
+    @staticmethod
+    def _index_documents(docs):
+        """
+        Indexa páginas em janelas de INGESTION_PAGE_WINDOW: cada janela é dividida em
+        chunks, embeddada e gravada antes de a próxima ser lida, então a memória não
+        cresce com o tamanho do PDF. `docs` pode ser um gerador. Devolve o número de
+        chunks por knowledge_id.
+        """
+        summaries = _SummaryAccumulator(settings.DOCUMENT_SECTION_PAGES)
+        chunks = Counter()
+
+        with RAG_Service._chunk_writer(RAG_Service._get_vector_store()) as write:
+            for window in RAG_Service._windows(docs):
+                # Embeddados aqui (e não no VectorStoreIndex) para reaproveitar os vetores nos resumos
+                nodes = RAG_Service._split_documents(window)
+                RAG_Service._embed_nodes(nodes)
+                write(nodes)
+                summaries.add(nodes)
+                chunks.update(node.metadata.get("knowledge_id") for node in nodes)
+
+        summary_nodes = summaries.build()
+        if summary_nodes:
+            RAG_Service._get_summary_store().add(summary_nodes)
+
+        return chunks
+
+    @staticmethod
+    def _get_document_chunks(user_id: str, knowledge_id: str, embeddings: bool = True):
+        """Chunks atuais de um documento, com os embeddings se `embeddings`."""
+        if settings.VECTOR_STORE_BACKEND == "numpy":
+            return RAG_Service._get_vector_store().get_nodes(
+                filters=RAG_Service._document_filters(user_id, knowledge_id),
+                include_embeddings=embeddings,
+            )
+
+        where = [{"user_id": str(user_id)}, {"knowledge_id": str(knowledge_id)}]
+        hidden = get_corpus(user_id)["hidden_chunk_versions"]
+        if hidden:
+            where.append({"chunk_version": {"$nin": hidden}})
+        batch = RAG_Service._get_chroma_collection().get(
+            where={"$and": where},
+            include=["documents", "metadatas"] + (["embeddings"] if embeddings else []),
         )
+        nodes = []
+        for i, (text, metadata) in enumerate(zip(batch["documents"], batch["metadatas"])):
+            node = metadata_dict_to_node(metadata, text=text)
+            if embeddings:
+                node.embedding = list(batch["embeddings"][i])
+            nodes.append(node)
+        return nodes
 
     @staticmethod
-    def ingest_pdf(file_path: str, user_id: str, title: str):
+    def _get_document_chunk_hashes(user_id: str, knowledge_id: str) -> list:
+        """(id, hash do conteúdo) dos chunks atuais de um documento, sem textos nem embeddings."""
+        if settings.VECTOR_STORE_BACKEND == "numpy":
+            records = RAG_Service._get_vector_store().get_records(
+                filters=RAG_Service._document_filters(user_id, knowledge_id)
+            )
+        else:
+            where = [{"user_id": str(user_id)}, {"knowledge_id": str(knowledge_id)}]
+            hidden = get_corpus(user_id)["hidden_chunk_versions"]
+            if hidden:
+                where.append({"chunk_version": {"$nin": hidden}})
+            batch = RAG_Service._get_chroma_collection().get(where={"$and": where}, include=["metadatas"])
+            records = zip(batch["ids"], batch["metadatas"])
+
+        hashes = [(node_id, metadata.get("content_hash")) for node_id, metadata in records]
+        if all(content_hash for _, content_hash in hashes):
+            return hashes
+        # Chunks anteriores ao hash guardado nos metadados têm o hash recalculado
+        return [
+            (node.node_id, node.metadata.get("content_hash") or RAG_Service._content_hash(node))
+            for node in RAG_Service._get_document_chunks(user_id, knowledge_id, embeddings=False)
+        ]
+
+    @staticmethod
+    def _get_chunk_embeddings(user_id: str, knowledge_id: str, node_ids: list) -> dict:
+        """Embeddings guardados dos chunks `node_ids` de um documento, por id."""
+        if not node_ids:
+            return {}
+        if settings.VECTOR_STORE_BACKEND == "numpy":
+            return RAG_Service._get_vector_store().get_embeddings(
+                node_ids, filters=RAG_Service._document_filters(user_id, knowledge_id),
+            )
+
+        collection = RAG_Service._get_chroma_collection()
+        embeddings = {}
+        for batch in RAG_Service._chroma_batches(list(node_ids)):
+            result = collection.get(ids=batch, include=["embeddings"])
+            embeddings.update(zip(result["ids"], (list(e) for e in result["embeddings"])))
+        return embeddings
+
+    @staticmethod
+    def _chroma_batches(items: list):
+        """Fatias de `items` no tamanho máximo que o Chroma aceita por chamada."""
+        size = RAG_Service._get_chroma_client().get_max_batch_size()
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+
+    @staticmethod
+    def _set_hidden_chunk_versions(user_id: str, knowledge_id: str, **versions):
+        # Um único UPDATE no banco: é o que torna a troca atômica para as consultas
+        Knowledge.objects.filter(pk=knowledge_id).update(**versions, updated_at=timezone.now())
+        invalidate_corpus(user_id)
+
+    @staticmethod
+    @contextmanager
+    def _replacing_document_chunks(user_id: str, knowledge_id: str, old_ids: list):
+        """
+        Função que grava os chunks novos de um documento, janela a janela; ao sair do
+        bloco eles substituem `old_ids` sem que uma consulta veja o documento pela
+        metade. Se o bloco falhar, a versão antiga continua valendo.
+
+        No backend numpy as janelas vão para segmentos no disco e a troca é uma única
+        reescrita do shard do usuário. No Chroma, que limita o tamanho de cada chamada,
+        os chunks novos entram em lotes com um `chunk_version` que as consultas ainda
+        excluem (pending_chunk_version do Knowledge) e os antigos recebem outra versão.
+        A troca é um único UPDATE no Knowledge, que passa a esconder a versão antiga no
+        lugar da nova; só então os antigos são apagados, também em lotes.
+        """
+        if settings.VECTOR_STORE_BACKEND == "numpy":
+            with RAG_Service._get_vector_store().bulk_replace(old_ids) as staged:
+                yield staged.add
+            return
+
+        collection = RAG_Service._get_chroma_collection()
+        document = [{"user_id": str(user_id)}, {"knowledge_id": str(knowledge_id)}]
+
+        # Restos de uma atualização anterior que falhou no meio
+        previous = Knowledge.objects.filter(pk=knowledge_id).values_list(
+            "pending_chunk_version", "retired_chunk_version"
+        ).first() or ()
+        leftovers = [version for version in previous if version]
+        if leftovers:
+            collection.delete(where={"$and": document + [{"chunk_version": {"$in": leftovers}}]})
+
+        new_version, old_version = uuid.uuid4().hex, uuid.uuid4().hex
+        RAG_Service._set_hidden_chunk_versions(
+            user_id, knowledge_id, pending_chunk_version=new_version, retired_chunk_version=""
+        )
+
+        def add(nodes):
+            for batch in RAG_Service._chroma_batches(nodes):
+                metadatas = []
+                for node in batch:
+                    metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=True)
+                    metadatas.append({**{k: "" if v is None else v for k, v in metadata.items()}, "chunk_version": new_version})
+                collection.add(
+                    ids=[n.node_id for n in batch],
+                    embeddings=[n.embedding for n in batch],
+                    metadatas=metadatas,
+                    documents=[n.get_content(metadata_mode=MetadataMode.NONE) for n in batch],
+                )
+
         try:
+            yield add
+        except Exception:
+            # Ainda escondidos; se a limpeza falhar, a próxima atualização os apaga
+            collection.delete(where={"$and": document + [{"chunk_version": new_version}]})
+            RAG_Service._set_hidden_chunk_versions(user_id, knowledge_id, pending_chunk_version="")
+            raise
 
-            reader = SimpleDirectoryReader(input_files=[file_path])
-            docs = reader.load_data()
-            del reader
+        # Ainda visíveis: a versão antiga só passa a ser escondida na troca
+        for batch in RAG_Service._chroma_batches(list(old_ids)):
+            collection.update(ids=batch, metadatas=[{"chunk_version": old_version}] * len(batch))
 
-            if len(docs) == 0:
-                logger.warning("Nenhum documento foi carregado do PDF")
-                return 0
+        RAG_Service._set_hidden_chunk_versions(
+            user_id, knowledge_id, pending_chunk_version="", retired_chunk_version=old_version
+        )
 
-            for d in docs:
-                d.metadata["user_id"] = str(user_id)
-                d.metadata["title"] = title
+        for batch in RAG_Service._chroma_batches(list(old_ids)):
+            collection.delete(ids=batch)
+        RAG_Service._set_hidden_chunk_versions(user_id, knowledge_id, retired_chunk_version="")
 
-            chroma_collection = RAG_Service._get_chroma_collection()
+    @staticmethod
+    def update_pdf(file_path: str, user_id: str, title: str, knowledge_id: str):
+        """
+        Re-ingestão incremental de um documento existente, nas mesmas janelas de
+        INGESTION_PAGE_WINDOW páginas da ingestão: só os chunks cujo conteúdo não
+        existia na versão anterior são embeddados; os demais reaproveitam o vetor
+        guardado, lido janela a janela. Retorna contadores da atualização.
+        """
+        # Só ids e hashes da versão anterior ficam em memória durante a atualização
+        old_ids, stored = [], {}
+        for node_id, content_hash in RAG_Service._get_document_chunk_hashes(user_id, knowledge_id):
+            old_ids.append(node_id)
+            stored.setdefault(content_hash, node_id)
 
-            vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-            storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        summaries = _SummaryAccumulator(settings.DOCUMENT_SECTION_PAGES)
+        new_hashes = set()
+        pages = chunks = reused = 0
 
-            index = VectorStoreIndex.from_documents(
-                docs,
-                storage_context=storage_context,
-                embed_model=OpenAIEmbedding(
-                    model="text-embedding-3-small",
-                    api_key=OPENAI_API_KEY,
-                ),
-                show_progress=True,
+        with RAG_Service._replacing_document_chunks(user_id, knowledge_id, old_ids) as write:
+            for window in RAG_Service._windows(RAG_Service._iter_pdf(file_path, user_id, title, knowledge_id)):
+                pages += len(window)
+                nodes = RAG_Service._split_documents(window)
+
+                reusable = {
+                    node.node_id: stored[node.metadata["content_hash"]]
+                    for node in nodes if node.metadata["content_hash"] in stored
+                }
+                embeddings = RAG_Service._get_chunk_embeddings(user_id, knowledge_id, list(set(reusable.values())))
+                for node in nodes:
+                    embedding = embeddings.get(reusable.get(node.node_id))
+                    if embedding is not None:
+                        node.embedding = embedding
+                        reused += 1
+
+                RAG_Service._embed_nodes(nodes)
+                write(nodes)
+                summaries.add(nodes)
+                chunks += len(nodes)
+                new_hashes.update(node.metadata["content_hash"] for node in nodes)
+
+            if not pages:
+                raise ValueError(f"Nenhum documento foi carregado do PDF {file_path}")
+
+        RAG_Service._delete_summaries(RAG_Service._document_filters(user_id, knowledge_id))
+        summary_nodes = summaries.build()
+        if summary_nodes:
+            RAG_Service._get_summary_store().add(summary_nodes)
+
+        return {
+            "chunks": chunks,
+            "embedded": chunks - reused,
+            "reused": reused,
+            "removed": sum(1 for h in stored if h not in new_hashes),
+        }
+
+    @staticmethod
+    def _route_documents(query_embedding, user_id: str, top_n: int):
+        """knowledge_ids dos `top_n` documentos do usuário mais próximos da pergunta."""
+        result = RAG_Service._get_summary_store().query(VectorStoreQuery(
+            query_embedding=query_embedding,
+            # Seções do mesmo documento ocupam vários resultados
+            similarity_top_k=top_n * 4,
+            filters=MetadataFilters(filters=[ExactMatchFilter(key="user_id", value=str(user_id))]),
+        ))
+
+        knowledge_ids = []
+        for node in result.nodes:
+            knowledge_id = node.metadata.get("knowledge_id")
+            if knowledge_id and knowledge_id not in knowledge_ids:
+                knowledge_ids.append(knowledge_id)
+        return knowledge_ids[:top_n]
+
+    @staticmethod
+    def ingest_pdf(file_path: str, user_id: str, title: str, knowledge_id: str = None):
+        pages = 0
+
+        def counted(docs):
+            nonlocal pages
+            for doc in docs:
+                pages += 1
+                yield doc
+
+        try:
+            chunks = RAG_Service._index_documents(
+                counted(RAG_Service._iter_pdf(file_path, user_id, title, knowledge_id))
             )
 
-            return len(docs)
+            if not pages:
+                logger.warning("Nenhum documento foi carregado do PDF")
+                return 0
+
+            return sum(chunks.values())
 
         except Exception as e:
             logger.error(f"Erro ao fazer ingestão do PDF: {e}", exc_info=True)
+            # Janelas anteriores à falha já foram gravadas
+            if knowledge_id:
+                RAG_Service.delete_knowledge(user_id, knowledge_id)
+            raise
+
+    @staticmethod
+    def ingest_pdfs(items: list, user_id: str):
+        """
+        Ingestão de vários PDFs em uma única passada: as páginas de todos os documentos
+        são lidas em sequência e indexadas nas mesmas janelas, com lotes de embedding
+        compartilhados entre arquivos.
+
+        `items` é uma lista de dicts com file_path, title e knowledge_id. Retorna o
+        número de chunks por knowledge_id; PDFs ilegíveis ou vazios ficam de fora.
+        """
+        pages = Counter()
+        failed = []
+
+        def read_all():
+            for item in items:
+                try:
+                    for doc in RAG_Service._iter_pdf(item["file_path"], user_id, item["title"], item["knowledge_id"]):
+                        pages[item["knowledge_id"]] += 1
+                        yield doc
+                except Exception as e:
+                    logger.error(f"Erro ao ler PDF {item['file_path']}: {e}", exc_info=True)
+                    failed.append(item["knowledge_id"])
+                    continue
+
+                if not pages[item["knowledge_id"]]:
+                    logger.warning(f"Nenhum documento foi carregado do PDF {item['file_path']}")
+
+        try:
+            chunks = RAG_Service._index_documents(read_all())
+        except Exception as e:
+            logger.error(f"Erro ao fazer ingestão em lote: {e}", exc_info=True)
+            for knowledge_id in pages:
+                RAG_Service.delete_knowledge(user_id, knowledge_id)
             raise
 
+        # PDFs que falharam no meio da leitura podem ter deixado páginas indexadas
+        for knowledge_id in failed:
+            if pages[knowledge_id]:
+                RAG_Service.delete_knowledge(user_id, knowledge_id)
+
+        return {
+            item["knowledge_id"]: chunks[item["knowledge_id"]]
+            for item in items
+            if pages[item["knowledge_id"]] and item["knowledge_id"] not in failed
+        }
+
+    @staticmethod
+    def delete_knowledge(user_id: str, knowledge_id: str):
+        """Remove os chunks e os resumos de um documento."""
+        filters = RAG_Service._document_filters(user_id, knowledge_id)
+        if settings.VECTOR_STORE_BACKEND == "numpy":
+            RAG_Service._get_vector_store().delete_nodes(filters=filters)
+        else:
+            RAG_Service._get_chroma_collection().delete(
+                where={"$and": [{"user_id": str(user_id)}, {"knowledge_id": str(knowledge_id)}]}
+            )
+        RAG_Service._delete_summaries(filters)
+
+    @staticmethod
+    def _question_filters(query_embedding, user_id: str) -> MetadataFilters:
+        filters = MetadataFilters(
+            filters=[
+                ExactMatchFilter(key="user_id", value=str(user_id))
+            ]
+        )
+
+        # Busca em dois estágios: escolhe os documentos pelo índice de resumos e
+        # procura chunks só dentro deles
+        # Chunks de trocas de PDF em andamento (ver _replacing_document_chunks)
+        hidden = get_corpus(user_id)["hidden_chunk_versions"]
+        if hidden:
+            filters.filters.append(MetadataFilter(key="chunk_version", value=hidden, operator=FilterOperator.NIN))
+
+        top_n = settings.DOCUMENT_ROUTING_TOP_N
+        if top_n:
+            knowledge_ids = RAG_Service._route_documents(query_embedding, user_id, top_n)
+            if knowledge_ids:
+                filters.filters.append(
+                    MetadataFilter(key="knowledge_id", value=knowledge_ids, operator=FilterOperator.IN)
+                )
+        return filters
+
+    @staticmethod
+    def _is_compound(question: str, user_id: str) -> bool:
+        """Heurística sem chamadas à API para decidir se vale decompor a pergunta."""
+        if question.count("?") > 1 or COMPOUND_QUESTION_PATTERN.search(question):
+            return True
+        # Cita dois ou mais documentos do usuário pelo título
+        lowered = question.lower()
+        titles = {title.lower() for title in get_corpus(user_id)["titles"] if len(title) >= 4}
+        return sum(1 for title in titles if title in lowered) >= 2
+
     @staticmethod
-    def answer_question(question: str, user_id: str):
+    def _decompose(question: str, llm) -> list:
+        text = llm.complete(
+            DECOMPOSE_PROMPT.format(max_questions=settings.SUBQUESTION_MAX, question=question)
+        ).text
+
+        sub_questions = []
+        for line in text.splitlines():
+            line = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip()
+            if line and line not in sub_questions:
+                sub_questions.append(line)
+        return sub_questions[:settings.SUBQUESTION_MAX]
+
+    @staticmethod
+    async def _aretrieve_subquestions(index, sub_questions: list, user_id: str, concurrent: bool = True):
+        """
+        Busca os chunks de cada sub-pergunta, com roteamento próprio por documento, e
+        une os resultados sem repetição. Embeddings e buscas rodam em threads: os vector
+        stores são síncronos, e o cliente async da OpenAI reaproveitado pelo modelo ficaria
+        preso ao loop do primeiro asyncio.run, já fechado nas perguntas seguintes. Em
+        paralelo, os embeddings das threads ainda saem em uma só chamada (micro-batching).
+        """
+        embed_model = get_embed_model()
+
+        async def retrieve(sub_question):
+            embedding = await asyncio.to_thread(embed_model.get_query_embedding, sub_question)
+            filters = await asyncio.to_thread(RAG_Service._question_filters, embedding, user_id)
+            retriever = index.as_retriever(similarity_top_k=SIMILARITY_TOP_K, filters=filters)
+            return await asyncio.to_thread(retriever.retrieve, QueryBundle(sub_question, embedding=embedding))
+
+        if concurrent:
+            results = await asyncio.gather(*(retrieve(q) for q in sub_questions))
+        else:
+            results = [await retrieve(q) for q in sub_questions]
+
+        # Chunk recuperado por mais de uma sub-pergunta fica com a maior pontuação
+        merged = {}
+        for nodes in results:
+            for node in nodes:
+                current = merged.get(node.node.node_id)
+                if current is None or (node.score or 0) > (current.score or 0):
+                    merged[node.node.node_id] = node
+        return sorted(merged.values(), key=lambda n: n.score or 0, reverse=True)
+
+    @staticmethod
+    def answer_question(question: str, user_id: str, usage: dict = None):
+        """
+        Responde a pergunta com os documentos do usuário. Se `usage` for passado, recebe
+        prompt_tokens e completion_tokens das chamadas ao LLM.
+
+        Com SUBQUESTION_DECOMPOSITION, perguntas compostas ("compare X no documento A com
+        Y no B") são divididas pelo LLM em sub-perguntas, buscadas em paralelo, e os
+        chunks de todas vão para uma única síntese com a pergunta original.
+        """
         try:
-            chroma_collection = RAG_Service._get_chroma_collection()
-            vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+            vector_store = RAG_Service._get_vector_store()
             storage_context = StorageContext.from_defaults(vector_store=vector_store)
 
             index = VectorStoreIndex.from_vector_store(
                 vector_store=vector_store,
                 storage_context=storage_context,
-                embed_model=OpenAIEmbedding(
-                    model="text-embedding-3-small",
-                    api_key=OPENAI_API_KEY,
-                ),
+                embed_model=get_embed_model(),
             )
 
-            filters = MetadataFilters(
-                filters=[
-                    ExactMatchFilter(key="user_id", value=str(user_id))
-                ]
-            )
+            token_counter = TokenCountingHandler()
 
-            query_engine = index.as_query_engine(
-                llm=OpenAI(
-                    model="gpt-4o-mini",
-                    api_key=OPENAI_API_KEY,
-                ),
-                similarity_top_k=5,
-                filters=filters,
-            )
+            # Contador por pergunta, e não em Settings: o worker de respostas roda várias em threads
+            callback_manager = CallbackManager([token_counter])
+            llm = get_llm()
+            # Também passa o callback_manager ao LLM, então a decomposição entra na contagem
+            response_synthesizer = get_response_synthesizer(llm=llm, callback_manager=callback_manager)
+
+            sub_questions = []
+            if settings.SUBQUESTION_DECOMPOSITION and RAG_Service._is_compound(question, user_id):
+                sub_questions = RAG_Service._decompose(question, llm)
+
+            if len(sub_questions) > 1:
+                nodes = asyncio.run(RAG_Service._aretrieve_subquestions(index, sub_questions, user_id))
+                response = response_synthesizer.synthesize(question, nodes=nodes)
+            else:
+                query_bundle = QueryBundle(question, embedding=get_embed_model().get_query_embedding(question))
+                filters = RAG_Service._question_filters(query_bundle.embedding, user_id)
 
-            response = query_engine.query(question)
+                query_engine = RetrieverQueryEngine(
+                    retriever=index.as_retriever(similarity_top_k=SIMILARITY_TOP_K, filters=filters),
+                    response_synthesizer=response_synthesizer,
+                    callback_manager=callback_manager,
+                )
+                response = query_engine.query(query_bundle)
+
+            if usage is not None:
+                usage["prompt_tokens"] = token_counter.prompt_llm_token_count
+                usage["completion_tokens"] = token_counter.completion_llm_token_count
 
             response_str = ""
             if hasattr(response, "response") and response.response:
@@ -107,12 +753,9 @@ class RAG_Service:
                 response_str = str(response) if response else ""
 
             if not response_str or response_str.strip() in ("", "Empty Response"):
-                response_str = (
-                    "Desculpe, não encontrei informações relevantes para responder "
-                    "sua pergunta nos documentos disponíveis."
-                )
+                response_str = NO_ANSWER_MESSAGE
             return response_str
 
         except Exception as e:
             logger.error(f"Erro ao responder pergunta: {e}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
@@ -1,5 +1,12 @@
+import zipfile
+
+from django.conf import settings
 from rest_framework import serializers
-from .models import Knowledge, Message
+from .models import IngestionJob, Knowledge, Message
+
+
+PDF_CONTENT_TYPES = ['application/pdf', 'application/x-pdf']
+ZIP_CONTENT_TYPES = ['application/zip', 'application/x-zip-compressed']
 
 
 class KnowledgeSerializer(serializers.ModelSerializer):
@@ -15,16 +22,62 @@ class KnowledgeUploadSerializer(serializers.Serializer):
     file = serializers.FileField()
 
     def validate_file(self, value):
-        if value.content_type not in ['application/pdf', 'application/x-pdf']:
+        if value.content_type not in PDF_CONTENT_TYPES:
             raise serializers.ValidationError('Envie um arquivo PDF válido.')
         if value.size == 0:
             raise serializers.ValidationError('Arquivo vazio.')
         return value
 
 
+class KnowledgeBulkUploadSerializer(serializers.Serializer):
+    files = serializers.ListField(child=serializers.FileField(), allow_empty=False)
+
+    def validate_files(self, value):
+        count, total = 0, 0
+        for f in value:
+            if f.content_type not in PDF_CONTENT_TYPES + ZIP_CONTENT_TYPES:
+                raise serializers.ValidationError('Envie arquivos PDF ou ZIP com PDFs.')
+            if f.size == 0:
+                raise serializers.ValidationError(f'Arquivo vazio: {f.name}')
+
+            sizes = [(f.name, f.size)]
+            if f.content_type in ZIP_CONTENT_TYPES:
+                valid_zip = zipfile.is_zipfile(f)
+                f.seek(0)
+                if not valid_zip:
+                    raise serializers.ValidationError(f'ZIP inválido: {f.name}')
+                # Tamanhos descompactados do índice do ZIP; a extração não passa deles
+                with zipfile.ZipFile(f) as archive:
+                    sizes = [(info.filename, info.file_size) for info in archive.infolist()]
+                f.seek(0)
+
+            for name, size in sizes:
+                if size > settings.BULK_UPLOAD_MAX_FILE_SIZE:
+                    raise serializers.ValidationError(
+                        f'Arquivo acima de {settings.BULK_UPLOAD_MAX_FILE_SIZE} bytes: {name}'
+                    )
+            count += len(sizes)
+            total += sum(size for _, size in sizes)
+            if count > settings.BULK_UPLOAD_MAX_FILES:
+                raise serializers.ValidationError(f'Envio acima de {settings.BULK_UPLOAD_MAX_FILES} arquivos.')
+            if total > settings.BULK_UPLOAD_MAX_TOTAL_SIZE:
+                raise serializers.ValidationError(
+                    f'Envio acima de {settings.BULK_UPLOAD_MAX_TOTAL_SIZE} bytes descompactados.'
+                )
+        return value
+
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = IngestionJob
+        fields = ['id', 'status', 'total', 'processed', 'failed', 'created_at', 'updated_at']
+
+
 class MessageSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     
     class Meta:
         model = Message
-        fields = ['id', 'user', 'content', 'author', 'created_at', 'updated_at'] 
\ No newline at end of file
+        fields = ['id', 'user', 'content', 'author', 'reply_to', 'status', 'created_at', 'updated_at']
+        read_only_fields = ['reply_to', 'status'] 
\ No newline at end of file
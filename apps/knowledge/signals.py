@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .corpus import invalidate_corpus
+from .models import Knowledge, Message, UsageRollup
+
+
+@receiver(post_save, sender=Knowledge)
+@receiver(post_delete, sender=Knowledge)
+def invalidate_corpus_cache(sender, instance, **kwargs):
+    invalidate_corpus(instance.user_id)
+
+
+@receiver(post_delete, sender=Message)
+def mark_usage_rollup_stale(sender, instance, **kwargs):
+    # Apagar não deixa rastro no updated_at das mensagens: marca o dia para ser recontado
+    UsageRollup.objects.filter(
+        user_id=instance.user_id, date=timezone.localdate(instance.created_at),
+    ).update(stale=True)
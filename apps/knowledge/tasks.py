@@ -1,17 +1,63 @@
 from pathlib import Path
 import os
 import time
+import uuid
 
-from celery import shared_task
+from celery import chord, shared_task
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .rag_service import RAG_Service
-from .models import Knowledge
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from .corpus import invalidate_corpus
+from .models import IngestionJob, Knowledge, Message
+from .openai_errors import RETRYABLE_ERRORS
+from .usage import refresh_usage_rollups
 
-@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={"max_retries": 3})
+
+# Tempo máximo que uma atualização de documento segura o lock do Knowledge
+KNOWLEDGE_UPDATE_LOCK_TIMEOUT = 30 * 60
+# Espera (s) antes de tentar de novo uma atualização cujo Knowledge está com o lock ocupado
+KNOWLEDGE_UPDATE_LOCK_WAIT = 10
+
+
+def message_status_cache_key(message_id) -> str:
+    """Chave que avisa o long-poll de /api/message/{id}/reply/ que a resposta ficou pronta."""
+    return f"message:status:{message_id}"
+
+
+def _remove_file(file_path_str: str):
+    if os.path.exists(file_path_str):
+        try:
+            time.sleep(0.5)
+            os.remove(file_path_str)
+        except PermissionError:
+            print("PermissionError")
+            time.sleep(2)
+            try:
+                os.remove(file_path_str)
+            except Exception:
+                print("Exception")
+                pass
+        except Exception:
+            print("Exception 01")
+            pass
+
+
+def _will_retry(task, error: Exception) -> bool:
+    """Se o autoretry do Celery vai repetir `task` depois de `error`."""
+    return not isinstance(error, RETRYABLE_ERRORS) and task.request.retries < task.max_retries
+
+
+# Erros transitórios da OpenAI já são repetidos lote a lote pelo OpenAIRateLimiter;
+# repetir a task inteira depois disso re-embeddaria o PDF todo
+@shared_task(bind=True, autoretry_for=(Exception,), dont_autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, retry_kwargs={"max_retries": 3})
 def ingest_pdf_and_create_knowledge(self, user_id: int,  file_path: str, title: str = "",):
     """
     Tarefa Celery que lê o PDF, executa ingestão (stub) e cria o Knowledge somente após sucesso.
     """
+    from .rag_service import RAG_Service
+
     User = get_user_model()
     file_path = Path(file_path)
 
@@ -19,27 +65,174 @@ def ingest_pdf_and_create_knowledge(self, user_id: int,  file_path: str, title:
         raise FileNotFoundError(f"Arquivo não encontrado para ingestão: {file_path}")
 
     user = User.objects.get(pk=user_id)
+    knowledge_id = uuid.uuid4()
 
+    retrying = False
     try:
-        RAG_Service.ingest_pdf(str(file_path), str(user_id), title)
-        knowledge = Knowledge.objects.create(user=user, title=title)
-        
+        chunks = RAG_Service.ingest_pdf(str(file_path), str(user_id), title, knowledge_id=str(knowledge_id))
+        knowledge = Knowledge.objects.create(id=knowledge_id, user=user, title=title, chunk_count=chunks)
+    except Exception as e:
+        retrying = _will_retry(self, e)
+        raise
     finally:
-        file_path_str = str(file_path)
-        if os.path.exists(file_path_str):
-            try:
-                time.sleep(0.5)
-                os.remove(file_path_str)
-            except PermissionError:
-                print("PermissionError")
-                time.sleep(2)
-                try:
-                    os.remove(file_path_str)
-                except Exception:
-                    print("Exception")
-                    pass
-            except Exception:
-                print("Exception 01")
-                pass
+        # Mantém o arquivo só enquanto a task ainda for repetida
+        if not retrying:
+            _remove_file(str(file_path))
 
     return {"status": "success", "user_id": user_id}
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), dont_autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, retry_kwargs={"max_retries": 3})
+def ingest_pdf_batch(self, job_id: str, user_id: int, files: list, delete_files: bool = True):
+    """
+    Ingestão de um lote de PDFs de um IngestionJob: embeddings em lotes compartilhados
+    entre os documentos, gravação única no Chroma e Knowledge criados com bulk_create.
+    """
+    from .rag_service import RAG_Service
+
+    items = [
+        {"file_path": f["file_path"], "title": f["title"], "knowledge_id": str(uuid.uuid4())}
+        for f in files
+        if Path(f["file_path"]).exists()
+    ]
+
+    retrying = False
+    try:
+        chunks = RAG_Service.ingest_pdfs(items, str(user_id))
+        Knowledge.objects.bulk_create([
+            Knowledge(id=item["knowledge_id"], user_id=user_id, title=item["title"], chunk_count=chunks[item["knowledge_id"]])
+            for item in items
+            if item["knowledge_id"] in chunks
+        ])
+        # bulk_create não dispara o post_save que invalida o corpus
+        invalidate_corpus(user_id)
+    except Exception as e:
+        retrying = _will_retry(self, e)
+        raise
+    finally:
+        # Mantém os arquivos só enquanto a task ainda for repetida
+        if delete_files and not retrying:
+            for f in files:
+                _remove_file(f["file_path"])
+
+    processed = len(chunks)
+    failed = len(files) - processed
+    IngestionJob.objects.filter(pk=job_id).update(
+        processed=F("processed") + processed,
+        failed=F("failed") + failed,
+    )
+    return {"processed": processed, "failed": failed}
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), dont_autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, retry_kwargs={"max_retries": 3})
+def update_knowledge_file(self, knowledge_id: str, user_id: int, file_path: str):
+    """
+    Substitui o PDF de um Knowledge existente, re-embeddando só os chunks que mudaram.
+    Atualizações do mesmo Knowledge são serializadas por um lock no cache.
+    """
+    from .rag_service import RAG_Service
+
+    if not Path(file_path).exists():
+        raise FileNotFoundError(f"Arquivo não encontrado para ingestão: {file_path}")
+
+    knowledge = Knowledge.objects.get(pk=knowledge_id, user_id=user_id, is_deleted=False)
+
+    lock_key = f"knowledge:update:{knowledge_id}"
+    if not cache.add(lock_key, self.request.id, timeout=KNOWLEDGE_UPDATE_LOCK_TIMEOUT):
+        # Outra versão do mesmo documento ainda está sendo aplicada. Reenfileira em vez de
+        # usar self.retry, que consumiria as tentativas reservadas para erros
+        self.apply_async(
+            kwargs={"knowledge_id": knowledge_id, "user_id": user_id, "file_path": file_path},
+            countdown=KNOWLEDGE_UPDATE_LOCK_WAIT,
+        )
+        return {"status": "waiting", "knowledge_id": knowledge_id}
+
+    retrying = False
+    try:
+        result = RAG_Service.update_pdf(file_path, str(user_id), knowledge.title, knowledge_id)
+        knowledge.chunk_count = result["chunks"]
+        knowledge.save(update_fields=["chunk_count", "updated_at"])
+    except Exception as e:
+        retrying = _will_retry(self, e)
+        raise
+    finally:
+        # Passado o timeout, o lock pode já ser de outra atualização: só libera o próprio
+        if cache.get(lock_key) == self.request.id:
+            cache.delete(lock_key)
+        # Mantém o arquivo só enquanto a task ainda for repetida
+        if not retrying:
+            _remove_file(file_path)
+
+    return {"status": "success", "knowledge_id": knowledge_id, **result}
+
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={"max_retries": 3})
+def delete_knowledge_chunks(user_id: int, knowledge_id: str):
+    """Remove do vector store os chunks e resumos de um Knowledge removido."""
+    from .rag_service import RAG_Service
+
+    RAG_Service.delete_knowledge(str(user_id), knowledge_id)
+    return {"status": "success", "knowledge_id": knowledge_id}
+
+
+# Roteada para a fila MESSAGE_ANSWER_QUEUE (CELERY_TASK_ROUTES), separada da ingestão
+@shared_task
+def answer_message(message_id: str):
+    """Responde em segundo plano uma pergunta enviada no modo assíncrono."""
+    from .rag_service import RAG_Service
+
+    message = Message.objects.get(pk=message_id)
+    status_key = message_status_cache_key(message_id)
+
+    started = time.monotonic()
+    usage = {}
+    try:
+        answer = RAG_Service.answer_question(question=message.content, user_id=str(message.user_id), usage=usage)
+    except Exception:
+        Message.objects.filter(pk=message_id).update(status="failed")
+        cache.set(status_key, "failed", timeout=settings.MESSAGE_REPLY_CACHE_TTL)
+        raise
+
+    with transaction.atomic():
+        reply = Message.objects.create(
+            user_id=message.user_id,
+            content=answer,
+            author="system",
+            reply_to=message,
+            latency_ms=round((time.monotonic() - started) * 1000),
+            **usage,
+        )
+        Message.objects.filter(pk=message_id).update(status="completed")
+    cache.set(status_key, "completed", timeout=settings.MESSAGE_REPLY_CACHE_TTL)
+
+    return {"status": "success", "message_id": message_id, "reply_id": str(reply.id)}
+
+
+@shared_task
+def rollup_usage():
+    """Task periódica (Celery beat) que atualiza os UsageRollup do painel do admin."""
+    return {"rollups": refresh_usage_rollups()}
+
+
+@shared_task
+def finalize_ingestion_job(results: list, job_id: str):
+    job = IngestionJob.objects.get(pk=job_id)
+    job.status = "completed" if job.processed else "failed"
+    job.save(update_fields=["status", "updated_at"])
+    return {"job_id": job_id, "processed": job.processed, "failed": job.failed}
+
+
+@shared_task
+def fail_ingestion_job(job_id: str):
+    IngestionJob.objects.filter(pk=job_id).update(status="failed")
+
+
+def dispatch_bulk_ingestion(job: IngestionJob, files: list, delete_files: bool = True):
+    """Divide os arquivos em lotes e dispara um chord: uma task por lote e a finalização do job."""
+    batch_size = settings.BULK_INGESTION_BATCH_SIZE
+    batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+
+    return chord(
+        ingest_pdf_batch.s(str(job.id), job.user_id, batch, delete_files)
+        for batch in batches
+    )(finalize_ingestion_job.s(str(job.id)).on_error(fail_ingestion_job.si(str(job.id))))
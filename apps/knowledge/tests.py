@@ -1,11 +1,52 @@
+import asyncio
+import io
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from pathlib import Path
 from unittest.mock import patch, MagicMock
-from django.test import TestCase
+
+import chromadb
+import httpx
+import openai
+from chromadb.api.models.Collection import Collection
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
-from rest_framework.test import APIClient
+from django.core.management import call_command
+from django.db import connection
+from llama_index.core import Document
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import MockLLM
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import ExactMatchFilter, FilterCondition, MetadataFilters, VectorStoreQuery
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
 
-from .models import Knowledge, Message
+from apps.accounts.authentication import CachedJWTAuthentication, _user_cache_key
+from .batching import MicroBatcher
+from .corpus import get_corpus, get_corpus_version
+from .embeddings import BatchedOpenAIEmbedding, get_collection_name
+from .management.commands.bench_ingest_memory import write_text_pdf
+from .models import IngestionJob, Knowledge, Message, UsageRollup
+from .openai_client import OpenAIRateLimiter
+from .pdf_reader import iter_pdf_pages
+from .rag_service import NO_ANSWER_MESSAGE, RAG_Service
+from .tasks import (
+    KNOWLEDGE_UPDATE_LOCK_WAIT, answer_message, ingest_pdf_and_create_knowledge, ingest_pdf_batch, update_knowledge_file,
+)
+from .usage import refresh_usage_rollups
+from .vector_store import NumpyVectorStore, _shard_cache
 
 
 class AuthEndpointsTest(TestCase):
@@ -70,6 +111,42 @@ class AuthEndpointsTest(TestCase):
         self.assertIn('access', response.data)
 
 
+class CachedJWTAuthenticationTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='Senha@123'
+        )
+        token = RefreshToken.for_user(self.user).access_token
+        self.request = APIRequestFactory().get('/api/knowledge/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_user_is_served_from_cache(self):
+        backend = CachedJWTAuthentication()
+        user, _ = backend.authenticate(self.request)
+        self.assertEqual(user, self.user)
+
+        with self.assertNumQueries(0):
+            user, _ = backend.authenticate(self.request)
+        self.assertEqual(user.email, 'test@example.com')
+        self.assertEqual(user, self.user)
+
+        cached = cache.get(_user_cache_key(self.user.id))
+        self.assertNotIn('password', cached)
+        self.assertNotIn(self.user.password, cached.values())
+
+    def test_saving_user_invalidates_cache(self):
+        backend = CachedJWTAuthentication()
+        backend.authenticate(self.request)
+
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            backend.authenticate(self.request)
+
+
 class KnowledgeEndpointsTest(TestCase):
     
     def setUp(self):
@@ -85,6 +162,8 @@ class KnowledgeEndpointsTest(TestCase):
         })
         self.token = login_response.data['access']
         self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
     
     def test_list_knowledge(self):
         Knowledge.objects.create(user=self.user, title='Knowledge 1')
@@ -96,7 +175,7 @@ class KnowledgeEndpointsTest(TestCase):
         self.assertEqual(len(response.data), 2)
         self.assertEqual(response.data[0]['title'], 'Knowledge 2')  
     
-    @patch('apps.knowledge.views.ingest_pdf_and_create_knowledge.delay')
+    @patch('apps.knowledge.tasks.ingest_pdf_and_create_knowledge.delay')
     def test_upload_knowledge(self, mock_task):
         mock_task.return_value = MagicMock(id='test-task-id')
         
@@ -116,6 +195,164 @@ class KnowledgeEndpointsTest(TestCase):
         mock_task.assert_called_once()
 
 
+    @patch('apps.knowledge.tasks.dispatch_bulk_ingestion')
+    def test_bulk_upload_knowledge(self, mock_dispatch):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('docs/a.pdf', b'%PDF-1.4 a')
+            zf.writestr('docs/notes.txt', b'ignorado')
+        files = [
+            SimpleUploadedFile("b.pdf", b'%PDF-1.4 b', content_type="application/pdf"),
+            SimpleUploadedFile("docs.zip", archive.getvalue(), content_type="application/zip"),
+        ]
+
+        response = self.client.post('/api/knowledge/bulk-upload/', {'files': files}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['job']['total'], 2)
+        job, saved = mock_dispatch.call_args[0]
+        self.assertEqual(sorted(f['title'] for f in saved), ['a', 'b'])
+
+        response = self.client.get(f'/api/knowledge/bulk-upload/{job.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'running')
+
+    @override_settings(BULK_UPLOAD_MAX_FILE_SIZE=1024, BULK_UPLOAD_MAX_TOTAL_SIZE=4096)
+    @patch('apps.knowledge.tasks.dispatch_bulk_ingestion')
+    def test_bulk_upload_rejects_zip_over_limits(self, mock_dispatch):
+        def zip_upload(members):
+            archive = io.BytesIO()
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for name, size in members:
+                    zf.writestr(name, b'0' * size)
+            return SimpleUploadedFile('docs.zip', archive.getvalue(), content_type='application/zip')
+
+        # Poucos bytes compactados, muitos descompactados
+        for members in ([('a.pdf', 100_000)], [(f'{i}.pdf', 1000) for i in range(5)]):
+            response = self.client.post('/api/knowledge/bulk-upload/', {'files': [zip_upload(members)]}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with override_settings(BULK_UPLOAD_MAX_FILES=2):
+            response = self.client.post(
+                '/api/knowledge/bulk-upload/', {'files': [zip_upload([(f'{i}.pdf', 10) for i in range(3)])]}, format='multipart',
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        mock_dispatch.assert_not_called()
+
+    @patch('apps.knowledge.tasks.update_knowledge_file.delay')
+    def test_replace_knowledge_file(self, mock_task):
+        knowledge = Knowledge.objects.create(user=self.user, title='Manual')
+        other = Knowledge.objects.create(
+            user=User.objects.create_user(username='outro', email='outro@example.com', password='Senha@123'),
+            title='Outro',
+        )
+
+        pdf_file = SimpleUploadedFile("manual-v2.pdf", b'%PDF-1.4 v2', content_type="application/pdf")
+        response = self.client.put(f'/api/knowledge/{knowledge.id}/file/', {'file': pdf_file}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(mock_task.call_args.kwargs['knowledge_id'], str(knowledge.id))
+
+        pdf_file = SimpleUploadedFile("outro.pdf", b'%PDF-1.4', content_type="application/pdf")
+        response = self.client.put(f'/api/knowledge/{other.id}/file/', {'file': pdf_file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(mock_task.call_count, 1)
+
+    @patch('apps.knowledge.rag_service.RAG_Service.update_pdf')
+    def test_update_waits_for_lock_without_spending_retries(self, mock_update):
+        knowledge = Knowledge.objects.create(user=self.user, title='Manual')
+        path = Path(self.tmp_dir) / 'manual-v2.pdf'
+        path.write_bytes(b'%PDF-1.4')
+        cache.add(f'knowledge:update:{knowledge.id}', 'outra-task')
+        kwargs = {'knowledge_id': str(knowledge.id), 'user_id': self.user.id, 'file_path': str(path)}
+
+        with patch.object(update_knowledge_file, 'apply_async') as mock_requeue:
+            result = update_knowledge_file.apply(kwargs=kwargs)
+
+        self.assertEqual(result.get()['status'], 'waiting')
+        mock_requeue.assert_called_once_with(kwargs=kwargs, countdown=KNOWLEDGE_UPDATE_LOCK_WAIT)
+        mock_update.assert_not_called()
+        self.assertTrue(path.exists())
+        self.assertEqual(cache.get(f'knowledge:update:{knowledge.id}'), 'outra-task')
+
+    @patch('apps.knowledge.rag_service.RAG_Service.update_pdf')
+    def test_update_does_not_release_a_lock_taken_by_another_update(self, mock_update):
+        knowledge = Knowledge.objects.create(user=self.user, title='Manual')
+        path = Path(self.tmp_dir) / 'manual-v2.pdf'
+        path.write_bytes(b'%PDF-1.4')
+        lock_key = f'knowledge:update:{knowledge.id}'
+
+        def expire_and_reacquire(*args):
+            # Timeout do lock estourado no meio da atualização e lock pego por outra task
+            cache.set(lock_key, 'outra-task')
+            return {'chunks': 2}
+
+        mock_update.side_effect = expire_and_reacquire
+        update_knowledge_file.apply(kwargs={'knowledge_id': str(knowledge.id), 'user_id': self.user.id, 'file_path': str(path)}).get()
+
+        self.assertEqual(cache.get(lock_key), 'outra-task')
+        knowledge.refresh_from_db()
+        self.assertEqual(knowledge.chunk_count, 2)
+
+    @patch('apps.knowledge.tasks.delete_knowledge_chunks.delay')
+    def test_delete_knowledge_removes_chunks(self, mock_delete):
+        knowledge = Knowledge.objects.create(user=self.user, title='Manual', chunk_count=3)
+        self.assertEqual(get_corpus(self.user.id)['titles'], ['Manual'])
+
+        response = self.client.delete(f'/api/knowledge/{knowledge.id}/')
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        knowledge.refresh_from_db()
+        self.assertTrue(knowledge.is_deleted)
+        mock_delete.assert_called_once_with(user_id=self.user.id, knowledge_id=str(knowledge.id))
+        self.assertEqual(get_corpus(self.user.id)['documents'], 0)
+
+    @patch('apps.knowledge.rag_service.RAG_Service.ingest_pdf', side_effect=[ValueError('falha transitória'), 3])
+    def test_ingest_pdf_keeps_file_for_retry(self, mock_ingest):
+        path = Path(self.tmp_dir) / 'manual.pdf'
+        path.write_bytes(b'%PDF-1.4')
+
+        result = ingest_pdf_and_create_knowledge.apply(args=(self.user.id, str(path), 'Manual'))
+
+        # A segunda tentativa ainda encontra o arquivo, que só então é removido
+        self.assertEqual(result.state, 'SUCCESS')
+        self.assertEqual(mock_ingest.call_count, 2)
+        self.assertEqual(Knowledge.objects.get(user=self.user).chunk_count, 3)
+        self.assertFalse(path.exists())
+
+    @patch('apps.knowledge.rag_service.RAG_Service.ingest_pdfs')
+    def test_ingest_pdf_batch_bulk_creates_knowledge(self, mock_ingest):
+        mock_ingest.side_effect = lambda items, user_id: {items[0]['knowledge_id']: 3}
+        job = IngestionJob.objects.create(user=self.user, total=2)
+        paths = []
+        for name in ('a.pdf', 'b.pdf'):
+            path = Path(self.tmp_dir) / name
+            path.write_bytes(b'%PDF-1.4')
+            paths.append({'file_path': str(path), 'title': path.stem})
+
+        result = ingest_pdf_batch.apply(args=(str(job.id), self.user.id, paths, False)).get()
+
+        self.assertEqual(result, {'processed': 1, 'failed': 1})
+        self.assertEqual(list(Knowledge.objects.filter(user=self.user).values_list('title', flat=True)), ['a'])
+        job.refresh_from_db()
+        self.assertEqual((job.processed, job.failed), (1, 1))
+
+    @patch('apps.knowledge.rag_service.RAG_Service.ingest_pdfs')
+    def test_ingest_pdf_batch_removes_files_when_openai_retries_are_exhausted(self, mock_ingest):
+        response = httpx.Response(429, request=httpx.Request('POST', 'https://api.openai.com/v1/embeddings'))
+        mock_ingest.side_effect = openai.RateLimitError('limite', response=response, body=None)
+        job = IngestionJob.objects.create(user=self.user, total=1)
+        path = Path(self.tmp_dir) / 'a.pdf'
+        path.write_bytes(b'%PDF-1.4')
+
+        result = ingest_pdf_batch.apply(args=(str(job.id), self.user.id, [{'file_path': str(path), 'title': 'a'}]))
+
+        # Sem repetição da task inteira: o arquivo não ficaria para trás
+        self.assertEqual(result.state, 'FAILURE')
+        self.assertFalse(path.exists())
+
+
 class MessageEndpointsTest(TestCase):
     
     def setUp(self):
@@ -141,9 +378,10 @@ class MessageEndpointsTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 2)
     
-    @patch('apps.knowledge.views.RAG_Service.answer_question')
+    @patch('apps.knowledge.rag_service.RAG_Service.answer_question')
     def test_send_message(self, mock_rag):
         mock_rag.return_value = "Esta é uma resposta do RAG"
+        Knowledge.objects.create(user=self.user, title='Manual', chunk_count=3)
         
         url = '/api/message/'
         data = {'content': 'Qual é a resposta?'}
@@ -155,4 +393,692 @@ class MessageEndpointsTest(TestCase):
         self.assertEqual(response.data['system_message']['author'], 'system')
         
         messages = Message.objects.filter(user=self.user)
-        self.assertEqual(messages.count(), 2)
\ No newline at end of file
+        self.assertEqual(messages.count(), 2)
+
+    @patch('apps.knowledge.rag_service.RAG_Service.answer_question')
+    @patch('apps.knowledge.tasks.answer_message.delay')
+    def test_send_message_async(self, mock_delay, mock_rag):
+        mock_rag.return_value = "Resposta assíncrona"
+        Knowledge.objects.create(user=self.user, title='Manual', chunk_count=3)
+
+        response = self.client.post('/api/message/?async=true', {'content': 'Qual é a resposta?'})
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        message_id = response.data['user_message']['id']
+        self.assertEqual(response.data['user_message']['status'], 'pending')
+        mock_delay.assert_called_once_with(message_id)
+
+        response = self.client.get(f'/api/message/{message_id}/reply/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIsNone(response.data['system_message'])
+
+        # Sem MESSAGE_REPLY_MAX_WAIT o long-poll não prende o worker
+        with patch('apps.knowledge.views.time.sleep') as mock_sleep:
+            response = self.client.get(f'/api/message/{message_id}/reply/?wait=5')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        mock_sleep.assert_not_called()
+
+        answer_message.apply(args=(message_id,)).get()
+
+        response = self.client.get(f'/api/message/{message_id}/reply/?wait=5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user_message']['status'], 'completed')
+        self.assertEqual(response.data['system_message']['content'], "Resposta assíncrona")
+        self.assertEqual(str(response.data['system_message']['reply_to']), message_id)
+
+
+    @patch('apps.knowledge.tasks.answer_message.delay')
+    @patch('apps.knowledge.rag_service.RAG_Service.answer_question')
+    def test_empty_corpus_skips_rag(self, mock_rag, mock_delay):
+        knowledge = Knowledge.objects.create(user=self.user, title='Vazio', chunk_count=0)
+
+        response = self.client.post('/api/message/?async=true', {'content': 'Qual é a resposta?'})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['system_message']['content'], NO_ANSWER_MESSAGE)
+        mock_rag.assert_not_called()
+        mock_delay.assert_not_called()
+        reply = Message.objects.get(author='system')
+        self.assertEqual((reply.no_documents, reply.cache_hit), (True, False))
+
+        version = get_corpus_version(self.user.id)
+        knowledge.chunk_count = 4
+        knowledge.save()
+        self.assertEqual(get_corpus(self.user.id)['chunks'], 4)
+        self.assertNotEqual(get_corpus_version(self.user.id), version)
+
+
+class EmbeddingBackendTest(TestCase):
+
+    def test_collection_name_per_embedding_model(self):
+        self.assertEqual(get_collection_name('rag_chunks'), 'rag_chunks')
+
+        with override_settings(EMBEDDING_BACKEND='onnx', EMBEDDING_MODEL='all-MiniLM-L6-v2'):
+            self.assertEqual(get_collection_name('rag_chunks'), 'rag_chunks__onnx-all-minilm-l6-v2')
+
+        with override_settings(EMBEDDING_DIMENSIONS=512):
+            self.assertEqual(get_collection_name('rag_chunks'), 'rag_chunks__openai-text-embedding-3-small-512d')
+
+    def test_micro_batcher_coalesces_concurrent_calls(self):
+        calls = []
+
+        def embed(texts):
+            calls.append(list(texts))
+            return [len(t) for t in texts]
+
+        batcher = MicroBatcher(embed, max_batch_size=8, max_wait_ms=200)
+        results = {}
+
+        def worker(text):
+            results[text] = batcher.run(text)
+
+        threads = [threading.Thread(target=worker, args=('x' * i,)) for i in range(1, 5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, {'x': 1, 'xx': 2, 'xxx': 3, 'xxxx': 4})
+        self.assertLess(len(calls), 4)
+
+        stats = batcher.stats()
+        self.assertEqual(stats['items'], 4)
+        self.assertEqual(stats['batches'], len(calls))
+
+    @patch('apps.knowledge.embeddings.get_embeddings')
+    def test_query_embeddings_share_one_api_call(self, mock_get_embeddings):
+        mock_get_embeddings.side_effect = lambda client, texts, engine, **kwargs: [[float(len(t))] for t in texts]
+        embed_model = BatchedOpenAIEmbedding(api_key='test', max_batch_size=8, max_wait_ms=200)
+        results = {}
+
+        def worker(question):
+            results[question] = embed_model.get_query_embedding(question)
+
+        threads = [threading.Thread(target=worker, args=('q' * i,)) for i in range(1, 4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, {'q': [1.0], 'qq': [2.0], 'qqq': [3.0]})
+        self.assertLess(mock_get_embeddings.call_count, 3)
+
+
+
+class OpenAIRateLimiterTest(TestCase):
+
+    def setUp(self):
+        # Porta sem Redis: o limitador cai para os limites locais ao processo
+        self.limiter = OpenAIRateLimiter(
+            name='test-model',
+            requests_per_minute=600,
+            tokens_per_minute=100000,
+            max_concurrency=2,
+            max_retries=3,
+            max_backoff=10,
+            redis_url='redis://localhost:1/0',
+        )
+
+    @patch('apps.knowledge.openai_client.time.sleep')
+    def test_retries_single_call_honoring_retry_after(self, mock_sleep):
+        response = httpx.Response(
+            429,
+            headers={'retry-after': '2'},
+            request=httpx.Request('POST', 'https://api.openai.com/v1/embeddings'),
+        )
+        fn = MagicMock(side_effect=[openai.RateLimitError('limite', response=response, body=None), 'ok'])
+
+        self.assertEqual(self.limiter.call(fn, tokens=10), 'ok')
+        self.assertEqual(fn.call_count, 2)
+        mock_sleep.assert_any_call(2.0)
+
+    @patch('apps.knowledge.openai_client.time.sleep')
+    def test_gives_up_after_max_retries(self, mock_sleep):
+        fn = MagicMock(side_effect=openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com')))
+
+        with self.assertRaises(openai.APIConnectionError):
+            self.limiter.call(fn)
+        self.assertEqual(fn.call_count, 4)
+
+    def test_redis_is_retried_after_cooldown(self):
+        self.limiter.wait_for_budget(1)
+        self.assertTrue(self.limiter._local)
+
+        with patch.object(self.limiter, '_take', return_value='0') as mock_take, \
+                patch.object(self.limiter._redis, 'get', return_value=None):
+            self.limiter.wait_for_budget(1)
+            mock_take.assert_not_called()
+
+            later = time.monotonic() + self.limiter.redis_cooldown + 1
+            with patch('apps.knowledge.openai_client.time.monotonic', return_value=later):
+                self.limiter.wait_for_budget(1)
+            self.assertEqual(mock_take.call_count, 2)
+
+
+class NumpyVectorStoreTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        self.nodes = [
+            TextNode(id_='a', text='a', embedding=[1.0, 0.0], metadata={'user_id': '1', 'knowledge_id': 'k1'}),
+            TextNode(id_='b', text='b', embedding=[0.8, 0.6], metadata={'user_id': '1', 'knowledge_id': 'k2'}),
+            TextNode(id_='c', text='c', embedding=[1.0, 0.0], metadata={'user_id': '2', 'knowledge_id': 'k3'}),
+        ]
+        self.store = NumpyVectorStore(self.tmp_dir)
+        self.store.add(self.nodes)
+
+    def _query(self, user_id):
+        return self.store.query(VectorStoreQuery(
+            query_embedding=[1.0, 0.0],
+            similarity_top_k=5,
+            filters=MetadataFilters(filters=[ExactMatchFilter(key='user_id', value=user_id)]),
+        ))
+
+    def test_query_is_restricted_to_user(self):
+        result = self._query('1')
+
+        self.assertEqual(result.ids, ['a', 'b'])
+        self.assertAlmostEqual(result.similarities[0], 1.0, places=5)
+        self.assertEqual(result.nodes[1].metadata['knowledge_id'], 'k2')
+
+    def test_delete_nodes_by_filter(self):
+        self.store.delete_nodes(filters=MetadataFilters(filters=[
+            ExactMatchFilter(key='user_id', value='1'),
+            ExactMatchFilter(key='knowledge_id', value='k1'),
+        ]))
+
+        self.assertEqual(self._query('1').ids, ['b'])
+        self.assertEqual(self._query('2').ids, ['c'])
+
+    def test_shard_cache_is_shared_across_instances(self):
+        self._query('1')
+
+        # RAG_Service cria um store novo por pergunta: o shard já lido não é relido
+        with patch('apps.knowledge.vector_store.json.load') as mock_load:
+            self.store = NumpyVectorStore(self.tmp_dir)
+            self.assertEqual(self._query('1').ids, ['a', 'b'])
+        mock_load.assert_not_called()
+
+        # Uma escrita troca a geração e invalida o cache nas outras instâncias
+        NumpyVectorStore(self.tmp_dir).delete_nodes(['a'])
+        self.assertEqual(self._query('1').ids, ['b'])
+
+    def test_shard_cache_evicts_least_recently_used(self):
+        store = NumpyVectorStore(self.tmp_dir, cache_shards=1)
+        store._load(store._shard_dir('1'))
+        store._load(store._shard_dir('2'))
+
+        self.assertEqual([path for path, _ in _shard_cache], [str(store._shard_dir('2'))])
+
+    def test_or_filter_keeps_user_condition(self):
+        result = self.store.query(VectorStoreQuery(
+            query_embedding=[1.0, 0.0],
+            similarity_top_k=5,
+            filters=MetadataFilters(filters=[
+                ExactMatchFilter(key='user_id', value='1'),
+                ExactMatchFilter(key='knowledge_id', value='k3'),
+            ], condition=FilterCondition.OR),
+        ))
+
+        self.assertEqual(sorted(result.ids), ['a', 'b', 'c'])
+
+    def test_int8_store_rescores_with_exact_vectors(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        store = NumpyVectorStore(tmp_dir, dtype='int8', oversample=2)
+        store.add(self.nodes)
+
+        result = store.query(VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=2))
+
+        self.assertEqual(set(result.ids), {'a', 'c'})
+        self.assertAlmostEqual(result.similarities[0], 1.0, places=6)
+        stats = store.storage_stats()
+        self.assertEqual(stats['chunks'], 3)
+        self.assertLess(stats['quantized_bytes'], stats['float32_bytes'])
+        # Em disco, a cópia quantizada se soma aos vetores float32
+        self.assertGreater(stats['disk_bytes'], stats['float32_bytes'] + stats['quantized_bytes'])
+
+    def test_bulk_replace_is_invisible_until_the_block_ends(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        self.store = NumpyVectorStore(tmp_dir, dtype='int8', oversample=2)
+        self.store.add(self.nodes)
+
+        with self.store.bulk_replace(['a']) as staged:
+            staged.add([TextNode(id_='d', text='d', embedding=[0.6, 0.8], metadata={'user_id': '1'})])
+            staged.add([TextNode(id_='e', text='e', embedding=[1.0, 0.1], metadata={'user_id': '1'})])
+            self.assertEqual(self._query('1').ids, ['a', 'b'])
+
+        self.assertEqual(self._query('1').ids, ['e', 'b', 'd'])
+        self.assertEqual(self._query('2').ids, ['c'])
+
+        with self.assertRaises(ValueError):
+            with self.store.bulk_replace(['b']) as staged:
+                staged.add([TextNode(id_='f', text='f', embedding=[1.0, 0.0], metadata={'user_id': '1'})])
+                raise ValueError('falha no meio da ingestão')
+        self.assertEqual(self._query('1').ids, ['e', 'b', 'd'])
+
+
+class DocumentRoutingTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+    def _chunk(self, knowledge_id, page, embedding):
+        return TextNode(
+            text=f'{knowledge_id} {page}',
+            embedding=embedding,
+            metadata={'user_id': '1', 'knowledge_id': knowledge_id, 'title': knowledge_id, 'page_label': str(page)},
+        )
+
+    def test_questions_route_to_closest_documents(self):
+        chunks = [
+            self._chunk('k1', 1, [1.0, 0.0, 0.0]),
+            self._chunk('k1', 2, [0.9, 0.1, 0.0]),
+            self._chunk('k1', 3, [0.0, 0.0, 1.0]),
+            self._chunk('k2', 1, [0.0, 1.0, 0.0]),
+        ]
+
+        with override_settings(VECTOR_STORE_BACKEND='numpy', NUMPY_VECTOR_STORE_PATH=self.tmp_dir, DOCUMENT_SECTION_PAGES=2):
+            summaries = RAG_Service._build_summary_nodes(chunks)
+            RAG_Service._get_summary_store().add(summaries)
+
+            self.assertEqual(
+                sorted(n.id_ for n in summaries),
+                ['k1:document', 'k1:section:0', 'k1:section:1', 'k2:document'],
+            )
+            # A seção com a página 3 leva ao k1 mesmo com o centróide do documento longe da pergunta
+            self.assertEqual(RAG_Service._route_documents([0.0, 0.0, 1.0], '1', top_n=1), ['k1'])
+            self.assertEqual(RAG_Service._route_documents([0.0, 1.0, 0.0], '1', top_n=1), ['k2'])
+            self.assertEqual(RAG_Service._route_documents([0.0, 1.0, 0.0], '2', top_n=1), [])
+
+
+class ReindexEmbeddingsTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+    def _query(self, store, dim):
+        return store.query(VectorStoreQuery(
+            query_embedding=[1.0] * dim,
+            similarity_top_k=10,
+            filters=MetadataFilters(filters=[ExactMatchFilter(key='user_id', value='1')]),
+        ))
+
+    def test_chunks_and_summaries_move_to_the_new_model(self):
+        pages = [
+            Document(text=text, metadata={'user_id': '1', 'knowledge_id': kid, 'title': kid, 'page_label': '1'})
+            for kid, text in (('k1', 'Prazo de instalação: 5 dias.'), ('k2', 'Prazo de suporte: 2 dias.'))
+        ]
+
+        for backend in ('numpy', 'persistent'):
+            path = str(Path(self.tmp_dir) / backend)
+            with self.subTest(backend=backend), \
+                    override_settings(VECTOR_STORE_BACKEND=backend, NUMPY_VECTOR_STORE_PATH=path, CHROMADB_PATH=path):
+                with patch('apps.knowledge.rag_service.get_embed_model', return_value=MockEmbedding(embed_dim=4)):
+                    RAG_Service._index_documents(pages)
+
+                with override_settings(EMBEDDING_DIMENSIONS=8), \
+                        patch('apps.knowledge.management.commands.reindex_embeddings.get_embed_model', return_value=MockEmbedding(embed_dim=8)):
+                    # Repetir não duplica chunks nem resumos
+                    call_command('reindex_embeddings', batch_size=1, stdout=io.StringIO())
+                    call_command('reindex_embeddings', stdout=io.StringIO())
+
+                    chunks = self._query(RAG_Service._get_vector_store(), 8)
+                    summaries = self._query(RAG_Service._get_summary_store(), 8)
+
+                self.assertEqual(len(chunks.ids), 2)
+                self.assertEqual(sorted(summaries.ids), ['k1:document', 'k2:document'])
+                # A origem continua no espaço do modelo antigo
+                self.assertEqual(len(self._query(RAG_Service._get_summary_store(), 4).ids), 2)
+
+
+class IncrementalUpdateTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+    def _pages(self, *texts):
+        return [
+            Document(text=text, metadata={'user_id': '1', 'knowledge_id': 'k1', 'title': 'Manual', 'page_label': str(i)})
+            for i, text in enumerate(texts, start=1)
+        ]
+
+    @patch('apps.knowledge.rag_service.get_embed_model', return_value=MockEmbedding(embed_dim=4))
+    def test_only_changed_chunks_are_embedded(self, mock_embed_model):
+        with override_settings(VECTOR_STORE_BACKEND='numpy', NUMPY_VECTOR_STORE_PATH=self.tmp_dir):
+            RAG_Service._index_documents(self._pages('Introdução.', 'Instalação.', 'Suporte.'))
+
+            with patch.object(RAG_Service, '_iter_pdf', return_value=self._pages('Introdução.', 'Instalação via pip.', 'Suporte.')):
+                result = RAG_Service.update_pdf('manual.pdf', '1', 'Manual', 'k1')
+
+            self.assertEqual(result, {'chunks': 3, 'embedded': 1, 'reused': 2, 'removed': 1})
+            chunks = RAG_Service._get_document_chunks('1', 'k1')
+            self.assertEqual(
+                sorted(c.get_content() for c in chunks),
+                ['Instalação via pip.', 'Introdução.', 'Suporte.'],
+            )
+
+    @patch('apps.knowledge.rag_service.get_embed_model', return_value=MockEmbedding(embed_dim=4))
+    def test_chroma_replacement_is_batched_and_hidden_until_swap(self, mock_embed_model):
+        user = User.objects.create_user(username='chroma', email='chroma@example.com', password='Senha@123')
+        knowledge = Knowledge.objects.create(user=user, title='Manual', chunk_count=6)
+        user_id = str(user.id)
+
+        def pages(texts):
+            return [
+                Document(text=text, metadata={'user_id': user_id, 'knowledge_id': str(knowledge.id), 'title': 'Manual', 'page_label': str(i)})
+                for i, text in enumerate(texts, start=1)
+            ]
+
+        # Limite de lote menor que os 6 chunks antigos e os 8 novos, recusado como o Chroma faz
+        limit = 4
+        calls = []
+
+        def limited(original):
+            def call(collection, ids=None, **kwargs):
+                if ids is not None and len(ids) > limit:
+                    raise ValueError(f"Batch size of {len(ids)} is greater than max batch size of {limit}")
+                calls.append((original.__name__, RAG_Service._get_document_chunks(user_id, knowledge.id)))
+                return original(collection, ids=ids, **kwargs)
+            return call
+
+        old_texts = [f'Seção {i}.' for i in range(6)]
+        new_texts = [f'Seção {i} revisada.' for i in range(8)]
+        with override_settings(VECTOR_STORE_BACKEND='persistent', CHROMADB_PATH=self.tmp_dir):
+            RAG_Service._index_documents(pages(old_texts))
+
+            with patch.object(chromadb.api.client.Client, 'get_max_batch_size', return_value=limit), \
+                    patch.object(Collection, 'add', limited(Collection.add)), \
+                    patch.object(Collection, 'update', limited(Collection.update)), \
+                    patch.object(Collection, 'delete', limited(Collection.delete)), \
+                    patch.object(RAG_Service, '_iter_pdf', return_value=pages(new_texts)):
+                result = RAG_Service.update_pdf('manual.pdf', user_id, 'Manual', str(knowledge.id))
+
+            self.assertEqual(result['chunks'], 8)
+            # Enquanto os novos entram e os antigos são marcados, as consultas veem só a
+            # versão antiga; a partir da remoção dos antigos, só a nova
+            names = [name for name, _ in calls]
+            swap = names.index('delete')
+            self.assertEqual(names[:swap], ['add', 'add', 'update', 'update'])
+            for position, (_, visible) in enumerate(calls):
+                expected = old_texts if position < swap else new_texts
+                self.assertEqual(sorted(c.get_content() for c in visible), sorted(expected))
+
+            chunks = RAG_Service._get_document_chunks(user_id, knowledge.id)
+            self.assertEqual(sorted(c.get_content() for c in chunks), sorted(new_texts))
+            knowledge.refresh_from_db()
+            self.assertEqual((knowledge.pending_chunk_version, knowledge.retired_chunk_version), ('', ''))
+            self.assertEqual(get_corpus(user.id)['hidden_chunk_versions'], [])
+
+
+@patch('apps.knowledge.rag_service.get_embed_model', return_value=MockEmbedding(embed_dim=4))
+class StreamingIngestionTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        self.pdf_path = Path(self.tmp_dir) / 'manual.pdf'
+        write_text_pdf(self.pdf_path, pages=5, lines_per_page=2)
+        self.settings = override_settings(
+            VECTOR_STORE_BACKEND='numpy',
+            NUMPY_VECTOR_STORE_PATH=str(Path(self.tmp_dir) / 'store'),
+            INGESTION_PAGE_WINDOW=2,
+            DOCUMENT_SECTION_PAGES=2,
+        )
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def test_pdf_is_indexed_in_page_windows(self, mock_embed_model):
+        pages = list(iter_pdf_pages(self.pdf_path))
+        self.assertEqual([p.metadata['page_label'] for p in pages], ['1', '2', '3', '4', '5'])
+        self.assertIn('Pagina 3.', pages[2].text)
+
+        with patch.object(RAG_Service, '_embed_nodes', wraps=RAG_Service._embed_nodes) as mock_embed:
+            chunks = RAG_Service.ingest_pdf(str(self.pdf_path), '1', 'Manual', knowledge_id='k1')
+
+        self.assertEqual(mock_embed.call_count, 3)
+        self.assertEqual(chunks, 5)
+        self.assertEqual(len(RAG_Service._get_document_chunks('1', 'k1')), 5)
+        summaries = RAG_Service._get_summary_store().get_nodes(
+            filters=RAG_Service._document_filters('1', 'k1')
+        )
+        self.assertEqual(
+            sorted(n.id_ for n in summaries),
+            ['k1:document', 'k1:section:0', 'k1:section:1', 'k1:section:2'],
+        )
+
+    def test_failed_ingestion_removes_written_windows(self, mock_embed_model):
+        embed_nodes = RAG_Service._embed_nodes
+        calls = []
+
+        def fail_on_second_window(nodes):
+            calls.append(nodes)
+            if len(calls) == 2:
+                raise openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com'))
+            return embed_nodes(nodes)
+
+        with patch.object(RAG_Service, '_embed_nodes', side_effect=fail_on_second_window):
+            with self.assertRaises(openai.APIConnectionError):
+                RAG_Service.ingest_pdf(str(self.pdf_path), '1', 'Manual', knowledge_id='k1')
+
+        self.assertEqual(RAG_Service._get_document_chunks('1', 'k1'), [])
+
+    def test_windows_rewrite_the_shard_once(self, mock_embed_model):
+        with patch.object(NumpyVectorStore, '_merge', autospec=True, side_effect=NumpyVectorStore._merge) as mock_merge:
+            RAG_Service.ingest_pdf(str(self.pdf_path), '1', 'Manual', knowledge_id='k1')
+            self.assertEqual(mock_merge.call_count, 1)
+
+            with patch.object(RAG_Service, '_embed_nodes', wraps=RAG_Service._embed_nodes) as mock_embed:
+                result = RAG_Service.update_pdf(str(self.pdf_path), '1', 'Manual', 'k1')
+
+        # A atualização também lê o PDF em janelas e reescreve o shard uma vez só
+        self.assertEqual(mock_embed.call_count, 3)
+        self.assertEqual(mock_merge.call_count, 2)
+        self.assertEqual(result, {'chunks': 5, 'embedded': 0, 'reused': 5, 'removed': 0})
+        self.assertEqual(len(RAG_Service._get_document_chunks('1', 'k1')), 5)
+        self.assertEqual(list((Path(self.tmp_dir) / 'store').glob('*/.staging/*')), [])
+
+    def test_failed_update_keeps_previous_version(self, mock_embed_model):
+        RAG_Service.ingest_pdf(str(self.pdf_path), '1', 'Manual', knowledge_id='k1')
+        before = sorted(c.node_id for c in RAG_Service._get_document_chunks('1', 'k1'))
+
+        split_documents = RAG_Service._split_documents
+        calls = []
+
+        def fail_on_second_window(docs):
+            calls.append(docs)
+            if len(calls) == 2:
+                raise ValueError('PDF corrompido')
+            return split_documents(docs)
+
+        with patch.object(RAG_Service, '_split_documents', side_effect=fail_on_second_window):
+            with self.assertRaises(ValueError):
+                RAG_Service.update_pdf(str(self.pdf_path), '1', 'Manual', 'k1')
+
+        after = sorted(c.node_id for c in RAG_Service._get_document_chunks('1', 'k1'))
+        self.assertEqual(after, before)
+        self.assertEqual(list((Path(self.tmp_dir) / 'store').glob('*/.staging/*')), [])
+
+
+class UsageRollupTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='analytics', email='analytics@example.com', password='Senha@123')
+        Knowledge.objects.create(user=self.user, title='Manual', chunk_count=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _answer(self, question, user_id, usage=None):
+        usage.update(prompt_tokens=120, completion_tokens=30)
+        return 'Resposta'
+
+    @patch('apps.knowledge.rag_service.RAG_Service.answer_question')
+    def test_rollups_are_incremental_and_idempotent(self, mock_rag):
+        mock_rag.side_effect = self._answer
+        self.client.post('/api/message/', {'content': 'Primeira?'})
+        self.client.post('/api/message/', {'content': 'Segunda?'})
+        Message.objects.create(user=self.user, content='Falhou?', author='user', status='failed')
+
+        self.assertEqual(refresh_usage_rollups(), 1)
+        refresh_usage_rollups()
+        rollup = UsageRollup.objects.get(user=self.user)
+        self.assertEqual(
+            (rollup.questions, rollup.answers, rollup.failed, rollup.prompt_tokens, rollup.completion_tokens),
+            (3, 2, 1, 240, 60),
+        )
+
+        self.client.post('/api/message/', {'content': 'Terceira?'})
+        refresh_usage_rollups()
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.questions, rollup.answers), (4, 3))
+
+    @patch('apps.knowledge.rag_service.RAG_Service.answer_question', side_effect=RuntimeError('LLM fora do ar'))
+    def test_sync_rag_errors_are_counted_as_failed(self, mock_rag):
+        response = self.client.post('/api/message/', {'content': 'Quebra?'})
+
+        self.assertEqual(response.data['user_message']['status'], 'failed')
+        refresh_usage_rollups()
+        rollup = UsageRollup.objects.get(user=self.user)
+        self.assertEqual((rollup.questions, rollup.answers, rollup.failed), (1, 0, 1))
+
+    def test_upsert_without_conflict_target(self):
+        # MySQL: bulk_create recusa unique_fields e o upsert usa a unique (user, date)
+        Message.objects.create(user=self.user, content='Pergunta?', author='user')
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            self.assertEqual(refresh_usage_rollups(), 1)
+        self.assertEqual(UsageRollup.objects.get(user=self.user).questions, 1)
+
+    def test_deleted_messages_are_recounted(self):
+        today = Message.objects.create(user=self.user, content='Hoje?', author='user')
+        Message.objects.create(user=self.user, content='Resposta', author='system', latency_ms=500)
+        yesterday = Message.objects.create(user=self.user, content='Ontem?', author='user')
+        Message.objects.filter(pk=yesterday.pk).update(created_at=timezone.now() - timedelta(days=1))
+        refresh_usage_rollups()
+        self.assertEqual(UsageRollup.objects.filter(user=self.user).count(), 2)
+
+        today.delete()
+        Message.objects.get(pk=yesterday.pk).delete()
+        refresh_usage_rollups()
+
+        # O dia de hoje é recontado; o de ontem ficou sem mensagens e some
+        rollup = UsageRollup.objects.get(user=self.user)
+        self.assertEqual((rollup.date, rollup.questions, rollup.answers, rollup.stale), (timezone.localdate(), 0, 1, False))
+
+    def test_knowledge_admin_does_not_list_users_in_filters(self):
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='Senha@123')
+        self.client.force_login(admin_user)
+
+        response = self.client.get('/admin/knowledge/knowledge/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('user', [spec.field_path for spec in response.context['cl'].filter_specs])
+
+    def test_admin_dashboard_reads_rollups(self):
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='Senha@123')
+        Message.objects.create(user=self.user, content='Pergunta?', author='user')
+        Message.objects.create(user=self.user, content='Resposta', author='system', latency_ms=800, cache_hit=True)
+        Message.objects.create(user=self.user, content=NO_ANSWER_MESSAGE, author='system', latency_ms=0, no_documents=True)
+        refresh_usage_rollups()
+
+        self.client.force_login(admin_user)
+        response = self.client.get('/admin/knowledge/usagerollup/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context['summary']['questions'], 1)
+        self.assertEqual(response.context['summary']['avg_latency_ms'], 400)
+        self.assertEqual(response.context['daily'][0]['cache_hits'], 1)
+        self.assertEqual(response.context['daily'][0]['no_documents'], 1)
+
+
+class StartupImportTest(TestCase):
+
+    def test_urlconf_does_not_load_rag_stack(self):
+        # Processo novo: neste, os testes anteriores já importaram a pilha do RAG
+        code = (
+            "import os, sys, django\n"
+            # Mesmo banco em memória dos testes (config/settings.py olha o sys.argv)
+            "sys.argv = ['manage.py', 'test']\n"
+            "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')\n"
+            "django.setup()\n"
+            "from django.urls import resolve\n"
+            "resolve('/api/message/')\n"
+            "print(','.join(m for m in ('chromadb', 'llama_index.core', 'apps.knowledge.rag_service') if m in sys.modules))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        self.assertEqual(result.stdout.strip(), '')
+
+
+class SubQuestionTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        self.user = User.objects.create_user(username='compound', email='compound@example.com', password='Senha@123')
+
+    def test_only_compound_questions_are_decomposed(self):
+        Knowledge.objects.create(user=self.user, title='Manual de Instalação', chunk_count=3)
+        Knowledge.objects.create(user=self.user, title='Guia de Suporte', chunk_count=3)
+
+        self.assertFalse(RAG_Service._is_compound('Como instalar o sistema?', self.user.id))
+        self.assertTrue(RAG_Service._is_compound('Compare a instalação com o suporte', self.user.id))
+        self.assertTrue(RAG_Service._is_compound('Qual o prazo? E o custo?', self.user.id))
+        self.assertTrue(RAG_Service._is_compound(
+            'O que o manual de instalação e o guia de suporte dizem sobre prazos', self.user.id
+        ))
+
+    @patch('apps.knowledge.rag_service.get_llm', return_value=MockLLM(max_tokens=8))
+    @patch('apps.knowledge.rag_service.get_embed_model', return_value=MockEmbedding(embed_dim=4))
+    def test_subquestions_are_retrieved_and_merged(self, mock_embed_model, mock_llm):
+        pages = [
+            Document(text=text, metadata={'user_id': '1', 'knowledge_id': kid, 'title': kid, 'page_label': '1'})
+            for kid, text in (('k1', 'Prazo de instalação: 5 dias.'), ('k2', 'Prazo de suporte: 2 dias.'))
+        ]
+
+        with override_settings(VECTOR_STORE_BACKEND='numpy', NUMPY_VECTOR_STORE_PATH=self.tmp_dir, SUBQUESTION_DECOMPOSITION=True):
+            RAG_Service._index_documents(pages)
+
+            with patch.object(RAG_Service, '_decompose', return_value=['Prazo de instalação?', 'Prazo de suporte?']), \
+                    patch.object(RAG_Service, '_aretrieve_subquestions', wraps=RAG_Service._aretrieve_subquestions) as mock_retrieve:
+                answer = RAG_Service.answer_question('Compare os prazos de instalação e suporte', '1')
+
+            self.assertNotEqual(answer, NO_ANSWER_MESSAGE)
+            mock_retrieve.assert_called_once()
+
+            index = mock_retrieve.call_args.args[0]
+            nodes = asyncio.run(RAG_Service._aretrieve_subquestions(index, ['Prazo de instalação?', 'Prazo de suporte?'], '1'))
+            self.assertEqual(sorted(n.node.metadata['knowledge_id'] for n in nodes), ['k1', 'k2'])
+
+    @patch('apps.knowledge.rag_service.get_llm', return_value=MockLLM(max_tokens=8))
+    def test_compound_questions_back_to_back(self, mock_llm):
+        loops = []
+
+        class LoopBoundEmbedding(MockEmbedding):
+            # Como o AsyncOpenAI reaproveitado: preso ao loop da primeira chamada async
+            async def _aget_query_embedding(self, query):
+                loops.append(asyncio.get_running_loop())
+                if loops[0] is not loops[-1]:
+                    raise RuntimeError('Event loop is closed')
+                return self._get_vector()
+
+        pages = [
+            Document(text=text, metadata={'user_id': '1', 'knowledge_id': kid, 'title': kid, 'page_label': '1'})
+            for kid, text in (('k1', 'Prazo de instalação: 5 dias.'), ('k2', 'Prazo de suporte: 2 dias.'))
+        ]
+
+        with override_settings(VECTOR_STORE_BACKEND='numpy', NUMPY_VECTOR_STORE_PATH=self.tmp_dir, SUBQUESTION_DECOMPOSITION=True), \
+                patch('apps.knowledge.rag_service.get_embed_model', return_value=LoopBoundEmbedding(embed_dim=4)):
+            RAG_Service._index_documents(pages)
+
+            with patch.object(RAG_Service, '_decompose', return_value=['Prazo de instalação?', 'Prazo de suporte?']):
+                first = RAG_Service.answer_question('Compare os prazos de instalação e suporte', '1')
+                second = RAG_Service.answer_question('Compare os custos de instalação e suporte', '1')
+
+        self.assertNotEqual(first, NO_ANSWER_MESSAGE)
+        self.assertNotEqual(second, NO_ANSWER_MESSAGE)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import KnowledgeViewSet, MessageViewSet
+from .views import KnowledgeViewSet, MessageViewSet, embedding_stats
 
 
 router = DefaultRouter()
@@ -8,6 +8,7 @@ router.register(r'knowledge', KnowledgeViewSet, basename='knowledge')
 router.register(r'message', MessageViewSet, basename='message')
 
 urlpatterns = [
+    path('metrics/embeddings/', embedding_stats, name='embedding-stats'),
     path('', include(router.urls)),
 ]
 
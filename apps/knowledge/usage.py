@@ -0,0 +1,125 @@
+from datetime import datetime, time, timedelta
+
+from django.db import connection
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Message, UsageRollup
+
+
+# Margem para mensagens gravadas enquanto a última agregação rodava
+ROLLUP_OVERLAP = timedelta(minutes=5)
+
+_USER = Q(author='user')
+_SYSTEM = Q(author='system')
+
+
+def _day_start(date) -> datetime:
+    """Começo do dia local `date`, como o TruncDate usado nos agregados."""
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def refresh_usage_rollups(since: datetime = None) -> int:
+    """
+    Recalcula os UsageRollup dos usuários com mensagens novas ou alteradas desde `since`
+    (padrão: a última agregação, com margem; sem nenhuma, agrega todo o histórico) e
+    os dias marcados como `stale` por mensagens apagadas.
+    Cada dia afetado é recontado inteiro a partir de Message, então rodar de novo sobre
+    o mesmo período não duplica contagens. Devolve quantas linhas foram gravadas ou
+    removidas.
+    """
+    if since is None:
+        last = UsageRollup.objects.aggregate(last=Max('updated_at'))['last']
+        since = last - ROLLUP_OVERLAP if last else None
+
+    # Desmarca antes de recontar: uma remoção durante a recontagem marca o dia de novo
+    stale = list(UsageRollup.objects.filter(stale=True).values_list('id', 'user_id', 'date'))
+    if stale:
+        UsageRollup.objects.filter(id__in=[pk for pk, _, _ in stale]).update(stale=False)
+
+    days = Q()
+    for _, user_id, date in stale:
+        days |= Q(user_id=user_id, created_at__gte=_day_start(date), created_at__lt=_day_start(date + timedelta(days=1)))
+
+    messages = Message.objects.all()
+    if since is not None:
+        # Mensagens novas ou alteradas (ex.: pergunta que falhou depois) desde a última agregação
+        changed = Message.objects.filter(updated_at__gte=since)
+        first = changed.aggregate(first=Min('created_at'))['first']
+        if first is not None:
+            # Dias afetados inteiros, do primeiro em diante
+            user_ids = list(changed.order_by().values_list('user_id', flat=True).distinct())
+            days |= Q(created_at__gte=_day_start(timezone.localtime(first).date()), user_id__in=user_ids)
+        if not days:
+            return 0
+        messages = messages.filter(days)
+
+    rows = (
+        messages
+        .annotate(date=TruncDate('created_at'))
+        .order_by()
+        .values('user_id', 'date')
+        .annotate(
+            questions=Count('id', filter=_USER),
+            answers=Count('id', filter=_SYSTEM),
+            failed=Count('id', filter=_USER & Q(status='failed')),
+            cache_hits=Count('id', filter=_SYSTEM & Q(cache_hit=True)),
+            no_documents=Count('id', filter=_SYSTEM & Q(no_documents=True)),
+            latency_ms=Sum('latency_ms', filter=_SYSTEM, default=0),
+            prompt_tokens=Sum('prompt_tokens', filter=_SYSTEM, default=0),
+            completion_tokens=Sum('completion_tokens', filter=_SYSTEM, default=0),
+        )
+    )
+
+    now = timezone.now()
+    rollups = [UsageRollup(**row, updated_at=now) for row in rows]
+    # MySQL não aceita alvo no upsert: o ON DUPLICATE KEY UPDATE usa a unique (user, date)
+    target = {'unique_fields': ['user', 'date']} if connection.features.supports_update_conflicts_with_target else {}
+    UsageRollup.objects.bulk_create(
+        rollups,
+        update_conflicts=True,
+        **target,
+        update_fields=[
+            'questions', 'answers', 'failed', 'cache_hits', 'no_documents',
+            'latency_ms', 'prompt_tokens', 'completion_tokens', 'updated_at',
+        ],
+    )
+
+    # Dias que ficaram sem nenhuma mensagem não aparecem na recontagem
+    recounted = {(r.user_id, r.date) for r in rollups}
+    emptied = [pk for pk, user_id, date in stale if (user_id, date) not in recounted]
+    removed, _ = UsageRollup.objects.filter(id__in=emptied, stale=False).delete() if emptied else (0, None)
+    return len(rollups) + removed
+
+
+def _totals():
+    return {
+        'questions': Sum('questions', default=0),
+        'answers': Sum('answers', default=0),
+        'failed': Sum('failed', default=0),
+        'cache_hits': Sum('cache_hits', default=0),
+        'no_documents': Sum('no_documents', default=0),
+        'latency_ms': Sum('latency_ms', default=0),
+        'prompt_tokens': Sum('prompt_tokens', default=0),
+        'completion_tokens': Sum('completion_tokens', default=0),
+        'users': Count('user', distinct=True),
+    }
+
+
+def _with_averages(totals: dict) -> dict:
+    answers = totals['answers']
+    totals['avg_latency_ms'] = round(totals['latency_ms'] / answers) if answers else None
+    totals['cache_hit_rate'] = totals['cache_hits'] / answers if answers else None
+    return totals
+
+
+def summarize(rollups) -> dict:
+    """Totais e médias de um conjunto de UsageRollup (usado pelo painel do admin)."""
+    return _with_averages(rollups.aggregate(**_totals()))
+
+
+def daily_summary(rollups, days: int = 31) -> list:
+    """Totais por dia dos `days` dias mais recentes de um conjunto de UsageRollup."""
+    rows = rollups.order_by().values('date').annotate(**_totals()).order_by('-date')[:days]
+    return [_with_averages(row) for row in rows]
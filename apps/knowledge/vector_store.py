@@ -0,0 +1,601 @@
+import fcntl
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict, namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import (
+    build_metadata_filter_fn,
+    metadata_dict_to_node,
+    node_to_metadata_dict,
+)
+
+
+logger = logging.getLogger(__name__)
+
+_SAFE_SHARD_KEY = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+VECTOR_DTYPES = ("float32", "float16", "int8")
+
+# Linhas convertidas para float32 por vez ao pontuar vetores quantizados
+_SCORE_BLOCK_ROWS = 4096
+
+# Linhas copiadas por vez ao juntar um shard com os segmentos de `bulk_replace`
+_MERGE_BLOCK_ROWS = 1024
+
+# Segmentos de `bulk_replace` ficam em `<path>/.staging`; os de processos que morreram
+# no meio da gravação são apagados depois deste tempo
+_STAGING_DIR = ".staging"
+_STAGING_MAX_AGE = 24 * 3600
+
+_Shard = namedtuple("_Shard", ["generation", "ids", "records", "vectors", "codes", "scales"])
+_EMPTY_SHARD = _Shard(None, [], [], np.zeros((0, 0), dtype=np.float32), None, None)
+
+# Shards já lidos, por processo: (diretório, dtype) -> (geração, _Shard), do menos para o
+# mais recente. O RAG_Service cria um NumpyVectorStore por chamada, então o cache não pode
+# ficar na instância; cada entrada guarda textos e metadados do shard, então o cache tem
+# tamanho máximo (`cache_shards`) e descarta os shards usados há mais tempo.
+_shard_cache = OrderedDict()
+_shard_cache_lock = threading.Lock()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+def _write_npy_header(f, dtype, shape):
+    """Cabeçalho de um .npy cujos dados são escritos em seguida, bloco a bloco."""
+    np.lib.format.write_array_header_1_0(f, {
+        "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape,
+    })
+
+
+def quantize(vectors: np.ndarray, dtype: str):
+    """
+    Converte vetores normalizados para a precisão reduzida `dtype`.
+
+    Retorna (codes, scales). Em int8 cada linha tem sua própria escala
+    (max |v| / 127); em float16 e float32 `scales` é None.
+    """
+    if dtype == "float32":
+        return vectors.astype(np.float32), None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.clip(np.abs(vectors).max(axis=1), 1e-12, None).astype(np.float32) / 127
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales
+    raise ValueError(f"dtype de vetor inválido: {dtype}")
+
+
+def approximate_scores(codes: np.ndarray, scales: Optional[np.ndarray], rows: Optional[np.ndarray], q: np.ndarray) -> np.ndarray:
+    """Produto interno aproximado entre `q` e as linhas `rows` (todas se None) dos vetores quantizados."""
+    total = len(codes) if rows is None else len(rows)
+    scores = np.empty(total, dtype=np.float32)
+    for start in range(0, total, _SCORE_BLOCK_ROWS):
+        block = slice(start, start + _SCORE_BLOCK_ROWS)
+        selected = codes[block] if rows is None else codes[rows[block]]
+        scores[block] = selected.astype(np.float32) @ q
+        if scales is not None:
+            scores[block] *= scales[block] if rows is None else scales[rows[block]]
+    return scores
+
+
+class _StagedNodes:
+    """Lotes de `NumpyVectorStore.bulk_replace` já gravados em segmentos no disco, ainda fora dos shards."""
+
+    def __init__(self, store: "NumpyVectorStore", directory: Path):
+        self._store = store
+        self._directory = directory
+        self._count = 0
+        # Diretório do shard -> [(prefixo do segmento, ids)]
+        self.segments = defaultdict(list)
+
+    def add(self, nodes: List[BaseNode]) -> List[str]:
+        by_shard = defaultdict(list)
+        for node in nodes:
+            by_shard[self._store._shard_dir(node.metadata.get("user_id"))].append(node)
+
+        for shard_dir, shard_nodes in by_shard.items():
+            prefix = self._directory / str(self._count)
+            self._count += 1
+            ids = [n.node_id for n in shard_nodes]
+            np.save(f"{prefix}.npy", _normalize(np.array([n.get_embedding() for n in shard_nodes], dtype=np.float32)))
+            with open(f"{prefix}.json", "w") as f:
+                json.dump([node_to_metadata_dict(n, remove_text=False, flat_metadata=False) for n in shard_nodes], f)
+            self.segments[shard_dir].append((prefix, ids))
+
+        return [n.node_id for n in nodes]
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    Vector store embutido para implantações em um único nó.
+
+    Os chunks de cada usuário ficam em um shard próprio: uma matriz float32 já
+    normalizada (`vectors-<geração>.npy`, lida com memory-map) e os metadados dos
+    nós (`records-<geração>.json`). A consulta filtrada por usuário lê só o shard
+    dele e calcula a similaridade de cosseno com um único produto matricial.
+
+    Escritas reescrevem o shard sob um flock e trocam o arquivo `CURRENT`
+    atomicamente, então leitores em outros processos sempre veem uma geração
+    completa; gravações em muitos lotes usam `bulk_replace` para reescrever o
+    shard uma vez só. Os `cache_shards` shards lidos mais recentemente ficam em um
+    cache do processo, compartilhado entre instâncias, até o `CURRENT` apontar
+    para outra geração.
+
+    Com `dtype` float16 ou int8, uma cópia quantizada dos vetores
+    (`codes-<geração>.npy`) é usada para a varredura: os `similarity_top_k *
+    oversample` melhores candidatos são então repontuados com os vetores float32
+    exatos, dos quais só essas linhas são lidas do disco. A economia é de memória
+    e de bytes varridos por consulta; em disco a cópia quantizada se soma aos
+    vetores float32.
+    """
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+
+    path: str
+    dtype: str = "float32"
+    oversample: int = 4
+    cache_shards: int = 64
+
+    def __init__(self, path: str, dtype: str = "float32", oversample: int = 4, cache_shards: int = 64, **kwargs: Any):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"dtype de vetor inválido: {dtype}")
+        super().__init__(
+            path=str(path), dtype=dtype, oversample=max(1, oversample), cache_shards=max(0, cache_shards), **kwargs
+        )
+        Path(self.path).mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    # ----- shards -----
+
+    def _shard_dir(self, user_id) -> Path:
+        key = str(user_id) if user_id is not None else "_shared"
+        if not _SAFE_SHARD_KEY.fullmatch(key):
+            key = hashlib.sha1(key.encode()).hexdigest()
+        return Path(self.path) / key
+
+    def _all_shard_dirs(self) -> List[Path]:
+        return [p for p in Path(self.path).iterdir() if p.is_dir() and p.name != _STAGING_DIR]
+
+    def _shard_dirs_for(self, filters: Optional[MetadataFilters]) -> List[Path]:
+        # Filtro por usuário com AND restringe a busca ao shard daquele usuário
+        if filters and filters.condition in (None, FilterCondition.AND):
+            for f in filters.filters:
+                if not isinstance(f, MetadataFilters) and f.key == "user_id" and f.operator == FilterOperator.EQ:
+                    return [self._shard_dir(f.value)]
+        return self._all_shard_dirs()
+
+    def _load(self, shard_dir: Path, use_cache: bool = True) -> _Shard:
+        """Devolve a geração atual do shard."""
+        for _ in range(2):
+            try:
+                generation = (shard_dir / "CURRENT").read_text().strip()
+            except FileNotFoundError:
+                return _EMPTY_SHARD
+
+            key = (str(shard_dir), self.dtype)
+            cached = _shard_cache.get(key)
+            if use_cache and cached is not None and cached[0] == generation:
+                with _shard_cache_lock:
+                    if key in _shard_cache:
+                        _shard_cache.move_to_end(key)
+                return cached[1]
+
+            try:
+                with open(shard_dir / f"records-{generation}.json") as f:
+                    data = json.load(f)
+                vectors_path = shard_dir / f"vectors-{generation}.npy"
+                vectors = np.load(vectors_path, mmap_mode="r") if data["ids"] else np.load(vectors_path)
+                codes, scales = self._load_codes(shard_dir, generation, data, vectors)
+            except FileNotFoundError:
+                # Geração substituída entre a leitura do CURRENT e a dos arquivos
+                continue
+
+            loaded = _Shard(generation, data["ids"], data["records"], vectors, codes, scales)
+            with _shard_cache_lock:
+                # Só avança: uma leitura atrasada não sobrescreve uma geração mais nova
+                cached = _shard_cache.get(key)
+                if cached is None or int(cached[0]) < int(generation):
+                    _shard_cache[key] = (generation, loaded)
+                    _shard_cache.move_to_end(key)
+                while len(_shard_cache) > self.cache_shards:
+                    _shard_cache.popitem(last=False)
+            return loaded
+
+        raise RuntimeError(f"Não foi possível ler o shard {shard_dir}")
+
+    def _load_codes(self, shard_dir: Path, generation: str, data: dict, vectors: np.ndarray):
+        if self.dtype == "float32" or not data["ids"]:
+            return None, None
+
+        if data.get("dtype") == self.dtype:
+            codes = np.load(shard_dir / f"codes-{generation}.npy", mmap_mode="r")
+            scales = np.load(shard_dir / f"scales-{generation}.npy") if self.dtype == "int8" else None
+            return codes, scales
+
+        # Shard gravado com outra precisão: quantiza em memória até a próxima escrita
+        return quantize(np.asarray(vectors), self.dtype)
+
+    @contextmanager
+    def _locked(self, shard_dir: Path):
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        with open(shard_dir / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, shard_dir: Path, ids: list, records: list, vectors: np.ndarray):
+        generation = str(time.time_ns())
+        np.save(shard_dir / f"vectors-{generation}.npy", vectors)
+        if self.dtype != "float32":
+            codes, scales = quantize(vectors, self.dtype)
+            np.save(shard_dir / f"codes-{generation}.npy", codes)
+            if scales is not None:
+                np.save(shard_dir / f"scales-{generation}.npy", scales)
+        with open(shard_dir / f"records-{generation}.json", "w") as f:
+            json.dump({"ids": ids, "records": records, "dtype": self.dtype}, f)
+        self._publish(shard_dir, generation)
+
+    def _publish(self, shard_dir: Path, generation: str):
+        previous = None
+        if (shard_dir / "CURRENT").exists():
+            previous = (shard_dir / "CURRENT").read_text().strip()
+
+        tmp = shard_dir / f"CURRENT.{generation}"
+        tmp.write_text(generation)
+        os.replace(tmp, shard_dir / "CURRENT")
+
+        # Mantém a geração anterior para leitores que ainda estejam abrindo os arquivos
+        keep = {generation, previous}
+        for p in shard_dir.glob("*-*.*"):
+            if p.stem.split("-", 1)[1] not in keep:
+                p.unlink(missing_ok=True)
+
+    def _rewrite(self, shard_dir: Path, fn):
+        with self._locked(shard_dir):
+            shard = self._load(shard_dir, use_cache=False)
+            result = fn(list(shard.ids), list(shard.records), np.asarray(shard.vectors))
+            if result is not None:
+                self._write(shard_dir, *result)
+
+    def _matching_rows(self, records: list, filters: Optional[MetadataFilters]) -> np.ndarray:
+        remaining = list(filters.filters) if filters else []
+        if filters and filters.condition in (None, FilterCondition.AND):
+            # Com AND, o filtro por usuário já foi aplicado na escolha do shard
+            remaining = [
+                f for f in remaining
+                if isinstance(f, MetadataFilters) or not (f.key == "user_id" and f.operator == FilterOperator.EQ)
+            ]
+        if not remaining:
+            return np.arange(len(records))
+
+        filter_fn = build_metadata_filter_fn(
+            lambda i: records[i],
+            MetadataFilters(filters=remaining, condition=filters.condition),
+        )
+        return np.array([i for i in range(len(records)) if filter_fn(i)], dtype=np.int64)
+
+    # ----- API do llama_index -----
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        return self.replace_nodes([], nodes)
+
+    def replace_nodes(self, node_ids: List[str], nodes: List[BaseNode]) -> List[str]:
+        """
+        Substitui `node_ids` por `nodes` em uma única reescrita de cada shard, então
+        leitores veem a versão antiga ou a nova, nunca uma mistura. Os `node_ids`
+        são procurados nos shards dos nós novos.
+        """
+        removed = set(node_ids)
+        by_shard = defaultdict(list)
+        for node in nodes:
+            by_shard[self._shard_dir(node.metadata.get("user_id"))].append(node)
+
+        for shard_dir, shard_nodes in by_shard.items():
+            new_ids = [n.node_id for n in shard_nodes]
+            new_records = [node_to_metadata_dict(n, remove_text=False, flat_metadata=False) for n in shard_nodes]
+            new_vectors = _normalize(np.array([n.get_embedding() for n in shard_nodes], dtype=np.float32))
+            replaced = removed | set(new_ids)
+
+            def append(ids, records, vectors):
+                # Ids repetidos substituem o registro anterior, como o upsert do Chroma
+                keep = [i for i in range(len(ids)) if ids[i] not in replaced]
+                return (
+                    [ids[i] for i in keep] + new_ids,
+                    [records[i] for i in keep] + new_records,
+                    np.vstack([vectors[keep], new_vectors]) if keep else new_vectors,
+                )
+
+            self._rewrite(shard_dir, append)
+
+        return [n.node_id for n in nodes]
+
+    @contextmanager
+    def bulk_replace(self, node_ids: List[str] = ()):
+        """
+        Grava nós em lotes sem reescrever o shard a cada lote: o `add` do objeto
+        devolvido guarda cada lote em um segmento no disco e, ao sair do bloco, cada
+        shard envolvido é reescrito uma única vez, trocando `node_ids` pelos nós
+        gravados, como em `replace_nodes`. Até lá as consultas não veem os nós novos;
+        se o bloco falhar, os segmentos são descartados e os shards ficam intactos.
+        """
+        staging = Path(self.path) / _STAGING_DIR
+        staging.mkdir(exist_ok=True)
+        for old in staging.iterdir():
+            try:
+                if time.time() - old.stat().st_mtime > _STAGING_MAX_AGE:
+                    shutil.rmtree(old, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+
+        directory = staging / uuid.uuid4().hex
+        directory.mkdir()
+        try:
+            staged = _StagedNodes(self, directory)
+            yield staged
+            removed = set(node_ids)
+            for shard_dir, segments in staged.segments.items():
+                self._merge(shard_dir, removed, segments)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _merge(self, shard_dir: Path, removed: set, segments: list):
+        """
+        Reescreve o shard com os segmentos de `bulk_replace`. Os vetores são copiados
+        em blocos com leituras e escritas comuns, sem memory-map: nem a matriz nem as
+        páginas dos arquivos entram no RSS do processo.
+        """
+        new_ids = [node_id for _, ids in segments for node_id in ids]
+        replaced = removed | set(new_ids)
+
+        with self._locked(shard_dir):
+            shard = self._load(shard_dir)
+            keep = np.array([i for i in range(len(shard.ids)) if shard.ids[i] not in replaced], dtype=np.int64)
+            ids = [shard.ids[i] for i in keep] + new_ids
+            dim = np.load(f"{segments[0][0]}.npy", mmap_mode="r").shape[1]
+
+            generation = str(time.time_ns())
+            blocks = itertools.chain(
+                self._read_rows(shard_dir / f"vectors-{shard.generation}.npy", keep) if len(keep) else (),
+                (np.load(f"{prefix}.npy") for prefix, _ in segments),
+            )
+            scales = []
+            with open(shard_dir / f"vectors-{generation}.npy", "wb") as vectors_file:
+                _write_npy_header(vectors_file, np.float32, (len(ids), dim))
+                codes_file = None
+                if self.dtype != "float32":
+                    codes_file = open(shard_dir / f"codes-{generation}.npy", "wb")
+                    _write_npy_header(codes_file, np.float16 if self.dtype == "float16" else np.int8, (len(ids), dim))
+                try:
+                    for block in blocks:
+                        vectors_file.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+                        if codes_file is not None:
+                            block_codes, block_scales = quantize(block, self.dtype)
+                            codes_file.write(block_codes.tobytes())
+                            if block_scales is not None:
+                                scales.append(block_scales)
+                finally:
+                    if codes_file is not None:
+                        codes_file.close()
+            if self.dtype == "int8":
+                np.save(shard_dir / f"scales-{generation}.npy", np.concatenate(scales))
+
+            def segment_records():
+                for prefix, _ in segments:
+                    with open(f"{prefix}.json") as f:
+                        yield from json.load(f)
+
+            # Mesmo formato de `_write`, escrito registro a registro
+            with open(shard_dir / f"records-{generation}.json", "w") as f:
+                f.write('{"ids": ')
+                json.dump(ids, f)
+                f.write(f', "dtype": {json.dumps(self.dtype)}, "records": [')
+                for n, record in enumerate(itertools.chain((shard.records[i] for i in keep), segment_records())):
+                    if n:
+                        f.write(", ")
+                    json.dump(record, f)
+                f.write("]}")
+
+            self._publish(shard_dir, generation)
+
+    @staticmethod
+    def _read_rows(path: Path, rows: np.ndarray):
+        """Linhas `rows` (em ordem) de um .npy 2D, em blocos de até _MERGE_BLOCK_ROWS linhas."""
+        with open(path, "rb") as f:
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            (total, dim), _, dtype = read_header(f)
+            offset = f.tell()
+            for start in range(0, total, _MERGE_BLOCK_ROWS):
+                stop = min(start + _MERGE_BLOCK_ROWS, total)
+                lo, hi = np.searchsorted(rows, [start, stop])
+                if lo == hi:
+                    continue
+                f.seek(offset + start * dim * dtype.itemsize)
+                block = np.fromfile(f, dtype=dtype, count=(stop - start) * dim).reshape(-1, dim)
+                yield block[rows[lo:hi] - start]
+
+    def _remove(self, shard_dirs: List[Path], should_remove):
+        for shard_dir in shard_dirs:
+            def remove(ids, records, vectors):
+                keep = [i for i in range(len(ids)) if not should_remove(ids[i], records[i])]
+                if len(keep) == len(ids):
+                    return None
+                return [ids[i] for i in keep], [records[i] for i in keep], vectors[keep] if keep else vectors[:0]
+
+            self._rewrite(shard_dir, remove)
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._remove(self._all_shard_dirs(), lambda node_id, record: record.get("ref_doc_id") == ref_doc_id)
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None, **delete_kwargs: Any) -> None:
+        node_ids = set(node_ids) if node_ids is not None else None
+        filter_fn = build_metadata_filter_fn(lambda record: record, filters)
+        self._remove(
+            self._shard_dirs_for(filters),
+            lambda node_id, record: (node_ids is None or node_id in node_ids) and filter_fn(record),
+        )
+
+    def get_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None,
+        include_embeddings: bool = True,
+    ) -> List[BaseNode]:
+        node_ids = set(node_ids) if node_ids is not None else None
+        nodes = []
+        for shard_dir in self._shard_dirs_for(filters):
+            shard = self._load(shard_dir)
+            for i in self._matching_rows(shard.records, filters):
+                if node_ids is None or shard.ids[i] in node_ids:
+                    node = metadata_dict_to_node(shard.records[i])
+                    if include_embeddings:
+                        node.embedding = shard.vectors[i].tolist()
+                    nodes.append(node)
+        return nodes
+
+    def get_records(self, filters: Optional[MetadataFilters] = None) -> List[tuple]:
+        """(id, metadados) dos nós que atendem `filters`, sem montar os nós nem ler vetores."""
+        return [
+            (shard.ids[i], shard.records[i])
+            for shard in map(self._load, self._shard_dirs_for(filters))
+            for i in self._matching_rows(shard.records, filters)
+        ]
+
+    def get_embeddings(self, node_ids: List[str], filters: Optional[MetadataFilters] = None) -> dict:
+        """
+        Vetores normalizados dos `node_ids`, por id. Lidos do arquivo em blocos, e não
+        pelo memory-map, para que as páginas lidas não fiquem no RSS do processo.
+        """
+        node_ids = set(node_ids)
+        embeddings = {}
+        for shard_dir in self._shard_dirs_for(filters):
+            shard = self._load(shard_dir)
+            rows = np.array([i for i in self._matching_rows(shard.records, filters) if shard.ids[i] in node_ids], dtype=np.int64)
+            if not len(rows):
+                continue
+            try:
+                blocks = list(self._read_rows(shard_dir / f"vectors-{shard.generation}.npy", rows))
+            except FileNotFoundError:
+                # Geração já apagada por duas escritas seguidas: o memory-map continua válido
+                blocks = [np.asarray(shard.vectors[rows])]
+            for i, vector in zip(rows, itertools.chain.from_iterable(blocks)):
+                embeddings[shard.ids[i]] = vector.tolist()
+        return embeddings
+
+    def clear(self) -> None:
+        self._remove(self._all_shard_dirs(), lambda node_id, record: True)
+
+    def storage_stats(self) -> dict:
+        """
+        Chunks e bytes ocupados pelos vetores exatos e pela cópia quantizada, e os
+        bytes em disco da geração atual de cada shard (vetores, cópia e metadados).
+        """
+        stats = {
+            "shards": 0, "chunks": 0, "dim": 0, "dtype": self.dtype,
+            "float32_bytes": 0, "quantized_bytes": 0, "disk_bytes": 0,
+        }
+        for shard_dir in self._all_shard_dirs():
+            shard = self._load(shard_dir)
+            if not shard.ids:
+                continue
+            generation = (shard_dir / "CURRENT").read_text().strip()
+            stats["disk_bytes"] += sum(p.stat().st_size for p in shard_dir.glob(f"*-{generation}.*"))
+            stats["shards"] += 1
+            stats["chunks"] += len(shard.ids)
+            stats["dim"] = shard.vectors.shape[1]
+            stats["float32_bytes"] += shard.vectors.nbytes
+            if shard.codes is not None:
+                stats["quantized_bytes"] += shard.codes.nbytes + (shard.scales.nbytes if shard.scales is not None else 0)
+        return stats
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        q = _normalize(np.array([query.query_embedding], dtype=np.float32))[0]
+        node_ids = set(query.node_ids) if query.node_ids else None
+
+        all_scores = []
+        shards = []
+        for shard_dir in self._shard_dirs_for(query.filters):
+            shard = self._load(shard_dir)
+            if not shard.ids:
+                continue
+
+            rows = self._matching_rows(shard.records, query.filters)
+            if node_ids is not None:
+                rows = np.array([i for i in rows if shard.ids[i] in node_ids], dtype=np.int64)
+            if len(rows) == 0:
+                continue
+
+            all_rows = len(rows) == len(shard.ids)
+            if shard.codes is not None:
+                scores = approximate_scores(shard.codes, shard.scales, None if all_rows else rows, q)
+            else:
+                scores = shard.vectors @ q if all_rows else shard.vectors[rows] @ q
+            all_scores.append(scores)
+            shards.append((shard, rows))
+
+        if not all_scores:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        scores = np.concatenate(all_scores)
+        offsets = np.cumsum([len(rows) for _, rows in shards])
+
+        def locate(position):
+            index = int(np.searchsorted(offsets, position, side="right"))
+            shard, rows = shards[index]
+            return shard, int(rows[position - (offsets[index - 1] if index else 0)])
+
+        quantized = any(shard.codes is not None for shard, _ in shards)
+        k = min(query.similarity_top_k * (self.oversample if quantized else 1), len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+
+        if quantized:
+            # Repontua os candidatos com os vetores exatos
+            for position in top:
+                shard, i = locate(position)
+                scores[position] = float(shard.vectors[i] @ q)
+            top = top[np.argsort(-scores[top])][:query.similarity_top_k]
+        else:
+            top = top[np.argsort(-scores[top])]
+
+        nodes, similarities, result_ids = [], [], []
+        for position in top:
+            shard, i = locate(position)
+            nodes.append(metadata_dict_to_node(shard.records[i]))
+            similarities.append(float(scores[position]))
+            result_ids.append(shard.ids[i])
+
+        return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=result_ids)
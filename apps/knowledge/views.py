@@ -1,16 +1,66 @@
+import time
+import zipfile
 from pathlib import Path
 
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from django.core.cache import cache
+from django.core.files import File
 from django.core.files.storage import FileSystemStorage
 from django.conf import settings
 
-from .models import Knowledge, Message
-from .serializers import KnowledgeSerializer, KnowledgeUploadSerializer, MessageSerializer
-from .tasks import ingest_pdf_and_create_knowledge
-from .rag_service import RAG_Service 
+from .models import IngestionJob, Knowledge, Message
+from .serializers import (
+    IngestionJobSerializer,
+    KnowledgeBulkUploadSerializer,
+    KnowledgeSerializer,
+    KnowledgeUploadSerializer,
+    MessageSerializer,
+    ZIP_CONTENT_TYPES,
+)
+from .corpus import NO_ANSWER_MESSAGE, get_corpus, is_empty
+
+# As tasks e o RAG (llama_index, chromadb, openai) são importados dentro das views que
+# os usam: carregá-los aqui atrasaria o início de todo processo Django, inclusive
+# migrate, testes e workers web que nunca consultam o RAG
+
+
+def _get_upload_storage():
+    upload_dir = Path(settings.MEDIA_ROOT) / 'knowledge_uploads'
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    return FileSystemStorage(location=upload_dir)
+
+
+def _save_bulk_files(files):
+    """Salva os PDFs enviados (soltos ou dentro de ZIPs) e devolve caminho e título de cada um."""
+    storage = _get_upload_storage()
+    saved = []
+
+    def save(name, content):
+        saved_name = storage.save(name, content)
+        saved.append({"file_path": storage.path(saved_name), "title": Path(name).stem})
+
+    for uploaded_file in files:
+        if uploaded_file.content_type not in ZIP_CONTENT_TYPES:
+            save(uploaded_file.name, uploaded_file)
+            continue
+
+        with zipfile.ZipFile(uploaded_file) as archive:
+            for info in archive.infolist():
+                # Usa só o nome do arquivo: ignora diretórios do ZIP e evita path traversal
+                name = Path(info.filename).name
+                if info.is_dir() or info.filename.startswith('__MACOSX/') or not name.lower().endswith('.pdf'):
+                    continue
+                with archive.open(info) as content:
+                    save(name, File(content, name=name))
+
+    return saved
+
+
+def _elapsed_ms(started: float) -> int:
+    return round((time.monotonic() - started) * 1000)
 
 
 class KnowledgeViewSet(viewsets.ModelViewSet):
@@ -35,6 +85,14 @@ class KnowledgeViewSet(viewsets.ModelViewSet):
         #Associa automaticamente o usuário ao criar um conhecimento
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        # Soft delete; os chunks saem do vector store em segundo plano
+        instance.is_deleted = True
+        instance.save(update_fields=['is_deleted', 'updated_at'])
+        from .tasks import delete_knowledge_chunks
+
+        delete_knowledge_chunks.delay(user_id=instance.user_id, knowledge_id=str(instance.id))
+
     @action(detail=False, methods=['post'], url_path='upload', permission_classes=[IsAuthenticated])
     def upload(self, request):
         """
@@ -47,13 +105,12 @@ class KnowledgeViewSet(viewsets.ModelViewSet):
         uploaded_file = serializer.validated_data['file']
         title = serializer.validated_data.get('title') or Path(uploaded_file.name).stem
 
-        upload_dir = Path(settings.MEDIA_ROOT) / 'knowledge_uploads'
-        upload_dir.mkdir(parents=True, exist_ok=True)
-
-        storage = FileSystemStorage(location=upload_dir)
+        storage = _get_upload_storage()
         saved_name = storage.save(uploaded_file.name, uploaded_file)
         file_path = storage.path(saved_name)
 
+        from .tasks import ingest_pdf_and_create_knowledge
+
         task = ingest_pdf_and_create_knowledge.delay(
             user_id=request.user.id,
             title=title,
@@ -67,6 +124,73 @@ class KnowledgeViewSet(viewsets.ModelViewSet):
             status=status.HTTP_202_ACCEPTED,
         )
 
+    @action(detail=True, methods=['put'], url_path='file', permission_classes=[IsAuthenticated])
+    def replace_file(self, request, pk=None):
+        """
+        Substitui o PDF de um Knowledge por uma nova versão. A task re-embedda só os
+        chunks que mudaram e troca a versão antiga pela nova de uma vez.
+        """
+        knowledge = self.get_object()
+
+        serializer = KnowledgeUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        uploaded_file = serializer.validated_data['file']
+        storage = _get_upload_storage()
+        saved_name = storage.save(uploaded_file.name, uploaded_file)
+
+        from .tasks import update_knowledge_file
+
+        update_knowledge_file.delay(
+            knowledge_id=str(knowledge.id),
+            user_id=request.user.id,
+            file_path=storage.path(saved_name),
+        )
+
+        return Response(
+            {
+                "detail": "Atualização iniciada"
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=False, methods=['post'], url_path='bulk-upload', permission_classes=[IsAuthenticated])
+    def bulk_upload(self, request):
+        """
+        Recebe vários PDFs e/ou arquivos ZIP com PDFs e dispara a ingestão em lote.
+        O progresso agregado fica disponível em /api/knowledge/bulk-upload/{job_id}/.
+        """
+        serializer = KnowledgeBulkUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        files = _save_bulk_files(serializer.validated_data['files'])
+        if not files:
+            return Response(
+                {"detail": "Nenhum PDF encontrado nos arquivos enviados."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        job = IngestionJob.objects.create(user=request.user, total=len(files))
+        from .tasks import dispatch_bulk_ingestion
+
+        dispatch_bulk_ingestion(job, files)
+
+        return Response(
+            {
+                "detail": "Ingestão em lote iniciada",
+                "job": IngestionJobSerializer(job).data,
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=False, methods=['get'], url_path=r'bulk-upload/(?P<job_id>[^/.]+)', permission_classes=[IsAuthenticated])
+    def bulk_upload_status(self, request, job_id=None):
+        """Progresso agregado de uma ingestão em lote."""
+        job = IngestionJob.objects.filter(pk=job_id, user=request.user).first()
+        if job is None:
+            return Response({"detail": "Ingestão não encontrada."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(IngestionJobSerializer(job).data, status=status.HTTP_200_OK)
+
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
@@ -80,6 +204,7 @@ class MessageViewSet(viewsets.ModelViewSet):
 
     def create(self, request, *args, **kwargs):
         """Cria mensagem do usuário, consulta RAG e cria mensagem de resposta do sistema."""
+        started = time.monotonic()
 
         serializer = self.get_serializer(data=request.data)
 
@@ -88,22 +213,67 @@ class MessageViewSet(viewsets.ModelViewSet):
                 serializer.errors,
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+        if is_empty(get_corpus(request.user.id)):
+            # Sem documentos não há o que buscar: responde sem embedding nem LLM
+            user_message = serializer.save(
+                user=request.user,
+                author='user'
+            )
+            system_message = Message.objects.create(
+                user=request.user,
+                content=NO_ANSWER_MESSAGE,
+                author='system',
+                reply_to=user_message,
+                latency_ms=_elapsed_ms(started),
+                no_documents=True
+            )
+            return Response(
+                {
+                    "system_message": MessageSerializer(system_message).data,
+                },
+                status=status.HTTP_201_CREATED
+            )
+
+        if self._async_requested(request):
+            # Não segura o worker web durante a chamada ao LLM: a resposta vem por /reply/
+            user_message = serializer.save(
+                user=request.user,
+                author='user',
+                status='pending'
+            )
+            from .tasks import answer_message
+
+            answer_message.delay(str(user_message.id))
+            return Response(
+                {
+                    "user_message": MessageSerializer(user_message).data,
+                },
+                status=status.HTTP_202_ACCEPTED
+            )
         
         user_message = serializer.save(
             user=request.user,
             author='user'
         )
         
+        from .rag_service import RAG_Service
+
         try:
+            usage = {}
             rag_response = RAG_Service.answer_question(
                 question=user_message.content,
-                user_id=str(request.user.id)
+                user_id=str(request.user.id),
+                usage=usage
             )
             
             system_message = Message.objects.create(
                 user=request.user,
                 content=rag_response,
-                author='system'
+                author='system',
+                reply_to=user_message,
+                latency_ms=_elapsed_ms(started),
+                **usage
             )
             
             system_serializer = MessageSerializer(system_message)
@@ -117,7 +287,9 @@ class MessageViewSet(viewsets.ModelViewSet):
             
         except Exception as e:
             # Se houver erro no RAG, ainda retorna a mensagem do usuário criada
-            # mas adiciona informação do erro
+            # mas adiciona informação do erro; a falha entra no painel de uso
+            user_message.status = 'failed'
+            user_message.save(update_fields=['status', 'updated_at'])
             user_serializer = MessageSerializer(user_message)
             return Response(
                 {
@@ -126,4 +298,62 @@ class MessageViewSet(viewsets.ModelViewSet):
                     "error": f"Erro ao consultar RAG: {str(e)}"
                 },
                 status=status.HTTP_201_CREATED
-            )
\ No newline at end of file
+            )
+
+
+    @staticmethod
+    def _async_requested(request):
+        value = request.query_params.get('async')
+        if value is None:
+            return settings.MESSAGE_ASYNC_ANSWERS
+        return value.lower() in ('1', 'true', 'yes')
+
+    @action(detail=True, methods=['get'], url_path='reply')
+    def reply(self, request, pk=None):
+        """
+        Resposta de uma pergunta enviada no modo assíncrono. Com `?wait=N` a requisição
+        espera até N segundos (limitado a MESSAGE_REPLY_MAX_WAIT, 0 por padrão) pela
+        resposta (long-poll); sem ele, devolve o estado atual imediatamente.
+        """
+        message = self.get_object()
+
+        try:
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            return Response({"detail": "wait deve ser um número de segundos."}, status=status.HTTP_400_BAD_REQUEST)
+        deadline = time.monotonic() + min(max(wait, 0), settings.MESSAGE_REPLY_MAX_WAIT)
+
+        # Enquanto espera, consulta só a chave no cache que a task grava ao terminar
+        from .tasks import message_status_cache_key
+
+        status_key = message_status_cache_key(message.id)
+        while message.status == 'pending' and cache.get(status_key) is None and time.monotonic() < deadline:
+            time.sleep(settings.MESSAGE_REPLY_POLL_INTERVAL)
+        message.refresh_from_db(fields=['status'])
+
+        if message.status == 'pending':
+            return Response(
+                {
+                    "user_message": MessageSerializer(message).data,
+                    "system_message": None,
+                },
+                status=status.HTTP_202_ACCEPTED
+            )
+
+        system_message = message.replies.filter(author='system').order_by('-created_at').first()
+        data = {
+            "user_message": MessageSerializer(message).data,
+            "system_message": MessageSerializer(system_message).data if system_message else None,
+        }
+        if message.status == 'failed':
+            data["error"] = "Erro ao consultar RAG"
+        return Response(data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def embedding_stats(request):
+    """Contadores de micro-batching de embeddings do processo que atendeu a requisição."""
+    from .embeddings import get_embedding_stats
+
+    return Response(get_embedding_stats(), status=status.HTTP_200_OK)
@@ -0,0 +1,29 @@
+import logging
+import time
+
+from .memory import current_rss_mb
+
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """
+    Carrega a pilha do RAG (llama_index, chromadb, openai, pypdf) e o tokenizer usado na
+    divisão em chunks, sem abrir conexões. Chamado antes do fork (gunicorn --preload,
+    worker_init do Celery), o custo é pago uma vez e as páginas são compartilhadas
+    entre os processos filhos; sem isso, cada processo paga na primeira requisição.
+    """
+    start = time.perf_counter()
+
+    import pypdf  # noqa: F401
+    from llama_index.core import Settings
+
+    from . import rag_service, tasks  # noqa: F401
+
+    Settings.tokenizer
+
+    logger.info(
+        "Pilha do RAG carregada em %.2fs (RSS %.1f MB)",
+        time.perf_counter() - start, current_rss_mb(),
+    )
@@ -1,8 +1,12 @@
+import logging
 import os
 
 from celery import Celery
+from celery.signals import task_postrun, task_prerun, worker_init
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
+logger = logging.getLogger(__name__)
+
 app = Celery("config")
 
 app.config_from_object("django.conf:settings", namespace="CELERY")
@@ -10,6 +14,32 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
 
 
+@worker_init.connect
+def warm_up_rag(**kwargs):
+    # No processo principal, antes do fork do pool: os filhos já nascem com a pilha carregada
+    from apps.knowledge.warmup import warm_up
+
+    warm_up()
+
+
+@task_prerun.connect
+def reset_task_peak_rss(task_id=None, task=None, **kwargs):
+    from apps.knowledge.memory import reset_peak_rss
+
+    reset_peak_rss()
+
+
+@task_postrun.connect
+def log_task_peak_rss(task_id=None, task=None, state=None, **kwargs):
+    from apps.knowledge.memory import current_rss_mb, peak_rss_mb
+
+    # Com o pool prefork cada processo roda uma task por vez, então o pico é o da task
+    logger.info(
+        "Task %s [%s] %s: pico de RSS %.1f MB, RSS atual %.1f MB",
+        task.name if task else "?", task_id, state, peak_rss_mb(), current_rss_mb(),
+    )
+
+
 @app.task(bind=True)
 def debug_task(self):
     return f"Celery is alive! Request: {self.request!r}"
@@ -55,7 +55,7 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.accounts.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -203,3 +203,120 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+
+# Embeddings
+# EMBEDDING_BACKEND: "openai" (API) ou "onnx" (modelo local em CPU via onnxruntime)
+EMBEDDING_BACKEND = config('EMBEDDING_BACKEND', default='openai')
+EMBEDDING_MODEL = config('EMBEDDING_MODEL', default='text-embedding-3-small')
+# Dimensões pedidas à API (modelos text-embedding-3 aceitam vetores truncados); vazio = dimensão completa
+EMBEDDING_DIMENSIONS = config('EMBEDDING_DIMENSIONS', default='', cast=lambda v: int(v) if v else None)
+ONNX_EMBEDDING_MODEL_PATH = config('ONNX_EMBEDDING_MODEL_PATH', default='')
+ONNX_EMBEDDING_TOKENIZER_PATH = config('ONNX_EMBEDDING_TOKENIZER_PATH', default='')
+ONNX_EMBEDDING_MAX_LENGTH = config('ONNX_EMBEDDING_MAX_LENGTH', default=256, cast=int)
+ONNX_EMBEDDING_BATCH_SIZE = config('ONNX_EMBEDDING_BATCH_SIZE', default=32, cast=int)
+ONNX_EMBEDDING_MAX_WAIT_MS = config('ONNX_EMBEDDING_MAX_WAIT_MS', default=5, cast=float)
+ONNX_EMBEDDING_THREADS = config('ONNX_EMBEDDING_THREADS', default=4, cast=int)
+ONNX_EMBEDDING_WORKERS = config('ONNX_EMBEDDING_WORKERS', default=2, cast=int)
+
+# Micro-batching dos embeddings de perguntas (backend openai)
+QUERY_EMBEDDING_BATCHING = config('QUERY_EMBEDDING_BATCHING', default=True, cast=bool)
+QUERY_EMBEDDING_MAX_BATCH_SIZE = config('QUERY_EMBEDDING_MAX_BATCH_SIZE', default=16, cast=int)
+QUERY_EMBEDDING_MAX_WAIT_MS = config('QUERY_EMBEDDING_MAX_WAIT_MS', default=5, cast=float)
+QUERY_EMBEDDING_WORKERS = config('QUERY_EMBEDDING_WORKERS', default=4, cast=int)
+
+# OpenAI: ritmo (RPM/TPM), concorrência e retries compartilhados entre processos via Redis
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/2')
+LLM_MODEL = config('LLM_MODEL', default='gpt-4o-mini')
+OPENAI_EMBEDDING_RPM = config('OPENAI_EMBEDDING_RPM', default=3000, cast=int)
+OPENAI_EMBEDDING_TPM = config('OPENAI_EMBEDDING_TPM', default=1000000, cast=int)
+OPENAI_CHAT_RPM = config('OPENAI_CHAT_RPM', default=500, cast=int)
+OPENAI_CHAT_TPM = config('OPENAI_CHAT_TPM', default=200000, cast=int)
+OPENAI_MAX_CONCURRENCY = config('OPENAI_MAX_CONCURRENCY', default=16, cast=int)
+OPENAI_MAX_RETRIES = config('OPENAI_MAX_RETRIES', default=6, cast=int)
+OPENAI_RETRY_MAX_BACKOFF = config('OPENAI_RETRY_MAX_BACKOFF', default=60, cast=float)
+
+# Cache (Redis); em testes usa memória local
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+}
+if 'test' in sys.argv or 'pytest' in sys.argv:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Tempo (s) que o usuário autenticado fica em cache entre requisições
+USER_CACHE_TTL = config('USER_CACHE_TTL', default=60, cast=int)
+
+# Ingestão em lote: PDFs por task do chord
+BULK_INGESTION_BATCH_SIZE = config('BULK_INGESTION_BATCH_SIZE', default=20, cast=int)
+# Limites de um envio em lote, conferidos no índice dos ZIPs antes de extrair qualquer arquivo
+BULK_UPLOAD_MAX_FILES = config('BULK_UPLOAD_MAX_FILES', default=200, cast=int)
+BULK_UPLOAD_MAX_FILE_SIZE = config('BULK_UPLOAD_MAX_FILE_SIZE', default=50 * 1024 * 1024, cast=int)
+BULK_UPLOAD_MAX_TOTAL_SIZE = config('BULK_UPLOAD_MAX_TOTAL_SIZE', default=500 * 1024 * 1024, cast=int)
+
+# Vector store: "http" (servidor ChromaDB), "persistent" (ChromaDB embutido no processo)
+# ou "numpy" (matrizes float32 mapeadas em memória, um shard por usuário)
+VECTOR_STORE_BACKEND = config('VECTOR_STORE_BACKEND', default='http')
+CHROMADB_PATH = config('CHROMADB_PATH', default=str(BASE_DIR / 'chroma_data'))
+NUMPY_VECTOR_STORE_PATH = config('NUMPY_VECTOR_STORE_PATH', default=str(BASE_DIR / 'vector_store'))
+# Precisão da cópia usada na varredura do backend numpy (float32, float16 ou int8) e quantos
+# candidatos por resultado são repontuados com os vetores exatos
+NUMPY_VECTOR_STORE_DTYPE = config('NUMPY_VECTOR_STORE_DTYPE', default='float32')
+NUMPY_VECTOR_STORE_OVERSAMPLE = config('NUMPY_VECTOR_STORE_OVERSAMPLE', default=4, cast=int)
+# Shards (com textos e metadados) mantidos em memória por processo; os menos usados saem primeiro
+NUMPY_VECTOR_STORE_CACHE_SHARDS = config('NUMPY_VECTOR_STORE_CACHE_SHARDS', default=64, cast=int)
+
+# Roteamento por documento: a pergunta primeiro escolhe os DOCUMENT_ROUTING_TOP_N documentos mais
+# próximos no índice de resumos e só então busca chunks dentro deles (0 desativa)
+DOCUMENT_ROUTING_TOP_N = config('DOCUMENT_ROUTING_TOP_N', default=0, cast=int)
+# Páginas por resumo de seção (0 gera só o resumo do documento inteiro)
+DOCUMENT_SECTION_PAGES = config('DOCUMENT_SECTION_PAGES', default=10, cast=int)
+
+# Respostas assíncronas: POST /api/message/ devolve 202 e a resposta é gerada por uma task
+# na fila MESSAGE_ANSWER_QUEUE (também ativável por requisição com ?async=true)
+MESSAGE_ASYNC_ANSWERS = config('MESSAGE_ASYNC_ANSWERS', default=False, cast=bool)
+MESSAGE_ANSWER_QUEUE = config('MESSAGE_ANSWER_QUEUE', default='answers')
+# Espera máxima (s) do long-poll em /api/message/{id}/reply/?wait=N e intervalo entre verificações.
+# Desligado por padrão: a espera prende um worker web síncrono; só ative com workers gevent/ASGI
+MESSAGE_REPLY_MAX_WAIT = config('MESSAGE_REPLY_MAX_WAIT', default=0, cast=float)
+MESSAGE_REPLY_POLL_INTERVAL = config('MESSAGE_REPLY_POLL_INTERVAL', default=0.25, cast=float)
+MESSAGE_REPLY_CACHE_TTL = 10 * 60
+CELERY_TASK_ROUTES = {
+    'apps.knowledge.tasks.answer_message': {'queue': MESSAGE_ANSWER_QUEUE},
+}
+
+# Tempo (s) que o descritor do corpus de cada usuário (documentos, chunks, versão) fica em cache
+CORPUS_CACHE_TTL = config('CORPUS_CACHE_TTL', default=300, cast=int)
+
+# Ingestão em janelas: páginas lidas, embeddadas e gravadas por vez, o que limita a memória
+# do worker independentemente do tamanho do PDF
+INGESTION_PAGE_WINDOW = config('INGESTION_PAGE_WINDOW', default=32, cast=int)
+# Reciclagem dos processos do worker: após N tasks ou quando o RSS passar do limite (KiB),
+# o processo é substituído ao fim da task atual
+CELERY_WORKER_MAX_TASKS_PER_CHILD = config('CELERY_WORKER_MAX_TASKS_PER_CHILD', default=50, cast=int)
+CELERY_WORKER_MAX_MEMORY_PER_CHILD = config('CELERY_WORKER_MAX_MEMORY_PER_CHILD', default=512000, cast=int)
+
+# Agregação periódica de uso (perguntas, latência, tokens e cache) por usuário e dia para o
+# painel do admin; requer `celery -A config beat`
+USAGE_ROLLUP_INTERVAL = config('USAGE_ROLLUP_INTERVAL', default=300, cast=int)
+CELERY_BEAT_SCHEDULE = {
+    'rollup-usage': {
+        'task': 'apps.knowledge.tasks.rollup_usage',
+        'schedule': USAGE_ROLLUP_INTERVAL,
+    },
+}
+
+# Carrega a pilha do RAG ao iniciar o WSGI/ASGI (com `gunicorn --preload`, uma vez no processo
+# mestre, antes do fork). Desligado, cada processo a carrega só na primeira view que usa o RAG
+RAG_WARMUP = config('RAG_WARMUP', default=False, cast=bool)
+
+# Decomposição de perguntas compostas: o LLM divide a pergunta em até SUBQUESTION_MAX
+# sub-perguntas, buscadas em paralelo e respondidas em uma única síntese. Só perguntas com
+# marcadores de comparação, várias interrogações ou dois títulos de documentos são divididas
+SUBQUESTION_DECOMPOSITION = config('SUBQUESTION_DECOMPOSITION', default=False, cast=bool)
+SUBQUESTION_MAX = config('SUBQUESTION_MAX', default=4, cast=int)